@@ -0,0 +1,197 @@
+# agreement_engine.py
+from itertools import combinations
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+
+# ---------- string interning ----------
+
+class Interner:
+    """Maps concept / triple strings to dense integer ids (shared across slides)."""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.strings: List[str] = []
+
+    def intern(self, s: str) -> int:
+        i = self.ids.get(s)
+        if i is None:
+            i = len(self.strings)
+            self.ids[s] = i
+            self.strings.append(s)
+        return i
+
+    def intern_many(self, items: Iterable[str]) -> List[int]:
+        return [self.intern(s) for s in items]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+# ---------- slide × model incidence ----------
+
+class SlideModelIncidence:
+    """
+    Binary incidence matrix with one row per (slide, model) and one column per
+    (slide, item). Columns are slide-local, so X @ X.T is block-diagonal and its
+    (a, b) entry inside a slide block is |items_a ∩ items_b| for that slide.
+    """
+
+    def __init__(self, models: Sequence[str], interner: Optional[Interner] = None):
+        self.models = list(models)
+        self.interner = interner if interner is not None else Interner()
+        self.n_slides = 0
+        self._rows: List[np.ndarray] = []
+        self._items: List[np.ndarray] = []
+        self._weights: List[np.ndarray] = []
+
+    @property
+    def n_models(self) -> int:
+        return len(self.models)
+
+    def add_slide(self, per_model: Dict[str, Iterable[str]]) -> int:
+        """
+        Register one slide; per_model maps model -> items (missing models are empty).
+        Items may also be given as {item: weight} (e.g. triple confidences); plain
+        iterables get weight 1.0. Duplicate items keep their largest weight.
+        """
+        base = self.n_slides * self.n_models
+        rows, items, weights = [], [], []
+        for mi, m in enumerate(self.models):
+            got = per_model.get(m) or []
+            ids: Dict[int, float] = {}
+            pairs = got.items() if isinstance(got, dict) else ((x, 1.0) for x in got)
+            for x, wt in pairs:
+                i = self.interner.intern(x)
+                ids[i] = max(ids.get(i, wt), wt)
+            rows.extend([base + mi] * len(ids))
+            items.extend(ids.keys())
+            weights.extend(ids.values())
+        self._rows.append(np.asarray(rows, dtype=np.int64))
+        self._items.append(np.asarray(items, dtype=np.int64))
+        self._weights.append(np.asarray(weights, dtype=np.float64))
+        self.n_slides += 1
+        return self.n_slides - 1
+
+    def _coo(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(rows, slide-local cols, item ids, weights) for every stored entry."""
+        if not self._rows or not sum(len(r) for r in self._rows):
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, np.zeros(0, dtype=np.float64)
+        rows = np.concatenate(self._rows)
+        items = np.concatenate(self._items)
+        weights = np.concatenate(self._weights)
+        # slide-local columns: unique (slide, item) pairs
+        slide_of_row = rows // self.n_models
+        key = slide_of_row * max(len(self.interner), 1) + items
+        _, cols = np.unique(key, return_inverse=True)
+        return rows, cols.ravel(), items, weights
+
+    def matrix(self, weighted: bool = False) -> sparse.csr_matrix:
+        """Binary incidence (or stored item weights if weighted=True)."""
+        n_rows = self.n_slides * self.n_models
+        rows, cols, _, weights = self._coo()
+        if not len(rows):
+            return sparse.csr_matrix((n_rows, 0), dtype=np.float64 if weighted else np.int64)
+        data = weights if weighted else np.ones(len(rows), dtype=np.int64)
+        return sparse.csr_matrix((data, (rows, cols)), shape=(n_rows, int(cols.max()) + 1))
+
+    def columns(self) -> Tuple[np.ndarray, np.ndarray]:
+        """(slide index, item id) for every matrix column, in column order."""
+        rows, cols, items, _ = self._coo()
+        n_cols = int(cols.max()) + 1 if len(cols) else 0
+        col_slide = np.zeros(n_cols, dtype=np.int64)
+        col_item = np.zeros(n_cols, dtype=np.int64)
+        col_slide[cols] = rows // self.n_models
+        col_item[cols] = items
+        return col_slide, col_item
+
+    def sizes(self) -> np.ndarray:
+        """Set size per (slide, model), shape (n_slides, n_models)."""
+        counts = np.zeros(self.n_slides * self.n_models, dtype=np.int64)
+        for r in self._rows:
+            np.add.at(counts, r, 1)
+        return counts.reshape(self.n_slides, self.n_models)
+
+    def pair_intersections(self, pairs: Sequence[Tuple[int, int]]) -> np.ndarray:
+        """|items_a ∩ items_b| for every slide and model-index pair, shape (n_slides, n_pairs)."""
+        if self.n_slides == 0 or not pairs:
+            return np.zeros((self.n_slides, len(pairs)), dtype=np.int64)
+        X = self.matrix()
+        G = (X @ X.T).tocsr()
+        base = (np.arange(self.n_slides, dtype=np.int64) * self.n_models)[:, None]
+        pa = np.asarray([a for a, _ in pairs], dtype=np.int64)[None, :]
+        pb = np.asarray([b for _, b in pairs], dtype=np.int64)[None, :]
+        ra = (base + pa).ravel()
+        rb = (base + pb).ravel()
+        inter = np.asarray(G[ra, rb]).ravel()
+        return inter.reshape(self.n_slides, len(pairs))
+
+# ---------- bulk metrics ----------
+
+def model_pairs(models: Sequence[str]) -> List[Tuple[int, int]]:
+    """Index pairs in the same order as itertools.combinations(models, 2)."""
+    return list(combinations(range(len(models)), 2))
+
+def bulk_jaccard(inter: np.ndarray, size_a: np.ndarray, size_b: np.ndarray,
+                 min_size: int = 0) -> np.ndarray:
+    """Vectorized counterpart of analyze_model_agreement_multi.jaccard."""
+    union = size_a + size_b - inter
+    out = np.zeros(inter.shape, dtype=np.float64)
+    ok = (union > 0) & (size_a >= min_size) & (size_b >= min_size)
+    out[ok] = inter[ok] / union[ok]
+    return out
+
+def bulk_f1(inter: np.ndarray, size_a: np.ndarray, size_b: np.ndarray,
+            min_size: int = 1) -> np.ndarray:
+    """Vectorized counterpart of analyze_model_agreement_multi.triple_f1."""
+    out = np.zeros(inter.shape, dtype=np.float64)
+    ok = (size_a >= max(min_size, 1)) & (size_b >= max(min_size, 1)) & (inter > 0)
+    prec = inter[ok] / size_a[ok]
+    rec = inter[ok] / size_b[ok]
+    out[ok] = 2 * prec * rec / (prec + rec)
+    return out
+
+def pairwise_metrics(conc: SlideModelIncidence, trip: SlideModelIncidence,
+                     min_concepts: int = 2, min_triples: int = 1
+                     ) -> Tuple[List[Tuple[int, int]], np.ndarray, np.ndarray]:
+    """
+    All pairwise concept Jaccard / triple F1 values for every slide.
+    Returns (pairs, concept_jaccard, triple_f1) with arrays of shape (n_slides, n_pairs).
+    """
+    pairs = model_pairs(conc.models)
+    pa = [a for a, _ in pairs]
+    pb = [b for _, b in pairs]
+
+    cs = conc.sizes()
+    cj = bulk_jaccard(conc.pair_intersections(pairs), cs[:, pa], cs[:, pb], min_size=min_concepts)
+
+    ts = trip.sizes()
+    tf = bulk_f1(trip.pair_intersections(pairs), ts[:, pa], ts[:, pb], min_size=min_triples)
+    return pairs, cj, tf
+
+def group_means(keys: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sum/count/mean of values per integer group key (keys in [0, max])."""
+    n_groups = int(keys.max()) + 1 if len(keys) else 0
+    sums = np.bincount(keys, weights=values, minlength=n_groups)
+    counts = np.bincount(keys, minlength=n_groups)
+    means = sums / np.maximum(counts, 1)
+    return sums, counts, means
+
+def group_spread(keys: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact sample std (ddof=1, 0.0 for singletons) and median of values per group key."""
+    n_groups = int(keys.max()) + 1 if len(keys) else 0
+    std = np.zeros(n_groups, dtype=np.float64)
+    med = np.zeros(n_groups, dtype=np.float64)
+    if not n_groups:
+        return std, med
+    order = np.lexsort((values, keys))
+    k_sorted, v_sorted = keys[order], values[order]
+    bounds = np.searchsorted(k_sorted, np.arange(n_groups + 1))
+    for g in range(n_groups):
+        v = v_sorted[bounds[g]:bounds[g + 1]]
+        if len(v):
+            med[g] = np.median(v)
+        if len(v) > 1:
+            std[g] = v.std(ddof=1)
+    return std, med
@@ -4,28 +4,23 @@ import os, csv
 from typing import Dict, List, Tuple
 import matplotlib.pyplot as plt
 
+from shared_config import log_line
+
+SCRIPT = "analyze_and_visualize_agreement"
+
 ROOT = os.path.abspath(".")
 MILU = os.path.join(ROOT, "MILU23")
 DATA_DIR = os.path.join(MILU, "data")
 ANALYSIS_DIR = os.path.join(DATA_DIR, "analysis")
 FIG_DIR = os.path.join(ANALYSIS_DIR, "figures")
-LOG_DIR = os.path.join(MILU, "logs")
 
 os.makedirs(FIG_DIR, exist_ok=True)
-os.makedirs(LOG_DIR, exist_ok=True)
-PIPELINE_LOG = os.path.join(LOG_DIR, "pipeline.log")
-
-
-def log(msg: str) -> None:
-    print(msg)
-    with open(PIPELINE_LOG, "a", encoding="utf-8") as f:
-        f.write(msg + "\n")
 
 
 def main() -> None:
     csv_path = os.path.join(ANALYSIS_DIR, "lecture_level_agreement.csv")
     if not os.path.isfile(csv_path):
-        log(f"❌ lecture_level_agreement.csv not found: {csv_path}")
+        log_line(SCRIPT, f"❌ lecture_level_agreement.csv not found: {csv_path}")
         return
 
     lecture_data: Dict[int, Dict[str, List[Tuple[float, float]]]] = {}
@@ -75,7 +70,7 @@ def main() -> None:
     plt.savefig(fig_path, dpi=300)
     plt.close()
 
-    log(f"✅ Saved lecture trend figure to {fig_path}")
+    log_line(SCRIPT, f"✅ Saved lecture trend figure to {fig_path}")
 
 
 if __name__ == "__main__":
@@ -1,13 +1,26 @@
 # analyze_model_agreement_multi.py
 import os, json, csv, re
-from itertools import combinations
-from typing import List, Dict, Any, Tuple
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 from shared_config import BY_SLIDE_DIR, ANALYSIS_DIR, SELECTED_MODELS, log_line
-from fuse_models_multi import extract_concepts, extract_triples
+from fuse_models_multi import extract_concepts, extract_triples, term_interners
+from agreement_engine import (Interner, SlideModelIncidence, model_pairs, pairwise_metrics,
+                              group_means, group_spread)
+from streaming_stats import RunningStats
 
 SCRIPT = "analyze_model_agreement_multi"
 
+# Option C filter: a pair only scores when both sides have at least this much
+MIN_CONCEPTS = 2
+MIN_TRIPLES = 1
+
+# Score one lecture at a time with running accumulators
+# (one lecture of slides in memory; means, std and median columns exact).
+# False = load the whole corpus and aggregate in bulk.
+STREAMING = True
+
 def safe_jload(path: str):
     try:
         with open(path, "r", encoding="utf-8") as f:
@@ -30,6 +43,8 @@ def list_slide_jsons(lec_dir: str) -> List[str]:
         key=lambda x: int(re.findall(r"\d+", x)[-1])
     )
 
+# Scalar reference versions (kept for evaluate_superlearner and spot checks
+# against the vectorized engine in agreement_engine.py)
 def jaccard(a: List[str], b: List[str]) -> float:
     sa, sb = set(a), set(b)
     if not sa and not sb:
@@ -49,117 +64,246 @@ def triple_f1(a: List[str], b: List[str]) -> float:
         return 0.0
     return 2 * prec * rec / (prec + rec)
 
-def main():
-    os.makedirs(ANALYSIS_DIR, exist_ok=True)
-    slide_csv   = os.path.join(ANALYSIS_DIR, "slide_level_agreement.csv")
-    lecture_csv = os.path.join(ANALYSIS_DIR, "lecture_level_agreement.csv")
-    pair_csv    = os.path.join(ANALYSIS_DIR, "model_pair_overall.csv")
-
-    slide_rows: List[Dict[str, Any]] = []
-    total_pairs = 0
+def load_slide_sets(models: List[str], lectures: Optional[List[str]] = None,
+                    interners: Tuple[Optional[Interner], Optional[Interner]] = (None, None)
+                    ) -> Tuple[List[Tuple[str, str]], SlideModelIncidence, SlideModelIncidence]:
+    """
+    Read by_slide records once (all lectures by default) and intern concepts/triples per model.
+    interners: (concept, triple) interners, e.g. canonicalizing ones for fuzzy matching.
+    """
+    meta: List[Tuple[str, str]] = []
+    conc = SlideModelIncidence(models, interners[0])
+    trip = SlideModelIncidence(models, interners[1])
 
-    for lec in list_lectures(BY_SLIDE_DIR):
+    for lec in (lectures if lectures is not None else list_lectures(BY_SLIDE_DIR)):
         lec_dir = os.path.join(BY_SLIDE_DIR, lec)
         for sf in list_slide_jsons(lec_dir):
             p = os.path.join(lec_dir, sf)
             j = safe_jload(p)
             if not j or "models" not in j:
                 continue
-            models = j["models"]
+            md_all = j["models"]
 
-            conc = {}
-            trip = {}
-            for m in SELECTED_MODELS:
-                md = models.get(m, {})
+            c_sets, t_sets = {}, {}
+            for m in models:
+                md = md_all.get(m, {})
                 if not isinstance(md, dict):
                     continue
-                conc[m] = extract_concepts(md)
-                trip[m] = extract_triples(md)
-
-            for a, b in combinations(SELECTED_MODELS, 2):
-                ca, cb = conc.get(a, []), conc.get(b, [])
-                ta, tb = trip.get(a, []), trip.get(b, [])
-
-                # --- Filtering (Option C) ---
-                # Only compute if both sides have "reasonable" content
-                cj = jaccard(ca, cb) if (len(ca) >= 2 and len(cb) >= 2) else 0.0
-                tf = triple_f1(ta, tb) if (len(ta) >= 1 and len(tb) >= 1) else 0.0
-
-                slide_rows.append({
-                    "lecture": j.get("lecture"),
-                    "slide_id": j.get("slide_id"),
-                    "model_a": a,
-                    "model_b": b,
-                    "concept_jaccard": cj,
-                    "triple_f1": tf,
-                })
-                total_pairs += 1
+                c_sets[m] = extract_concepts(md)
+                t_sets[m] = extract_triples(md)
+
+            conc.add_slide(c_sets)
+            trip.add_slide(t_sets)
+            meta.append((j.get("lecture"), j.get("slide_id")))
+
+    return meta, conc, trip
+
+def lecture_index(lec: str) -> int:
+    return int(re.findall(r"\d+", lec)[-1])
+
+SLIDE_FIELDS = ["lecture", "slide_id", "model_a", "model_b",
+                "concept_jaccard", "triple_f1"]
+LECTURE_FIELDS = ["lecture", "lecture_index",
+                  "model_a", "model_b",
+                  "avg_concept_jaccard", "avg_triple_f1", "n_slides",
+                  "std_concept_jaccard", "median_concept_jaccard",
+                  "std_triple_f1", "median_triple_f1"]
+PAIR_FIELDS = ["model_a", "model_b",
+               "avg_concept_jaccard", "avg_triple_f1", "n_slide_pairs",
+               "std_concept_jaccard", "median_concept_jaccard",
+               "std_triple_f1", "median_triple_f1"]
+
+def write_slide_rows(w: csv.DictWriter, meta: List[Tuple[str, str]], models: List[str],
+                     pairs: List[Tuple[int, int]], cj: np.ndarray, tf: np.ndarray) -> None:
+    for si, (lec, slide_id) in enumerate(meta):
+        for pi, (a, b) in enumerate(pairs):
+            w.writerow({
+                "lecture": lec,
+                "slide_id": slide_id,
+                "model_a": models[a],
+                "model_b": models[b],
+                "concept_jaccard": float(cj[si, pi]),
+                "triple_f1": float(tf[si, pi]),
+            })
+
+def sorted_pair_order(models: List[str], pairs: List[Tuple[int, int]]) -> List[int]:
+    return sorted(range(len(pairs)), key=lambda pi: (models[pairs[pi][0]], models[pairs[pi][1]]))
+
+def write_agreement_csvs(meta: List[Tuple[str, str]], models: List[str],
+                         pairs: List[Tuple[int, int]], cj: np.ndarray, tf: np.ndarray,
+                         slide_csv: str, lecture_csv: str, pair_csv: str) -> None:
+    n_slides, n_pairs = cj.shape
+    pair_order = sorted_pair_order(models, pairs)
 
     # --- slide-level CSV ---
     with open(slide_csv, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(
-            f, fieldnames=["lecture", "slide_id", "model_a", "model_b",
-                           "concept_jaccard", "triple_f1"]
-        )
+        w = csv.DictWriter(f, fieldnames=SLIDE_FIELDS)
         w.writeheader()
-        for r in slide_rows:
-            w.writerow(r)
+        write_slide_rows(w, meta, models, pairs, cj, tf)
 
     # --- lecture-level aggregation ---
-    lec_agg: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    lectures = sorted({lec for lec, _ in meta}, key=lecture_index)
+    lec_id = {lec: i for i, lec in enumerate(lectures)}
+    slide_lec = np.asarray([lec_id[lec] for lec, _ in meta], dtype=np.int64)
+    lec_keys = (slide_lec[:, None] * n_pairs + np.arange(n_pairs)[None, :]).ravel()
 
-    for r in slide_rows:
-        key = (r["lecture"], r["model_a"], r["model_b"])
-        lec_agg.setdefault(key, {"sum_cj": 0.0, "sum_tf": 0.0, "n": 0})
-        lec_agg[key]["sum_cj"] += float(r["concept_jaccard"])
-        lec_agg[key]["sum_tf"] += float(r["triple_f1"])
-        lec_agg[key]["n"] += 1
+    _, lec_n, lec_cj = group_means(lec_keys, cj.ravel())
+    _, _, lec_tf = group_means(lec_keys, tf.ravel())
+    lec_cj_std, lec_cj_med = group_spread(lec_keys, cj.ravel())
+    lec_tf_std, lec_tf_med = group_spread(lec_keys, tf.ravel())
 
     with open(lecture_csv, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(
-            f,
-            fieldnames=["lecture", "lecture_index",
-                        "model_a", "model_b",
-                        "avg_concept_jaccard", "avg_triple_f1", "n_slides"]
-        )
+        w = csv.DictWriter(f, fieldnames=LECTURE_FIELDS)
         w.writeheader()
-        for (lec, ma, mb), v in sorted(
-            lec_agg.items(),
-            key=lambda kv: (int(re.findall(r"\d+", kv[0][0])[-1]), kv[0][1], kv[0][2])
-        ):
-            n = max(v["n"], 1)
-            idx = int(re.findall(r"\d+", lec)[-1])
-            w.writerow({
-                "lecture": lec,
-                "lecture_index": idx,
-                "model_a": ma,
-                "model_b": mb,
-                "avg_concept_jaccard": v["sum_cj"] / n,
-                "avg_triple_f1": v["sum_tf"] / n,
-                "n_slides": v["n"],
-            })
+        for li, lec in enumerate(lectures):
+            for pi in pair_order:
+                k = li * n_pairs + pi
+                a, b = pairs[pi]
+                w.writerow({
+                    "lecture": lec,
+                    "lecture_index": lecture_index(lec),
+                    "model_a": models[a],
+                    "model_b": models[b],
+                    "avg_concept_jaccard": float(lec_cj[k]),
+                    "avg_triple_f1": float(lec_tf[k]),
+                    "n_slides": int(lec_n[k]),
+                    "std_concept_jaccard": float(lec_cj_std[k]),
+                    "median_concept_jaccard": float(lec_cj_med[k]),
+                    "std_triple_f1": float(lec_tf_std[k]),
+                    "median_triple_f1": float(lec_tf_med[k]),
+                })
 
     # --- overall model-pair aggregation (for one main table) ---
-    pair_agg: Dict[Tuple[str, str], Dict[str, Any]] = {}
-    for r in slide_rows:
-        key = (r["model_a"], r["model_b"])
-        pair_agg.setdefault(key, {"sum_cj": 0.0, "sum_tf": 0.0, "n": 0})
-        pair_agg[key]["sum_cj"] += float(r["concept_jaccard"])
-        pair_agg[key]["sum_tf"] += float(r["triple_f1"])
-        pair_agg[key]["n"] += 1
+    pair_keys = np.tile(np.arange(n_pairs), n_slides)
+    _, pair_n, pair_cj = group_means(pair_keys, cj.ravel())
+    _, _, pair_tf = group_means(pair_keys, tf.ravel())
+    pair_cj_std, pair_cj_med = group_spread(pair_keys, cj.ravel())
+    pair_tf_std, pair_tf_med = group_spread(pair_keys, tf.ravel())
 
     with open(pair_csv, "w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
-        w.writerow(["model_a", "model_b",
-                    "avg_concept_jaccard", "avg_triple_f1", "n_slide_pairs"])
-        for (ma, mb), v in sorted(pair_agg.items()):
-            n = max(v["n"], 1)
-            w.writerow([ma, mb, v["sum_cj"]/n, v["sum_tf"]/n, v["n"]])
+        w.writerow(PAIR_FIELDS)
+        if n_slides:
+            for pi in pair_order:
+                a, b = pairs[pi]
+                w.writerow([models[a], models[b],
+                            float(pair_cj[pi]), float(pair_tf[pi]), int(pair_n[pi]),
+                            float(pair_cj_std[pi]), float(pair_cj_med[pi]),
+                            float(pair_tf_std[pi]), float(pair_tf_med[pi])])
+
+# ---------- streaming mode ----------
+
+def stream_agreement(models: List[str], slide_csv: str, lecture_csv: str, pair_csv: str,
+                     interners: Tuple[Optional[Interner], Optional[Interner]] = (None, None)) -> int:
+    """
+    One lecture in memory at a time: slide rows are written as each lecture is
+    scored and only running accumulators (Welford + value counts for the
+    median) are kept. All columns match the batch path.
+    """
+    pairs = model_pairs(models)
+    pair_order = sorted_pair_order(models, pairs)
+    lec_acc: Dict[Tuple[str, int], Tuple[RunningStats, RunningStats]] = {}
+    pair_acc = [(RunningStats(), RunningStats()) for _ in pairs]
+    total_pairs = 0
+
+    with open(slide_csv, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=SLIDE_FIELDS)
+        w.writeheader()
+        for lec in list_lectures(BY_SLIDE_DIR):
+            meta, conc, trip = load_slide_sets(models, lectures=[lec], interners=interners)
+            if not meta:
+                continue
+            _, cj, tf = pairwise_metrics(conc, trip,
+                                         min_concepts=MIN_CONCEPTS, min_triples=MIN_TRIPLES)
+            write_slide_rows(w, meta, models, pairs, cj, tf)
+            f.flush()
+
+            for si, (lec_name, _) in enumerate(meta):
+                for pi in range(len(pairs)):
+                    c, t = float(cj[si, pi]), float(tf[si, pi])
+                    acc = lec_acc.get((lec_name, pi))
+                    if acc is None:
+                        acc = lec_acc[(lec_name, pi)] = (RunningStats(), RunningStats())
+                    acc[0].push(c)
+                    acc[1].push(t)
+                    pair_acc[pi][0].push(c)
+                    pair_acc[pi][1].push(t)
+            total_pairs += cj.size
+
+    with open(lecture_csv, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=LECTURE_FIELDS)
+        w.writeheader()
+        for lec in sorted({k[0] for k in lec_acc}, key=lecture_index):
+            for pi in pair_order:
+                a, b = pairs[pi]
+                c_acc, t_acc = lec_acc[(lec, pi)]
+                w.writerow({
+                    "lecture": lec,
+                    "lecture_index": lecture_index(lec),
+                    "model_a": models[a],
+                    "model_b": models[b],
+                    "avg_concept_jaccard": c_acc.mean,
+                    "avg_triple_f1": t_acc.mean,
+                    "n_slides": c_acc.n,
+                    "std_concept_jaccard": c_acc.std,
+                    "median_concept_jaccard": c_acc.median,
+                    "std_triple_f1": t_acc.std,
+                    "median_triple_f1": t_acc.median,
+                })
+
+    with open(pair_csv, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(PAIR_FIELDS)
+        if total_pairs:
+            for pi in pair_order:
+                a, b = pairs[pi]
+                c_acc, t_acc = pair_acc[pi]
+                w.writerow([models[a], models[b], c_acc.mean, t_acc.mean, c_acc.n,
+                            c_acc.std, c_acc.median, t_acc.std, t_acc.median])
+
+    return total_pairs
+
+# ---------- pair ranking ----------
+
+def log_pair_extremes(pair_csv: str) -> None:
+    """Most / least similar model pairs by corpus-average concept Jaccard and triple F1."""
+    with open(pair_csv, "r", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        return
+    for kind, col in (("concepts", "avg_concept_jaccard"), ("triples", "avg_triple_f1")):
+        ranked = sorted(rows, key=lambda r: -float(r[col]))
+        top, bottom = ranked[0], ranked[-1]
+        log_line(SCRIPT, f"[{kind}] most similar:  {top['model_a']} vs {top['model_b']} ({float(top[col]):.3f})")
+        log_line(SCRIPT, f"[{kind}] least similar: {bottom['model_a']} vs {bottom['model_b']} ({float(bottom[col]):.3f})")
+
+def main():
+    os.makedirs(ANALYSIS_DIR, exist_ok=True)
+    slide_csv   = os.path.join(ANALYSIS_DIR, "slide_level_agreement.csv")
+    lecture_csv = os.path.join(ANALYSIS_DIR, "lecture_level_agreement.csv")
+    pair_csv    = os.path.join(ANALYSIS_DIR, "model_pair_overall.csv")
+
+    models = list(SELECTED_MODELS)
+    # canonicalizing interners when TERM_MATCHING == "fuzzy" (shared across lectures)
+    _, conc_interner, trip_interner = term_interners()
+    interners = (conc_interner, trip_interner)
+
+    if STREAMING:
+        total_pairs = stream_agreement(models, slide_csv, lecture_csv, pair_csv, interners)
+    else:
+        meta, conc, trip = load_slide_sets(models, interners=interners)
+        # --- Filtering (Option C) ---
+        # Only compute if both sides have "reasonable" content
+        pairs, cj, tf = pairwise_metrics(conc, trip,
+                                         min_concepts=MIN_CONCEPTS, min_triples=MIN_TRIPLES)
+        total_pairs = cj.size
+        write_agreement_csvs(meta, models, pairs, cj, tf, slide_csv, lecture_csv, pair_csv)
 
     log_line(SCRIPT, f"✅ Slide-level saved to: {slide_csv}")
     log_line(SCRIPT, f"✅ Lecture-level saved to: {lecture_csv}")
     log_line(SCRIPT, f"✅ Overall pair summary saved to: {pair_csv}")
     log_line(SCRIPT, f"✅ Total slide pairs analyzed: {total_pairs}")
+    log_pair_extremes(pair_csv)
 
 if __name__ == "__main__":
     main()
@@ -3,6 +3,7 @@ import os, re, json
 from typing import List, Dict, Any
 
 from shared_config import MILU, BY_SLIDE_DIR, SELECTED_MODELS, log_line
+from output_store import OutputReader
 
 SCRIPT = "build_by_slide"
 
@@ -29,13 +30,6 @@ def list_slides(lec_dir: str) -> List[str]:
             out.append(int(idxs[-1]))
     return sorted(set(out))
 
-def load_model_file(path: str) -> Any:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return None
-
 def main():
     total_slides = 0
     lectures = list_lectures(MILU)
@@ -53,6 +47,9 @@ def main():
 
         log_line(SCRIPT, f"Processing {lec} — {len(slides)} slides")
 
+        # per-slide files and/or JSONL shards (shard records win)
+        outputs = OutputReader(os.path.join(lec_dir, "Outputs"))
+
         for sid in slides:
             slide_id = f"Slide{sid}"
             img_path = os.path.join(lec_dir, "Images", f"{slide_id}.JPG")
@@ -68,12 +65,8 @@ def main():
 
             models_block: Dict[str, Any] = {}
             for model in SELECTED_MODELS:
-                m_dir = os.path.join(lec_dir, "Outputs", model)
-                c_path = os.path.join(m_dir, "concepts", f"{slide_id}.json")
-                t_path = os.path.join(m_dir, "triples",  f"{slide_id}.json")
-
-                c_obj = load_model_file(c_path) if os.path.exists(c_path) else None
-                t_obj = load_model_file(t_path) if os.path.exists(t_path) else None
+                c_obj, c_path = outputs.get(model, "concepts", slide_id)
+                t_obj, t_path = outputs.get(model, "triples", slide_id)
 
                 entry: Dict[str, Any] = {}
                 if c_obj is not None:
@@ -112,6 +105,11 @@ def main():
 
             total_slides += 1
 
+        if outputs.unreadable:
+            log_line(SCRIPT, f"⚠️ {lec}: {len(outputs.unreadable)} output files could not be read "
+                             f"(truncated write?), e.g. {outputs.unreadable[0]}")
+        outputs.close()
+
     log_line(SCRIPT, f"✅ Done. Built {total_slides} slide JSON files into by_slide/")
     log_line(SCRIPT, f"Location: {BY_SLIDE_DIR}")
 
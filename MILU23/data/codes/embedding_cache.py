@@ -0,0 +1,95 @@
+# embedding_cache.py
+import json, os
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+# Projected visual tokens (vision tower + projector output) per slide image.
+# They do not depend on the prompt, so the concepts and triples prompts and
+# every prompt-engineering iteration can share them. One .npz per entry
+# under <root>/<key[:2]>/; the cache is capped at max_bytes and evicts the
+# least recently used entries (by file mtime, which get() refreshes, so the
+# order survives restarts and is shared by processes on the same cache).
+
+ENTRY_EXT = ".npz"
+
+class EmbeddingCache:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        os.makedirs(root, exist_ok=True)
+        self._lru: "OrderedDict[str, int]" = OrderedDict()   # key -> bytes, oldest first
+        found: List[Tuple[float, str, int]] = []
+        for sub in os.listdir(root):
+            d = os.path.join(root, sub)
+            if not os.path.isdir(d):
+                continue
+            for f in os.listdir(d):
+                if f.endswith(ENTRY_EXT):
+                    st = os.stat(os.path.join(d, f))
+                    found.append((st.st_mtime, f[:-len(ENTRY_EXT)], st.st_size))
+        for _, key, size in sorted(found):
+            self._lru[key] = size
+        self.total_bytes = sum(self._lru.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ENTRY_EXT)
+
+    def get(self, key: str) -> Optional[Tuple[List[np.ndarray], Any]]:
+        """(arrays, spec) stored by put(), or None."""
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                spec = json.loads(str(z["__spec__"]))
+                arrays = [z[f"a{i}"] for i in range(spec["n"])]
+            os.utime(path)
+        except (OSError, ValueError, KeyError):
+            self._lru.pop(key, None)
+            self.misses += 1
+            return None
+        if key not in self._lru:
+            self._lru[key] = os.path.getsize(path)
+            self.total_bytes += self._lru[key]
+        self._lru.move_to_end(key)
+        self.hits += 1
+        return arrays, spec["spec"]
+
+    def put(self, key: str, arrays: List[np.ndarray], spec: Any) -> None:
+        """Store arrays plus a JSON-serialisable spec describing how to rebuild the caller's output."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.savez(f, __spec__=np.array(json.dumps({"n": len(arrays), "spec": spec})),
+                         **{f"a{i}": np.ascontiguousarray(a) for i, a in enumerate(arrays)})
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        self.total_bytes -= self._lru.pop(key, 0)
+        self._lru[key] = os.path.getsize(path)
+        self.total_bytes += self._lru[key]
+        self._evict()
+
+    def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes and len(self._lru) > 1:
+            key, size = self._lru.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.unlink(self._path(key))
+                self.evicted += 1
+            except OSError:
+                pass
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        used = f"{self.total_bytes / 1e9:.2f}/{self.max_bytes / 1e9:.2f} GB"
+        return f"{self.hits}/{total} hits, {self.evicted} evicted, {used}" if total else f"unused, {used}"
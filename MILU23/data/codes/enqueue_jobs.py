@@ -0,0 +1,49 @@
+# enqueue_jobs.py
+import os, re
+from typing import List
+
+from shared_config import MILU, JOB_QUEUE_DB, log_line
+from job_queue import JobQueue, lecture_jobs
+
+SCRIPT = "enqueue_jobs"
+
+# Which lectures / model families to queue. Models, prompts and gen kwargs come
+# from each lecture's own runner script, so queued work matches `python
+# <family>_code_to_compare_models.py` run in that lecture.
+LECTURES = None                      # None = every "Lecture N" directory
+FAMILIES = ["qwen", "intern", "llava", "idefics2"]
+MAX_ATTEMPTS = 3
+RETRY_FAILED = False                 # also reset jobs that already used up their attempts
+
+def list_lectures(base: str) -> List[str]:
+    out = []
+    for name in os.listdir(base):
+        p = os.path.join(base, name)
+        if name.lower().startswith("lecture ") and os.path.isdir(p):
+            out.append(name)
+    out.sort(key=lambda x: int(re.findall(r"\d+", x)[-1]))
+    return out
+
+def main():
+    q = JobQueue(JOB_QUEUE_DB)
+    lectures = LECTURES or list_lectures(MILU)
+
+    found = added = 0
+    for lec in lectures:
+        jobs = lecture_jobs(os.path.join(MILU, lec), FAMILIES)
+        n = q.enqueue(jobs, max_attempts=MAX_ATTEMPTS)
+        found += len(jobs)
+        added += n
+        if jobs:
+            log_line(SCRIPT, f"{lec}: {len(jobs)} jobs ({n} new)")
+
+    if RETRY_FAILED:
+        log_line(SCRIPT, f"Reset {q.retry_failed()} failed jobs to pending")
+
+    log_line(SCRIPT, f"✅ {added} new jobs queued ({found} total seen) in {JOB_QUEUE_DB}")
+    for (model, status), n in sorted(q.counts().items()):
+        log_line(SCRIPT, f"  {model:<45} {status:<8} {n}")
+    q.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# image_router.py
+import os
+from typing import Any, Dict
+
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+
+# Decides per slide whether the image is worth sending with the prompt. The
+# prompts only accept terms found verbatim in SLIDE_TEXT (post_filter_parsed
+# enforces it), so for blank slides and plain text/bullet slides the image
+# mostly costs encoder time. Figures, scans and photos keep the image.
+#
+# Statistics come from one 512px thumbnail (~20 ms per slide on CPU):
+#   contrast  std of gray levels — near-blank slides are almost flat
+#   ink       share of pixels away from the background level
+#   dense     share of CELL×CELL cells mostly covered by ink; text strokes at
+#             thumbnail scale leave most of a cell background, pictures don't
+#   figure    share of ink in connected components spanning > FIGURE_SPAN of
+#             both image sides; glyphs are small, plots and line drawings aren't
+#   color     Hasler–Süsstrunk colourfulness
+# Thresholds err towards keeping the image: on MILU23, slides with a logo or a
+# large bracket in an equation stay "visual".
+ROUTER_VERSION = 1            # bump when the rule or thresholds change (part of resume hashes)
+THUMB = 512
+BLANK_CONTRAST = 6.0          # below: near-blank slide
+BLANK_INK = 0.01
+TEXT_MAX_DENSE = 0.04         # a text-only slide has at most this share of dense cells,
+TEXT_MAX_FIGURE = 0.05        # this share of ink in figure-sized components
+TEXT_MAX_COLOR = 25.0         # and this colourfulness
+INK_DELTA = 40                # gray-level distance from background that counts as ink
+CELL = 32
+FIGURE_SPAN = 0.10
+
+def image_stats(path: str) -> Dict[str, float]:
+    with Image.open(path) as im:
+        im = im.convert("RGB")
+        im.thumbnail((THUMB, THUMB), Image.BILINEAR)
+        rgb = np.asarray(im, dtype=np.float32)
+    gray = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    hist = np.bincount(gray.astype(np.uint8).ravel(), minlength=256)
+    background = float(np.argmax(hist))
+    ink = np.abs(gray - background) > INK_DELTA
+
+    h, w = (ink.shape[0] // CELL) * CELL, (ink.shape[1] // CELL) * CELL
+    if h and w:
+        cells = ink[:h, :w].reshape(h // CELL, CELL, w // CELL, CELL).mean(axis=(1, 3))
+        dense = float((cells > 0.5).mean())
+    else:
+        dense = 0.0
+
+    figure = 0.0
+    labels, n = ndimage.label(ink, structure=np.ones((3, 3), dtype=bool))
+    if n:
+        big = [i + 1 for i, (ys, xs) in enumerate(ndimage.find_objects(labels))
+               if ys.stop - ys.start > FIGURE_SPAN * ink.shape[0] and xs.stop - xs.start > FIGURE_SPAN * ink.shape[1]]
+        if big:
+            figure = float(np.isin(labels, big).sum() / ink.sum())
+
+    rg = rgb[..., 0] - rgb[..., 1]
+    yb = 0.5 * (rgb[..., 0] + rgb[..., 1]) - rgb[..., 2]
+    color = float(np.hypot(rg.std(), yb.std()) + 0.3 * np.hypot(rg.mean(), yb.mean()))
+    return {"contrast": float(gray.std()), "ink": float(ink.mean()), "dense": dense, "figure": figure, "color": color}
+
+def classify(stats: Dict[str, float]) -> str:
+    """'blank' | 'text' | 'visual'."""
+    if stats["contrast"] < BLANK_CONTRAST or stats["ink"] < BLANK_INK:
+        return "blank"
+    if (stats["dense"] <= TEXT_MAX_DENSE and stats["figure"] <= TEXT_MAX_FIGURE
+            and stats["color"] <= TEXT_MAX_COLOR):
+        return "text"
+    return "visual"
+
+def router_config() -> Dict[str, Any]:
+    """What a routed run depends on besides the image (goes into input hashes)."""
+    return {"router": ROUTER_VERSION, "thumb": THUMB, "blank": [BLANK_CONTRAST, BLANK_INK],
+            "text": [TEXT_MAX_DENSE, TEXT_MAX_FIGURE, TEXT_MAX_COLOR], "ink": INK_DELTA, "cell": CELL,
+            "span": FIGURE_SPAN}
+
+class ImageRouter:
+    """
+    mode: "always" (image every call, the original behaviour), "auto"
+    (image only for slides classified "visual") or "never" (text-only).
+    Decisions are cached per image path.
+    """
+
+    MODES = ("always", "auto", "never")
+
+    def __init__(self, mode: str = "always"):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown image routing mode {mode!r} (expected one of {self.MODES})")
+        self.mode = mode
+        self._cls: Dict[str, str] = {}
+        self.with_image = 0
+        self.text_only = 0
+
+    def classify(self, img_path: str) -> str:
+        key = os.path.abspath(img_path)
+        if key not in self._cls:
+            self._cls[key] = classify(image_stats(img_path))
+        return self._cls[key]
+
+    def use_image(self, img_path: str) -> bool:
+        use = self.mode == "always" or (self.mode == "auto" and self.classify(img_path) == "visual")
+        if use:
+            self.with_image += 1
+        else:
+            self.text_only += 1
+        return use
+
+    def gen_kw(self, gen_kw: Dict[str, Any]) -> Dict[str, Any]:
+        """gen_kw to hash for resume/dedup: unchanged for "always", tagged with the routing otherwise."""
+        if self.mode == "always":
+            return gen_kw
+        return dict(gen_kw, image_routing=self.mode, **({"router": router_config()} if self.mode == "auto" else {}))
+
+    def summary(self) -> str:
+        total = self.with_image + self.text_only
+        return f"{self.text_only}/{total} calls text-only ({self.mode})" if total else f"unused ({self.mode})"
@@ -0,0 +1,135 @@
+# image_routing_eval.py
+import csv, os
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+from shared_config import MILU, ANALYSIS_DIR, log_line
+from job_queue import list_slides, load_runner_config
+from image_router import classify, image_stats
+from inference_engine import InferenceEngine
+from vlm_wrappers import family_for
+from qwen_resolution_sweep import agreement, list_lectures, sample_slides, timed_run
+
+SCRIPT = "image_routing_eval"
+
+# 1) Classifies every slide with image_router (CPU only) and writes
+#    image_routes.csv, so the share of slides IMAGE_ROUTING="auto" would send
+#    text-only is known before any GPU time is spent.
+# 2) If MODEL_ID is set, runs a sample of slides image+text and text-only and
+#    reports, per mode (always / auto / never): wall time, throughput gain
+#    over image+text, parse rate and agreement with the image+text output
+#    (concept Jaccard, triple F1). "auto" is assembled from the two runs —
+#    greedy decoding makes its image calls identical to the image+text ones.
+MODEL_ID = "Qwen/Qwen3-VL-4B-Instruct"     # None = routing census only
+LECTURES = None                            # None = all
+N_SLIDES = 60
+SEED = 0
+
+OUT_ROUTES = os.path.join(ANALYSIS_DIR, "image_routes.csv")
+OUT_ROWS = os.path.join(ANALYSIS_DIR, "image_routing_eval_rows.csv")
+OUT_SUMMARY = os.path.join(ANALYSIS_DIR, "image_routing_eval.csv")
+
+def route_census(lectures: List[str]) -> Dict[Tuple[str, str], str]:
+    routes: Dict[Tuple[str, str], str] = {}
+    rows = []
+    for lec in lectures:
+        img_dir = os.path.join(MILU, lec, "Images")
+        if not os.path.isdir(img_dir):
+            continue
+        counts: Counter = Counter()
+        for f in list_slides(img_dir):
+            stats = image_stats(os.path.join(img_dir, f))
+            cls = classify(stats)
+            routes[(lec, f)] = cls
+            counts[cls] += 1
+            rows.append({"lecture": lec, "slide_id": os.path.splitext(f)[0], "class": cls,
+                         **{k: round(v, 4) for k, v in stats.items()}})
+        total = sum(counts.values())
+        if total:
+            log_line(SCRIPT, f"{lec}: {counts['text'] + counts['blank']}/{total} text-only "
+                             f"({counts['blank']} blank), {counts['visual']} with image")
+    if rows:
+        with open(OUT_ROUTES, "w", encoding="utf-8", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=list(rows[0]))
+            w.writeheader()
+            w.writerows(rows)
+    return routes
+
+def summarize(mode: str, rows: List[Dict[str, Any]], base_secs: float) -> Dict[str, Any]:
+    conc = [r["agreement"] for r in rows if r["prompt"] == "concepts" and r["agreement"] is not None]
+    trip = [r["agreement"] for r in rows if r["prompt"] == "triples" and r["agreement"] is not None]
+    secs = sum(r["latency_s"] for r in rows)
+    return {
+        "mode": mode,
+        "calls": len(rows),
+        "text_only_calls": sum(1 for r in rows if not r["image_used"]),
+        "total_s": round(secs, 2),
+        "calls_per_s": round(len(rows) / secs, 4) if secs else "",
+        "speedup": round(base_secs / secs, 3) if secs else "",
+        "parsed_ok_rate": round(float(np.mean([r["parsed_ok"] for r in rows])), 4),
+        "concept_jaccard_mean": round(float(np.mean(conc)), 4) if conc else "",
+        "triple_f1_mean": round(float(np.mean(trip)), 4) if trip else "",
+    }
+
+def main():
+    lectures = LECTURES or list_lectures(MILU)
+    routes = route_census(lectures)
+    n_text = sum(1 for c in routes.values() if c != "visual")
+    log_line(SCRIPT, f"✅ {n_text}/{len(routes)} slides would go text-only under IMAGE_ROUTING=\"auto\" → {OUT_ROUTES}")
+    if not MODEL_ID:
+        return
+
+    slides = sample_slides(lectures, N_SLIDES, SEED)
+    family = family_for(MODEL_ID)
+    cfg = load_runner_config(os.path.join(MILU, slides[0][0]), family)
+    prompts, gen_kw = cfg["prompts"], cfg["gen_kw"]
+    engine = InferenceEngine(MODEL_ID, family=family)
+    log_line(SCRIPT, f"✅ Loaded: {MODEL_ID} — {len(slides)} slides × {len(prompts)} prompts, image+text and text-only")
+
+    rows: List[Dict[str, Any]] = []
+    for lec, slide_file in slides:
+        lec_dir = os.path.join(MILU, lec)
+        for prompt_id, prompt_tpl in prompts.items():
+            ref, ref_secs = timed_run(engine, lec_dir, slide_file, prompt_id, prompt_tpl, gen_kw)
+            txt, txt_secs = timed_run(engine, lec_dir, slide_file, prompt_id, prompt_tpl, gen_kw, use_image=False)
+            cls = routes.get((lec, slide_file)) or classify(image_stats(os.path.join(lec_dir, "Images", slide_file)))
+            base = {"lecture": lec, "slide_id": ref["slide_id"], "prompt": prompt_id, "class": cls}
+            rows.append({**base, "run": "image", "image_used": True, "latency_s": round(ref_secs, 4),
+                         "parsed_ok": int(bool(ref["parsed"])), "agreement": agreement(prompt_id, ref, ref)})
+            rows.append({**base, "run": "text", "image_used": False, "latency_s": round(txt_secs, 4),
+                         "parsed_ok": int(bool(txt["parsed"])), "agreement": agreement(prompt_id, txt, ref)})
+    engine.unload()
+
+    with open(OUT_ROWS, "w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=list(rows[0]))
+        w.writeheader()
+        w.writerows(rows)
+
+    image_rows = [r for r in rows if r["run"] == "image"]
+    text_rows = [r for r in rows if r["run"] == "text"]
+    auto_rows = [r for r in rows if r["run"] == ("image" if r["class"] == "visual" else "text")]
+    base_secs = sum(r["latency_s"] for r in image_rows)
+    summary = [summarize("always", image_rows, base_secs),
+               summarize("auto", auto_rows, base_secs),
+               summarize("never", text_rows, base_secs)]
+    # where the router's choice matters: text-only agreement per slide class
+    for cls in ("blank", "text", "visual"):
+        sub = [r for r in text_rows if r["class"] == cls]
+        if sub:
+            summary.append(summarize(f"never[{cls}]", sub, sum(r["latency_s"] for r in image_rows
+                                                                 if r["class"] == cls)))
+    with open(OUT_SUMMARY, "w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=list(summary[0]))
+        w.writeheader()
+        w.writerows(summary)
+
+    for s in summary:
+        log_line(SCRIPT, f"{s['mode']:>14}: {s['calls']} calls ({s['text_only_calls']} text-only), "
+                         f"{s['speedup']}× throughput, concepts J={s['concept_jaccard_mean']}, "
+                         f"triples F1={s['triple_f1_mean']}, parsed {s['parsed_ok_rate']:.0%}")
+    log_line(SCRIPT, f"✅ Wrote {OUT_SUMMARY} and {OUT_ROWS}")
+
+if __name__ == "__main__":
+    main()
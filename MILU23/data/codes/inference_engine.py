@@ -0,0 +1,280 @@
+# inference_engine.py
+import datetime, os, time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+from PIL import Image
+
+from slide_parsing import safe_json_parse, post_filter_parsed
+from run_manifest import input_hashes
+from vlm_wrappers import family_for, load_wrapper
+from tensor_cache import TensorCache
+from embedding_cache import EmbeddingCache
+
+# The per-slide step of the lecture runners — read text, open image, generate,
+# parse, ground — behind one loaded model, for callers that are not a
+# lecture's own run() loop (queue workers, benchmarks). run_batch() sends
+# several slides per generate call, sized by MemoryPlanner, and splits a batch
+# in half and retries when it still runs out of GPU memory.
+
+# ---------- memory planning ----------
+BYTES = {torch.float32: 4, torch.float16: 2, torch.bfloat16: 2}
+ACT_FACTOR = 4 * 2            # hidden-sized tensors live per prefill token (residual, q/k/v/o), ×2 for the MLP input
+VISION_FACTOR = 24            # vision-encoder activations per visual token, in units of its hidden size
+SAFETY = 0.85                 # share of free GPU memory a batch may plan for
+MAX_BATCH = 8
+
+def read_text(path: str) -> str:
+    if not os.path.isfile(path):
+        return ""
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return f.read().strip()
+
+def is_oom(e: BaseException) -> bool:
+    return isinstance(e, torch.cuda.OutOfMemoryError) or (isinstance(e, RuntimeError) and "out of memory" in str(e))
+
+def _text_config(model):
+    cfg = model.config
+    for name in ("text_config", "llm_config"):
+        sub = getattr(cfg, name, None)
+        if sub is not None:
+            return sub
+    return cfg
+
+class MemoryPlanner:
+    """
+    Estimates the GPU memory one generate call needs on top of the weights:
+    KV cache for prompt + max_new_tokens, prefill activations (plus the full
+    attention matrix under eager attention), last-position logits and the
+    vision encoder's activations. Batches are padded to their longest member.
+    Estimates are multiplied by `scale`, which grows on every OOM and follows
+    the measured peak after each successful call. Without CUDA (or without a
+    torch model, as for the scripted backend) nothing is bounded and plan()
+    returns chunks of max_batch.
+    """
+
+    def __init__(self, model, max_batch: int = MAX_BATCH, safety: float = SAFETY):
+        self.max_batch = max_batch
+        self.safety = safety
+        self.scale = 1.0
+        if model is None:
+            self.device = torch.device("cpu")
+            return
+        tc = _text_config(model)
+        self.bytes = BYTES.get(getattr(model, "dtype", torch.float16), 2)
+        self.layers = tc.num_hidden_layers
+        self.heads = tc.num_attention_heads
+        self.kv_heads = getattr(tc, "num_key_value_heads", None) or self.heads
+        self.head_dim = getattr(tc, "head_dim", None) or tc.hidden_size // self.heads
+        self.hidden = tc.hidden_size
+        self.intermediate = getattr(tc, "intermediate_size", 4 * tc.hidden_size)
+        self.vocab = tc.vocab_size
+        self.eager = getattr(tc, "_attn_implementation", None) == "eager"
+        vc = getattr(model.config, "vision_config", None)
+        self.vit_hidden = getattr(vc, "hidden_size", 1024)
+        self.device = next(model.parameters()).device
+
+    def estimate(self, sizes: Sequence[Tuple[int, int]], max_new_tokens: int) -> int:
+        """Bytes for one call over (prompt tokens, visual tokens) per sequence."""
+        n = len(sizes)
+        prompt = max(p for p, _ in sizes)
+        vision = sum(v for _, v in sizes)
+        kv = 2 * self.layers * self.kv_heads * self.head_dim * (prompt + max_new_tokens)
+        act = prompt * (ACT_FACTOR * self.hidden + 3 * self.intermediate)
+        if self.eager:
+            act += self.heads * prompt * prompt
+        logits = 4 * self.vocab                     # float32 logits of the last position
+        per_seq = (kv + act) * self.bytes + logits
+        return int(self.scale * (n * per_seq + vision * VISION_FACTOR * self.vit_hidden * self.bytes))
+
+    def budget(self) -> Optional[int]:
+        if self.device.type != "cuda":
+            return None
+        free, _ = torch.cuda.mem_get_info(self.device)
+        reusable = torch.cuda.memory_reserved(self.device) - torch.cuda.memory_allocated(self.device)
+        return int((free + reusable) * self.safety)
+
+    def plan(self, sizes: Sequence[Tuple[int, int]], max_new_tokens: int) -> List[List[int]]:
+        """
+        Splits indices into consecutive chunks, each as large as the budget
+        allows (at least 1, at most max_batch). Sort sizes first so similar
+        lengths share a chunk and padding stays small.
+        """
+        budget = self.budget()
+        chunks: List[List[int]] = []
+        cur: List[int] = []
+        for i in range(len(sizes)):
+            cand = cur + [i]
+            fits = budget is None or self.estimate([sizes[j] for j in cand], max_new_tokens) <= budget
+            if cur and (len(cand) > self.max_batch or not fits):
+                chunks.append(cur)
+                cand = [i]
+            cur = cand
+        if cur:
+            chunks.append(cur)
+        return chunks
+
+    def on_oom(self) -> None:
+        self.scale *= 1.5
+
+    def observe(self, sizes: Sequence[Tuple[int, int]], max_new_tokens: int, peak_bytes: int) -> None:
+        """Calibrate scale from a measured peak (bytes above the pre-call allocation)."""
+        est = self.estimate(sizes, max_new_tokens) / self.scale
+        if est > 0 and peak_bytes > 0:
+            self.scale = max(self.scale * 0.9, peak_bytes / est, 0.25)
+
+class InferenceEngine:
+    """One loaded model; turns (lecture dir, slide, prompt) into a runner record."""
+
+    def __init__(self, model_id: str, device: Optional[str] = None, family: Optional[str] = None,
+                 tensor_cache_dir: Optional[str] = None, embed_cache_dir: Optional[str] = None,
+                 embed_cache_max_bytes: int = 20 * 10**9, max_batch: int = MAX_BATCH, **wrapper_kwargs):
+        self.model_id = model_id
+        self.model_safe = model_id.replace("/", "__")
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.family = family or family_for(model_id)
+        self.wrapper = load_wrapper(model_id, self.device, self.family, **wrapper_kwargs)
+        if tensor_cache_dir:
+            self.wrapper.tensor_cache = TensorCache(tensor_cache_dir)
+        if embed_cache_dir:
+            self.wrapper.embed_cache = EmbeddingCache(embed_cache_dir, embed_cache_max_bytes)
+        self.planner = MemoryPlanner(self.wrapper.model, max_batch=max_batch)
+        self.n_oom_splits = 0
+        # summed over generate calls; tokens / preprocess_s as reported by the backend's last_stats
+        self.stats = {"calls": 0, "sequences": 0, "prompt_tokens": 0, "new_tokens": 0, "generate_s": 0.0,
+                      "preprocess_s": 0.0, "parse_s": 0.0}
+
+    def _account(self, n_seq: int, secs: float) -> None:
+        st = getattr(self.wrapper, "last_stats", {})
+        self.stats["calls"] += 1
+        self.stats["sequences"] += n_seq
+        self.stats["prompt_tokens"] += int(st.get("prompt_tokens", 0))
+        self.stats["new_tokens"] += int(st.get("new_tokens", 0))
+        self.stats["generate_s"] += secs
+        self.stats["preprocess_s"] += float(st.get("preprocess_s", 0.0))
+
+    @staticmethod
+    def slide_inputs(lecture_dir: str, slide_file: str, prompt_tpl: str,
+                     gen_kw: Dict[str, Any]) -> Tuple[str, Dict[str, str]]:
+        """(slide text, input hashes) — enough to decide whether a unit is already done."""
+        slide_id = os.path.splitext(slide_file)[0]
+        txt_path = os.path.join(lecture_dir, "Texts", f"{slide_id}.txt")
+        if not os.path.exists(txt_path):
+            raise FileNotFoundError(f"Missing text for {slide_id}: {txt_path}")
+        slide_text = read_text(txt_path)
+        img_path = os.path.join(lecture_dir, "Images", slide_file)
+        return slide_text, input_hashes(img_path, slide_text, prompt_tpl, gen_kw)
+
+    def run_slide(self, lecture_dir: str, slide_file: str, prompt_id: str, prompt_tpl: str,
+                  gen_kw: Dict[str, Any], slide_text: Optional[str] = None,
+                  use_image: bool = True) -> Dict[str, Any]:
+        """use_image=False sends the prompt text-only (see image_router.py)."""
+        slide_id = os.path.splitext(slide_file)[0]
+        if slide_text is None:
+            slide_text = read_text(os.path.join(lecture_dir, "Texts", f"{slide_id}.txt"))
+        image = Image.open(os.path.join(lecture_dir, "Images", slide_file)).convert("RGB") if use_image else None
+        prompt_text = prompt_tpl.replace("<<SLIDE_TEXT>>", slide_text)
+
+        t0 = time.perf_counter()
+        raw = self.wrapper.generate(image=image, prompt_text=prompt_text, gen_kw=gen_kw)
+        self._account(1, time.perf_counter() - t0)
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+        return self._record(slide_id, prompt_id, slide_text, raw)
+
+    def _record(self, slide_id: str, prompt_id: str, slide_text: str, raw: str) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        parsed = safe_json_parse(raw)
+        if parsed:
+            parsed = post_filter_parsed(parsed, slide_text, prompt_id)
+        self.stats["parse_s"] += time.perf_counter() - t0
+        return {
+            "slide_id": slide_id,
+            "model": self.model_id,
+            "prompt": prompt_id,
+            "timestamp_utc": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "text_length": len(slide_text),
+            "raw_output": raw,
+            "parsed": parsed,
+        }
+
+    def _prompt_tokens(self, text: str) -> int:
+        return self.wrapper.count_tokens(text) + 32    # + chat template
+
+    def run_batch(self, items: List[Dict[str, Any]], gen_kw: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        items: dicts with lecture_dir, slide_file, prompt_id, prompt_tpl and
+        optionally slide_text / use_image (as for run_slide) and image (an
+        already opened RGB image, e.g. shared by several models). Returns one
+        record per item, in order. With-image and text-only items go in
+        separate calls; each group is sorted by size and cut into chunks by
+        the planner. An OOM halves the chunk and retries; a single slide
+        that still does not fit re-raises.
+        """
+        max_new = int(gen_kw.get("max_new_tokens", 256))
+        slides = []
+        for it in items:
+            slide_id = os.path.splitext(it["slide_file"])[0]
+            slide_text = it.get("slide_text")
+            if slide_text is None:
+                slide_text = read_text(os.path.join(it["lecture_dir"], "Texts", f"{slide_id}.txt"))
+            prompt_text = it["prompt_tpl"].replace("<<SLIDE_TEXT>>", slide_text)
+            img = it.get("image")
+            if img is None:
+                img = os.path.join(it["lecture_dir"], "Images", it["slide_file"])
+            if not it.get("use_image", True):
+                img, vis = None, 0
+            elif isinstance(img, Image.Image):
+                vis = self.wrapper.visual_tokens(img)
+            else:
+                with Image.open(img) as im:
+                    vis = self.wrapper.visual_tokens(im)
+            slides.append((slide_id, it["prompt_id"], slide_text, prompt_text, img,
+                           (self._prompt_tokens(prompt_text) + vis, vis)))
+
+        records: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        for with_image in (True, False):
+            group = sorted((i for i, s in enumerate(slides) if (s[4] is not None) == with_image),
+                           key=lambda i: slides[i][5])
+            for chunk in self.planner.plan([slides[i][5] for i in group], max_new):
+                idx = [group[j] for j in chunk]
+                outs = self._generate_split([slides[i] for i in idx], gen_kw, max_new)
+                for i, raw in zip(idx, outs):
+                    slide_id, prompt_id, slide_text = slides[i][:3]
+                    records[i] = self._record(slide_id, prompt_id, slide_text, raw)
+        return records
+
+    def _generate_split(self, slides: List[tuple], gen_kw: Dict[str, Any], max_new: int) -> List[str]:
+        cuda = self.planner.device.type == "cuda"
+        try:
+            if cuda:
+                base = torch.cuda.memory_allocated(self.planner.device)
+                torch.cuda.reset_peak_memory_stats(self.planner.device)
+            images = [s[4] if s[4] is None or isinstance(s[4], Image.Image) else Image.open(s[4]).convert("RGB")
+                      for s in slides]
+            t0 = time.perf_counter()
+            outs = self.wrapper.generate_batch(images, [s[3] for s in slides], gen_kw)
+            self._account(len(slides), time.perf_counter() - t0)
+            if cuda:
+                self.planner.observe([s[5] for s in slides], max_new,
+                                     torch.cuda.max_memory_allocated(self.planner.device) - base)
+            return outs
+        except Exception as e:
+            if not is_oom(e) or len(slides) == 1:
+                raise
+        finally:
+            if cuda:
+                torch.cuda.empty_cache()
+        # out of memory: the estimate was too low — be more careful and halve the batch
+        self.planner.on_oom()
+        self.n_oom_splits += 1
+        half = len(slides) // 2
+        return (self._generate_split(slides[:half], gen_kw, max_new)
+                + self._generate_split(slides[half:], gen_kw, max_new))
+
+    def unload(self) -> None:
+        self.wrapper = None
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
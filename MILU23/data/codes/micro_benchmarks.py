@@ -0,0 +1,272 @@
+# micro_benchmarks.py
+import datetime, glob, json, os, platform, statistics, time
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+from shared_config import MILU, ANALYSIS_DIR, BENCHMARK_DIR, log_line
+from job_queue import load_runner_config
+from slide_parsing import safe_json_parse, post_filter_parsed
+from fuse_models_multi import extract_concepts, extract_triples, canon_triple
+from analyze_model_agreement_multi import jaccard, triple_f1
+from scripted_backend import ScriptedVLM
+
+SCRIPT = "micro_benchmarks"
+
+# Timings for the per-slide analysis functions that model × prompt sweeps call
+# millions of times, on a generated corpus: real MILU23 slide texts (a pool of
+# N_TEXTS) and, per model, scripted_backend outputs for both runner prompts —
+# so every model answers differently, as in a real comparison.
+#
+# 1) Per-call benchmarks, pytest-benchmark style: WARMUP_ROUNDS, then ROUNDS
+#    rounds over N_CALLS generated inputs (repeated up to MIN_ROUND_S);
+#    min / median / mean / stddev per call and ops/s. Regressions are judged
+#    on the min, the least noisy of these.
+# 2) Scaling: the whole parse → extract → pairwise-agreement pass over
+#    SCALING_SIZES (models, slides); time per stage, and the log-log slope of
+#    each stage against its own work (model-slides, or model pairs × slides).
+#    A slope well above 1 means something went superlinear.
+# Times are also divided by a fixed pure-Python calibration loop, so numbers
+# from different machines can be compared. Both parts are checked against
+# micro_benchmarks_baseline.json next to this file; set UPDATE_BASELINE to
+# rewrite it after an intended change.
+N_TEXTS = 100
+N_CALLS = 2000
+WARMUP_ROUNDS = 1
+ROUNDS = 7
+MIN_ROUND_S = 0.05            # a round repeats the inputs until it lasts at least this long
+SCALING_SIZES: List[Tuple[int, int]] = [   # (models, slides)
+    (4, 100), (4, 300), (4, 1000), (4, 3000),
+    (2, 300), (8, 300), (16, 300), (32, 300),
+]
+# e.g. SCALING_SIZES += [(100, 10000)]   # a full 100-model sweep: ~5 min of parsing + 10^8 pair scores
+SEED = 0
+TOLERANCE = 0.25              # flag a per-call min time more than 25% above baseline (normalized)
+SLOPE_TOLERANCE = 0.15        # flag a scaling slope this much above baseline
+UPDATE_BASELINE = False
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_benchmarks_baseline.json")
+OUT_CALLS = os.path.join(ANALYSIS_DIR, "micro_benchmarks.csv")
+OUT_SCALING = os.path.join(ANALYSIS_DIR, "micro_benchmarks_scaling.csv")
+OUT_FIG = os.path.join(ANALYSIS_DIR, "fig_micro_benchmark_scaling.png")
+
+# ---------- corpus ----------
+
+class Corpus:
+    """raw[m][k][prompt] — model m's output for text k; slide i uses text i % N_TEXTS."""
+
+    def __init__(self, n_models: int, texts: List[str], prompts: Dict[str, str], gen_kw: Dict[str, Any]):
+        self.texts = texts
+        self.prompts = list(prompts)
+        self.raw: List[List[Dict[str, str]]] = []
+        for m in range(n_models):
+            vlm = ScriptedVLM(f"scripted/model-{m}", seed=SEED)
+            self.raw.append([{pid: vlm.generate(None, tpl.replace("<<SLIDE_TEXT>>", t), gen_kw)
+                              for pid, tpl in prompts.items()} for t in texts])
+
+def load_texts(n: int) -> List[str]:
+    paths = sorted(glob.glob(os.path.join(MILU, "Lecture *", "Texts", "*.txt")))
+    rng = np.random.default_rng(SEED)
+    out = []
+    for i in rng.permutation(len(paths)):
+        with open(paths[i], "r", encoding="utf-8", errors="ignore") as f:
+            t = f.read().strip()
+        if t:
+            out.append(t)
+        if len(out) == n:
+            break
+    return out
+
+# ---------- timing ----------
+
+def calibrate() -> float:
+    """Seconds for a fixed string / set / sort workload (best of 5)."""
+    words = [f"term{i % 997}-{i % 31}" for i in range(20000)]
+    best = float("inf")
+    for _ in range(5):
+        t0 = time.perf_counter()
+        s = set()
+        for w in words:
+            s.add(w.lower().strip())
+        sorted(s)
+        json.loads(json.dumps(words[:2000]))
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def bench(fn: Callable, calls: Sequence[tuple]) -> Dict[str, float]:
+    """pytest-benchmark-like stats (seconds per call) of fn(*args) over calls."""
+    t0 = time.perf_counter()
+    for _ in range(WARMUP_ROUNDS):
+        for args in calls:
+            fn(*args)
+    once = (time.perf_counter() - t0) / max(WARMUP_ROUNDS, 1)
+    reps = max(1, int(MIN_ROUND_S / once) + 1) if once > 0 else 1
+    per_call = []
+    for _ in range(ROUNDS):
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            for args in calls:
+                fn(*args)
+        per_call.append((time.perf_counter() - t0) / (reps * len(calls)))
+    med = statistics.median(per_call)
+    return {"min_s": min(per_call), "median_s": med, "mean_s": statistics.fmean(per_call),
+            "stddev_s": statistics.pstdev(per_call), "ops_per_s": 1.0 / med if med else 0.0,
+            "rounds": ROUNDS, "calls": len(calls) * reps}
+
+def call_inputs(corpus: Corpus) -> Dict[str, Tuple[Callable, List[tuple]]]:
+    n_models, n_texts = len(corpus.raw), len(corpus.texts)
+    idx = [(i % n_models, (i * 7) % n_texts) for i in range(N_CALLS)]
+    parsed = {pid: [safe_json_parse(corpus.raw[m][k][pid]) for m, k in idx] for pid in corpus.prompts}
+    filtered = {pid: [post_filter_parsed(p, corpus.texts[k], pid) for p, (_, k) in zip(parsed[pid], idx)]
+                for pid in corpus.prompts}
+    records = [{pid: {"parsed": filtered[pid][j]} for pid in corpus.prompts} for j in range(N_CALLS)]
+    concepts = [extract_concepts(r) for r in records]
+    triples = [extract_triples(r) for r in records]
+    triple_dicts = [t for r in records for t in ((r["triples"]["parsed"] or {}).get("triples") or [])][:N_CALLS]
+    pairs = [(j, (j + 1) % N_CALLS) for j in range(N_CALLS)]
+    return {
+        "safe_json_parse": (safe_json_parse, [(corpus.raw[m][k][pid],) for m, k in idx for pid in corpus.prompts]),
+        "post_filter_parsed": (post_filter_parsed, [(parsed[pid][j], corpus.texts[k], pid)
+                                                    for j, (_, k) in enumerate(idx) for pid in corpus.prompts]),
+        "extract_concepts": (extract_concepts, [(r,) for r in records]),
+        "extract_triples": (extract_triples, [(r,) for r in records]),
+        "canon_triple": (canon_triple, [(t,) for t in triple_dicts]),
+        "jaccard": (jaccard, [(concepts[a], concepts[b]) for a, b in pairs]),
+        "triple_f1": (triple_f1, [(triples[a], triples[b]) for a, b in pairs]),
+    }
+
+def scaling_run(corpus: Corpus, n_models: int, n_slides: int) -> Dict[str, float]:
+    """Seconds per stage for one parse → extract → pairwise pass."""
+    t_parse = t_extract = t_pair = 0.0
+    n_texts = len(corpus.texts)
+    for i in range(n_slides):
+        k = i % n_texts
+        text = corpus.texts[k]
+        t0 = time.perf_counter()
+        records = []
+        for m in range(n_models):
+            rec = {}
+            for pid in corpus.prompts:
+                p = safe_json_parse(corpus.raw[m][k][pid])
+                rec[pid] = {"parsed": post_filter_parsed(p, text, pid) if p else p}
+            records.append(rec)
+        t1 = time.perf_counter()
+        concepts = [extract_concepts(r) for r in records]
+        triples = [extract_triples(r) for r in records]
+        t2 = time.perf_counter()
+        for a in range(n_models):
+            for b in range(a + 1, n_models):
+                jaccard(concepts[a], concepts[b])
+                triple_f1(triples[a], triples[b])
+        t3 = time.perf_counter()
+        t_parse += t1 - t0
+        t_extract += t2 - t1
+        t_pair += t3 - t2
+    return {"parse": t_parse, "extract": t_extract, "pairwise": t_pair}
+
+def slope(xs: List[float], ys: List[float]) -> float:
+    keep = [(x, y) for x, y in zip(xs, ys) if x > 0 and y > 0]
+    if len({x for x, _ in keep}) < 2:
+        return float("nan")
+    lx, ly = np.log([x for x, _ in keep]), np.log([y for _, y in keep])
+    return float(np.polyfit(lx, ly, 1)[0])
+
+# ---------- main ----------
+
+def main():
+    cfg = load_runner_config(os.path.join(MILU, "Lecture 1"), "qwen")
+    texts = load_texts(N_TEXTS)
+    calib = calibrate()
+    max_models = max([m for m, _ in SCALING_SIZES] + [4])
+    t0 = time.perf_counter()
+    corpus = Corpus(max_models, texts, cfg["prompts"], cfg["gen_kw"])
+    log_line(SCRIPT, f"Corpus: {max_models} models × {len(texts)} texts × {len(cfg['prompts'])} prompts "
+                     f"in {time.perf_counter() - t0:.1f}s; calibration {calib * 1e3:.2f} ms")
+
+    calls = {}
+    for name, (fn, args) in call_inputs(corpus).items():
+        st = bench(fn, args)
+        st["normalized"] = st["min_s"] / calib
+        calls[name] = st
+        log_line(SCRIPT, f"{name:>20}: {st['median_s'] * 1e6:9.2f} µs/call (min {st['min_s'] * 1e6:.2f}, "
+                         f"±{st['stddev_s'] * 1e6:.2f}), {st['ops_per_s']:,.0f} ops/s")
+
+    scaling = []
+    for n_models, n_slides in SCALING_SIZES:
+        st = scaling_run(corpus, n_models, n_slides)
+        row = {"models": n_models, "slides": n_slides, "model_slides": n_models * n_slides,
+               "pair_slides": n_models * (n_models - 1) // 2 * n_slides,
+               **{f"{k}_s": round(v, 5) for k, v in st.items()}, "total_s": round(sum(st.values()), 5)}
+        scaling.append(row)
+        log_line(SCRIPT, f"{n_models:>4} models × {n_slides:>6} slides: parse {st['parse']:.3f}s, "
+                         f"extract {st['extract']:.3f}s, pairwise {st['pairwise']:.3f}s")
+    work = {"parse": "model_slides", "extract": "model_slides", "pairwise": "pair_slides"}
+    slopes = {stage: round(slope([r[w] for r in scaling], [r[f"{stage}_s"] for r in scaling]), 3)
+              for stage, w in work.items()}
+    log_line(SCRIPT, "Scaling slopes (1.0 = linear in work): " + ", ".join(f"{k} {v}" for k, v in slopes.items()))
+
+    with open(OUT_CALLS, "w", encoding="utf-8") as f:
+        f.write("benchmark,median_us,min_us,mean_us,stddev_us,ops_per_s,normalized\n")
+        for name, st in calls.items():
+            f.write(f"{name},{st['median_s'] * 1e6:.3f},{st['min_s'] * 1e6:.3f},{st['mean_s'] * 1e6:.3f},"
+                    f"{st['stddev_s'] * 1e6:.3f},{st['ops_per_s']:.1f},{st['normalized']:.6f}\n")
+    with open(OUT_SCALING, "w", encoding="utf-8") as f:
+        f.write(",".join(scaling[0]) + "\n")
+        for r in scaling:
+            f.write(",".join(str(v) for v in r.values()) + "\n")
+
+    fig, axes = plt.subplots(1, 3, figsize=(15, 4.5))
+    for ax, (stage, w) in zip(axes, work.items()):
+        for label, sel in (("4 models, slides vary", lambda r: r["models"] == 4),
+                           ("300 slides, models vary", lambda r: r["slides"] == 300)):
+            pts = sorted((r[w], r[f"{stage}_s"]) for r in scaling if sel(r))
+            if pts:
+                ax.plot([p[0] for p in pts], [p[1] for p in pts], marker="o", label=label)
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel(w.replace("_", " "))
+        ax.set_ylabel("seconds")
+        ax.set_title(f"{stage} (slope {slopes[stage]})")
+        ax.legend(fontsize=8)
+    fig.tight_layout()
+    fig.savefig(OUT_FIG, dpi=120)
+    plt.close(fig)
+
+    ts = datetime.datetime.now(datetime.timezone.utc)
+    report = {"benchmark": "micro", "timestamp_utc": ts.isoformat(), "python": platform.python_version(),
+              "calibration_s": calib, "n_texts": N_TEXTS, "n_calls": N_CALLS, "calls": calls,
+              "scaling": scaling, "slopes": slopes}
+    with open(os.path.join(BENCHMARK_DIR, f"micro_{ts.strftime('%Y%m%dT%H%M%SZ')}.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    if UPDATE_BASELINE or not os.path.isfile(BASELINE_PATH):
+        baseline = {"timestamp_utc": report["timestamp_utc"], "python": report["python"], "calibration_s": calib,
+                    "calls": {k: {"min_s": v["min_s"], "normalized": v["normalized"]} for k, v in calls.items()},
+                    "slopes": slopes}
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        log_line(SCRIPT, f"✅ Baseline written to {BASELINE_PATH}")
+    else:
+        with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, st in calls.items():
+            ref = baseline["calls"].get(name)
+            if ref:
+                ratio = st["normalized"] / ref["normalized"]
+                if ratio > 1 + TOLERANCE:
+                    regressions.append(f"{name} {ratio:.2f}× baseline")
+        for stage, s in slopes.items():
+            ref = baseline.get("slopes", {}).get(stage)
+            if ref is not None and s == s and s > ref + SLOPE_TOLERANCE:
+                regressions.append(f"{stage} scaling slope {s} (baseline {ref})")
+        if regressions:
+            log_line(SCRIPT, "⚠️ Regressions: " + "; ".join(regressions))
+        else:
+            log_line(SCRIPT, "✅ No regressions against baseline")
+    log_line(SCRIPT, f"✅ Wrote {OUT_CALLS}, {OUT_SCALING} and {OUT_FIG}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# pipeline_logging.py
+import atexit, datetime, json, os, queue, socket, sys, threading, time, uuid
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+# One structured log for every script: each call becomes a JSON line
+#   {"ts", "level", "script", "run_id", "pid", "host", "msg", ...fields}
+# in LOG_PATH (extra keyword fields such as stage=, duration_s=,
+# lecture=, model= are kept as-is), and the usual "[ts] [script] msg" line
+# on stdout. Records go through a queue to one background thread that
+# appends them in batches every FLUSH_INTERVAL_S, so a log call never opens
+# a file on the hot path; the queue is drained at exit and by flush().
+#
+# run_id is PIPELINE_RUN_ID when set (so scripts started by one driver, or
+# several queue workers, share it) and otherwise one id per process.
+# Without an explicit level=, messages starting with ❌ / ⚠️ are logged as
+# "error" / "warning" and everything else as "info"; PIPELINE_LOG_LEVEL
+# sets the minimum level written (default "info").
+#
+# LOG_PATH is PIPELINE_LOG_PATH when set and otherwise pipeline.jsonl in the
+# directory the script is run from, the same ROOT shared_config.py uses, so
+# library modules, scripts and the MILU23/data/codes copies all write to one
+# file; shared_config.LOG_PATH is this path.
+#
+#   from pipeline_logging import get_logger
+#   log = get_logger()
+#   log.info("queue_worker", "✅ Claimed 16 jobs", lecture="Lecture 3")
+#   with log.stage("queue_worker", "generate", model=model_id):
+#       ...                     # logs stage="generate", duration_s=...
+
+LOG_PATH = os.path.abspath(os.environ.get("PIPELINE_LOG_PATH") or "pipeline.jsonl")
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+FLUSH_INTERVAL_S = 1.0
+MAX_BATCH = 512                # records written per file open
+
+RUN_ID = os.environ.get("PIPELINE_RUN_ID") or (
+    datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:6])
+
+def _level_of(msg: str) -> str:
+    """Level for calls that do not pass one, from the status emoji the scripts start messages with."""
+    head = msg.lstrip()[:2]
+    return "error" if head.startswith("❌") else "warning" if head.startswith("⚠") else "info"
+
+class JsonlLogger:
+    def __init__(self, path: str, level: str = "info", console: bool = True,
+                 flush_interval: float = FLUSH_INTERVAL_S):
+        self.path = path
+        self.min_level = LEVELS[level.lower()]
+        self.console = console
+        self.flush_interval = flush_interval
+        self.host = socket.gethostname()
+        self.n_records = self.n_dropped = 0
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._lock = threading.Lock()           # one writer at a time (thread or flush())
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._writer, name="pipeline-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ---------- writing ----------
+
+    def _writer(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> None:
+        """Append everything queued so far, MAX_BATCH records per file open."""
+        with self._lock:
+            while True:
+                lines: List[str] = []
+                while len(lines) < MAX_BATCH:
+                    try:
+                        lines.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not lines:
+                    return
+                try:
+                    d = os.path.dirname(self.path)
+                    if d:
+                        os.makedirs(d, exist_ok=True)
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write("".join(lines))
+                except OSError as e:
+                    self.n_dropped += len(lines)
+                    print(f"⚠️  Could not write {len(lines)} log records to {self.path}: {e}", file=sys.stderr)
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=5.0)
+        self.flush()
+
+    # ---------- records ----------
+
+    def log(self, script: str, msg: str, level: Optional[str] = None, **fields: Any) -> None:
+        lvl = (level or _level_of(msg)).lower()
+        if LEVELS.get(lvl, LEVELS["info"]) < self.min_level:
+            return
+        ts = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        if self.console:
+            print(f"[{ts}] [{script}] {msg}")
+        record: Dict[str, Any] = {"ts": ts, "level": lvl, "script": script, "run_id": RUN_ID,
+                                  "pid": os.getpid(), "host": self.host, "msg": msg}
+        record.update(fields)
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        self.n_records += 1
+        self._queue.put(line)
+        if self._stop.is_set():             # logging after close(), e.g. from other atexit handlers
+            self.flush()
+
+    def debug(self, script: str, msg: str, **fields: Any) -> None:
+        self.log(script, msg, "debug", **fields)
+
+    def info(self, script: str, msg: str, **fields: Any) -> None:
+        self.log(script, msg, "info", **fields)
+
+    def warning(self, script: str, msg: str, **fields: Any) -> None:
+        self.log(script, msg, "warning", **fields)
+
+    def error(self, script: str, msg: str, **fields: Any) -> None:
+        self.log(script, msg, "error", **fields)
+
+    @contextmanager
+    def stage(self, script: str, name: str, level: str = "info", **fields: Any):
+        """Time a block; logs one record with stage=name, duration_s and ok=False if it raised."""
+        t0 = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            dt = time.perf_counter() - t0
+            self.log(script, f"{'✅' if ok else '❌'} {name} {dt:.3f}s", level if ok else "error",
+                     stage=name, duration_s=round(dt, 6), ok=ok, **fields)
+
+_loggers: Dict[Any, JsonlLogger] = {}
+_loggers_lock = threading.Lock()
+
+def get_logger(path: Optional[str] = None) -> JsonlLogger:
+    """One logger (and writer thread) per log file and process; forked children get their own."""
+    key = (os.path.abspath(path or LOG_PATH), os.getpid())
+    with _loggers_lock:
+        if key not in _loggers:
+            _loggers[key] = JsonlLogger(key[0], level=os.environ.get("PIPELINE_LOG_LEVEL", "info"))
+        return _loggers[key]
+
+def log_line(script: str, msg: str, level: Optional[str] = None, path: Optional[str] = None, **fields: Any) -> None:
+    get_logger(path).log(script, msg, level, **fields)
@@ -0,0 +1,176 @@
+# slide_dedup.py
+import hashlib, json, os, re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from output_store import OutputReader, atomic_write_json
+from run_manifest import completed_units
+
+# Animation builds and repeated title / outline slides produce groups of slides
+# with identical text and near-identical images. dedup_slides.py writes
+# Lecture N/slide_dedup.json mapping every duplicate to the earliest slide of
+# its group (its canonical); runners and queue workers then copy the
+# canonical's record instead of generating again. Text must match exactly
+# (the prompt embeds it); images must be within HAMMING_THRESHOLD bits of
+# the canonical's 64-bit difference hash.
+
+DEDUP_FILENAME = "slide_dedup.json"
+HAMMING_THRESHOLD = 6
+
+# ---------- hashing ----------
+
+def dhash(path: str, size: int = 8) -> int:
+    """64-bit difference hash: sign of horizontal gradients on a (size+1)×size grayscale thumbnail."""
+    with Image.open(path) as im:
+        g = np.asarray(im.convert("L").resize((size + 1, size), Image.LANCZOS), dtype=np.int16)
+    bits = (g[:, 1:] > g[:, :-1]).ravel()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def text_key(path: str) -> Optional[str]:
+    """sha1 of the slide text exactly as the runners read it (None if missing)."""
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return hashlib.sha1(f.read().strip().encode("utf-8")).hexdigest()
+
+# ---------- grouping ----------
+
+def _slide_num(name: str) -> int:
+    nums = re.findall(r"\d+", name)
+    return int(nums[-1]) if nums else 0
+
+def hash_lecture(lecture_dir: str) -> List[Dict[str, Any]]:
+    """Image/text hashes for every slide of a lecture, in slide order."""
+    img_dir = os.path.join(lecture_dir, "Images")
+    if not os.path.isdir(img_dir):
+        return []
+    out = []
+    files = sorted((f for f in os.listdir(img_dir) if f.lower().endswith((".jpg", ".jpeg", ".png"))),
+                   key=_slide_num)
+    for f in files:
+        slide_id = os.path.splitext(f)[0]
+        out.append({
+            "slide_id": slide_id,
+            "image": f,
+            "dhash": dhash(os.path.join(img_dir, f)),
+            "text": text_key(os.path.join(lecture_dir, "Texts", f"{slide_id}.txt")),
+        })
+    return out
+
+def find_duplicates(lectures: List[Tuple[str, List[Dict[str, Any]]]], threshold: int = HAMMING_THRESHOLD,
+                    cross_lecture: bool = False) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """
+    lectures: [(lecture name, hash_lecture(...))] in lecture order.
+    Returns lecture -> slide_id -> {"canonical": {"lecture", "slide_id"}, "hamming"} for duplicates only.
+    The first slide of each (text, image-cluster) group is its canonical.
+    """
+    dups: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    canon: Dict[Any, List[Tuple[str, str, int]]] = {}   # text key -> [(lecture, slide_id, dhash)]
+    for lec, slides in lectures:
+        dups.setdefault(lec, {})
+        for s in slides:
+            if s["text"] is None:
+                continue
+            key = s["text"] if cross_lecture else (lec, s["text"])
+            group = canon.setdefault(key, [])
+            best = None
+            for c_lec, c_sid, c_hash in group:
+                d = hamming(s["dhash"], c_hash)
+                if d <= threshold and (best is None or d < best[2]):
+                    best = (c_lec, c_sid, d)
+            if best is None:
+                group.append((lec, s["slide_id"], s["dhash"]))
+            else:
+                dups[lec][s["slide_id"]] = {"canonical": {"lecture": best[0], "slide_id": best[1]},
+                                            "hamming": best[2]}
+    return dups
+
+def write_dedup_map(lecture_dir: str, slides: List[Dict[str, Any]],
+                    duplicates: Dict[str, Dict[str, Any]], threshold: int) -> str:
+    path = os.path.join(lecture_dir, DEDUP_FILENAME)
+    atomic_write_json(path, {
+        "threshold": threshold,
+        "hashes": {s["slide_id"]: {"dhash": f"{s['dhash']:016x}", "text": s["text"]} for s in slides},
+        "duplicates": duplicates,
+    })
+    return path
+
+# ---------- reuse at generation time ----------
+
+class DedupReuse:
+    """
+    Looks up a reusable record for a duplicate slide: first among records
+    generated earlier in this process (remember()), then in the canonical
+    lecture's Outputs. A record from another lecture or an earlier run is only
+    reused if its run-manifest unit was produced with the same prompt and gen
+    kwargs; same-lecture records without a manifest are trusted (same runner).
+    """
+
+    def __init__(self, lecture_dir: str):
+        self.lecture_dir = os.path.abspath(lecture_dir)
+        self.lecture = os.path.basename(self.lecture_dir)
+        self.milu = os.path.dirname(self.lecture_dir)
+        self.duplicates: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(os.path.join(lecture_dir, DEDUP_FILENAME), "r", encoding="utf-8") as f:
+                self.duplicates = json.load(f).get("duplicates", {})
+        except (OSError, ValueError):
+            pass
+        self.canonicals = {d["canonical"]["slide_id"] for d in self.duplicates.values()
+                           if d["canonical"]["lecture"] == self.lecture}
+        self._mem: Dict[Tuple[str, str, str, str], Dict[str, Any]] = {}
+        self._readers: Dict[str, OutputReader] = {}
+        self._units: Dict[str, Dict] = {}
+        self.reused = 0
+
+    def __bool__(self) -> bool:
+        return bool(self.duplicates)
+
+    def remember(self, model_safe: str, prompt_id: str, record: Dict[str, Any]) -> None:
+        if record["slide_id"] not in self.canonicals:
+            return
+        self._mem[(self.lecture, record["slide_id"], model_safe, prompt_id)] = record
+
+    def _stored(self, lec: str, slide_id: str, model_safe: str, prompt_id: str,
+                inputs: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        out_root = os.path.join(self.milu, lec, "Outputs")
+        if lec not in self._units:
+            self._units[lec] = completed_units(out_root)
+        unit = self._units[lec].get((model_safe, prompt_id, slide_id))
+        if unit is not None:
+            u_in = unit.get("inputs", {})
+            if u_in.get("prompt") != inputs.get("prompt") or u_in.get("gen") != inputs.get("gen"):
+                return None
+        elif lec != self.lecture:
+            return None
+        if lec not in self._readers:
+            self._readers[lec] = OutputReader(out_root)
+        return self._readers[lec].get(model_safe, prompt_id, slide_id)[0]
+
+    def reuse(self, model_safe: str, prompt_id: str, slide_id: str,
+              inputs: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """Record for slide_id copied from its canonical, or None (not a duplicate / nothing to reuse)."""
+        dup = self.duplicates.get(slide_id)
+        if dup is None:
+            return None
+        c_lec, c_sid = dup["canonical"]["lecture"], dup["canonical"]["slide_id"]
+        src = self._mem.get((c_lec, c_sid, model_safe, prompt_id))
+        if src is None:
+            src = self._stored(c_lec, c_sid, model_safe, prompt_id, inputs)
+        if not isinstance(src, dict) or "raw_output" not in src:
+            return None
+        rec = dict(src)
+        rec["slide_id"] = slide_id
+        rec["reused_from"] = {"lecture": c_lec, "slide_id": c_sid, "hamming": dup["hamming"]}
+        self.reused += 1
+        return rec
+
+    def close(self) -> None:
+        for r in self._readers.values():
+            r.close()
+        self._readers.clear()
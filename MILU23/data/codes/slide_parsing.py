@@ -0,0 +1,413 @@
+# slide_parsing.py
+import json, re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Shared by the per-lecture runners (MILU23/Lecture N/*_code_to_compare_models.py).
+# Keep this module free of shared_config imports: runners are launched from
+# their lecture folder and must not create data/ directories there.
+
+# ---------- JSON extraction ----------
+
+def _normalize_quotes(s: str) -> str:
+    # make quotes/json punctuation consistent
+    return (s.replace("“", '"').replace("”", '"')
+             .replace("’", "'").replace("‘", "'")
+             .replace("–", "-").replace("—", "-"))
+
+try:  # optional fast decoder for bulk re-parsing (pip install orjson)
+    import orjson
+except ImportError:
+    orjson = None
+
+def _json_loads(s: str) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(s)
+        except Exception:
+            pass  # orjson is stricter (NaN, huge ints, raw control chars): let json decide
+    return json.loads(s, strict=False)
+
+# Skip to the next structural character: plain text and whole JSON string
+# literals (escapes included) are consumed in one C-level regex match, so the
+# Python loop only runs once per brace and braces inside strings never count.
+_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'  # unrolled: no per-character alternation
+_OBJ_SKIP_RE = re.compile(r'(?:[^{}"]+|' + _STRING + r')*', re.S)
+_ARRAY_SKIP_RE = re.compile(r'(?:[^{}\]"]+|' + _STRING + r')*', re.S)
+
+def _top_level_objects(s: str) -> Tuple[List[Tuple[int, int]], int]:
+    """
+    One forward, string-aware pass over s for top-level {...} spans (braces
+    inside JSON strings are ignored; prose between objects is skipped with
+    str.find). A stack holds the offsets of the objects still open; the
+    complete objects inside one that never closes (a truncated answer) count
+    as top level too. Returns (spans, open_start): open_start is where the
+    outermost unclosed object begins, -1 if none. Each character is scanned
+    once, so the pass is linear.
+    """
+    spans: List[Tuple[int, int]] = []
+    inner: List[Tuple[int, int]] = []    # closed objects whose enclosing ones are still open
+    stack: List[int] = []
+    n = len(s)
+    pos = s.find("{")
+    while pos != -1:
+        if s[pos] == "{":
+            stack.append(pos)
+        else:
+            start = stack.pop()
+            while inner and inner[-1][0] > start:    # nested in the object that just closed
+                inner.pop()
+            (inner if stack else spans).append((start, pos + 1))
+        pos += 1
+        if not stack:
+            pos = s.find("{", pos)
+            continue
+        pos = _OBJ_SKIP_RE.match(s, pos).end()
+        if pos >= n or s[pos] == '"':  # cut off (possibly inside a string)
+            break
+    spans.extend(inner)
+    return spans, stack[0] if stack else -1
+
+def _load_fragment(frag: str) -> Any:
+    # normalized first (original behaviour), then as-is: normalizing turns curly
+    # quotes inside string values into bare '"' and breaks otherwise-valid JSON
+    for cand in (_normalize_quotes(frag), frag):
+        try:
+            return _json_loads(cand)
+        except Exception:
+            continue
+    return None
+
+def _to_float(x: Any, default: float = 0.0) -> float:
+    try:
+        return float(x)
+    except (TypeError, ValueError):
+        return default
+
+def _clean_concepts(items: List[Any]) -> List[Dict[str, str]]:
+    cleaned = []
+    for c in items:
+        if isinstance(c, dict) and "term" in c and "category" in c:
+            cleaned.append({
+                "term": str(c["term"]).strip(),
+                "category": str(c["category"]).strip().lower()
+            })
+    return cleaned
+
+def _clean_triples(items: List[Any]) -> List[Dict[str, Any]]:
+    cleaned_t = []
+    for t in items:
+        if isinstance(t, dict) and all(k in t for k in ("s", "p", "o")):
+            mods = t.get("modalities", ["text"])
+            if isinstance(mods, str):
+                mods = [mods]
+            cleaned_t.append({
+                "s": str(t["s"]).strip(),
+                "p": str(t["p"]).strip(),
+                "o": str(t["o"]).strip(),
+                "modalities": mods,
+                "confidence": _to_float(t.get("confidence", 0.0)),
+                "evidence": str(t.get("evidence", "")).strip()
+            })
+    return cleaned_t
+
+def _coerce_schema(obj: dict) -> dict:
+    """Light schema coercion shared by the strict and the recovery path."""
+    if "evidence" in obj and isinstance(obj["evidence"], str):
+        obj["evidence"] = [obj["evidence"]]
+    if "concepts" in obj and isinstance(obj["concepts"], list):
+        obj["concepts"] = _clean_concepts(obj["concepts"])
+    if "triples" in obj and isinstance(obj["triples"], list):
+        obj["triples"] = _clean_triples(obj["triples"])
+    return obj
+
+# ---------- truncation-tolerant recovery ----------
+
+_ARRAY_KEY_RE = re.compile(r'"(concepts|triples)"\s*:\s*\[')
+# placeholders used in the runners' OUTPUT examples
+TEMPLATE_PLACEHOLDERS = frozenset({"<exact term from slide>", "<verbatim subject>", "<verbatim object>"})
+
+def _array_elements(s: str, start: int) -> Iterator[str]:
+    """
+    Yield the text of every complete {...} element of the JSON array opening
+    just before `start`. String-aware (braces inside quotes are ignored);
+    stops at the closing ']' or wherever the text was cut off.
+    """
+    depth = 0
+    elem_start = -1
+    pos, n = start, len(s)
+    while True:
+        pos = _ARRAY_SKIP_RE.match(s, pos).end()
+        if pos >= n or s[pos] == '"':
+            return
+        ch = s[pos]
+        if ch == "{":
+            if depth == 0:
+                elem_start = pos
+            depth += 1
+        elif ch == "}":
+            depth -= 1
+            if depth == 0 and elem_start >= 0:
+                yield s[elem_start:pos + 1]
+                elem_start = -1
+            elif depth < 0:
+                return
+        elif depth == 0:  # "]" closing the array
+            return
+        pos += 1
+
+def _is_template_echo(item: dict) -> bool:
+    # the prompt's own example element ("<exact term from slide>") echoed back
+    vals = [v for k, v in item.items() if k in ("term", "s", "o")]
+    return bool(vals) and all(isinstance(v, str) and v.strip() in TEMPLATE_PLACEHOLDERS for v in vals)
+
+def recover_partial(raw: str) -> Optional[dict]:
+    """
+    Salvage every complete concept/triple element from a truncated or
+    malformed "concepts"/"triples" array (the last one in the output, i.e.
+    the model's answer rather than the echoed prompt template).
+    Returns {"concepts"|"triples": [...], "partial": True} or None.
+    """
+    if not isinstance(raw, str) or not raw:
+        return None
+    matches = list(_ARRAY_KEY_RE.finditer(raw))
+    if not matches:
+        return None
+    m = matches[-1]
+    key = m.group(1)
+
+    items = []
+    for frag in _array_elements(raw, m.end()):
+        obj = _load_fragment(frag)
+        if isinstance(obj, dict) and not _is_template_echo(obj):
+            items.append(obj)
+
+    cleaned = _clean_concepts(items) if key == "concepts" else _clean_triples(items)
+    if not cleaned:
+        return None
+    return {key: cleaned, "partial": True}
+
+def _is_template_doc(obj: Any) -> bool:
+    """The prompt's OUTPUT example echoed back (every item is a <placeholder>)."""
+    if not isinstance(obj, dict):
+        return False
+    for key in ("concepts", "triples"):
+        items = obj.get(key)
+        if isinstance(items, list) and items:
+            return all(isinstance(x, dict) and _is_template_echo(x) for x in items)
+    return False
+
+def _is_answer(obj: Any) -> bool:
+    """A schema-matching object that is not the echoed template."""
+    return (isinstance(obj, dict) and ("concepts" in obj or "triples" in obj)
+            and not _is_template_doc(obj))
+
+def extract_json_objects(raw: str) -> List[Tuple[int, Any]]:
+    """Every parseable top-level object in raw as (start offset, value)."""
+    spans, _ = _top_level_objects(raw)
+    out = []
+    for a, b in spans:
+        obj = _load_fragment(raw[a:b])
+        if obj is not None:
+            out.append((a, obj))
+    return out
+
+def safe_json_parse(raw: str) -> Optional[dict]:
+    """
+    Tolerant JSON extractor used across all runners. Picks the last
+    schema-matching object ("concepts"/"triples", not the echoed prompt
+    template). If the answer was cut off at max_new_tokens, its complete
+    array elements are recovered and flagged with "partial": True; as a last
+    resort the last parseable object is returned (the original behaviour).
+    """
+    if not isinstance(raw, str) or not raw:
+        return None
+
+    # fast path: the whole output is one JSON document
+    body = raw.strip()
+    if body.startswith("{") and body.endswith("}"):
+        obj = _load_fragment(body)
+        if _is_answer(obj):
+            return _coerce_schema(obj)
+
+    spans, open_start = _top_level_objects(raw)
+    answer_at, answer, last_obj = -1, None, None
+    for a, b in reversed(spans):  # parse lazily, newest first
+        obj = _load_fragment(raw[a:b])
+        if last_obj is None and isinstance(obj, dict):
+            last_obj = obj
+        if _is_answer(obj):
+            answer_at, answer = a, obj
+            break
+
+    if open_start > answer_at:
+        recovered = recover_partial(raw[open_start:])
+        if recovered is not None:
+            return recovered
+    if answer is not None:
+        return _coerce_schema(answer)
+    recovered = recover_partial(raw)
+    if recovered is not None:
+        return recovered
+    return _coerce_schema(last_obj) if last_obj is not None else None
+
+# ---------- grounding vocabulary ----------
+
+STOP_TERMS = frozenset({
+    "science", "engineering", "computer science", "biology", "foundation", "technologies",
+    "office hour", "office hours", "discussion forums", "online resources", "selected reading materials",
+    "modern healthcare", "clinical", "course", "syllabus", "industry", "career", "jobs",
+    "employment", "market share", "innovation", "r&d spending", "email", "room",
+})
+GEO_TERMS = frozenset({
+    "asia", "europe", "africa", "america", "americas", "north america", "south america", "oceania",
+    "antarctica", "china", "india", "us", "usa", "uk", "european",
+})
+ALLOWED_CATS = frozenset({
+    "software", "workflow", "mathematics", "signal_processing", "frequency_domain",
+    "physics", "instrumentation", "data_processing", "reconstruction", "quality_metric",
+    "communication", "modality", "anatomy", "algorithm", "ai_ml",
+})
+ALLOWED_P = frozenset({"uses", "via", "represents", "depends_on", "measures", "produces", "reconstructs_with"})
+ACRONYM_KEEP = frozenset({"ct", "mri", "pet", "spect", "us", "x-ray", "xray", "cbct", "oct"})
+ANATOMY_HINTS = frozenset({
+    "brain", "heart", "lung", "liver", "kidney", "bone", "skull", "tissue",
+    "organ", "vessel", "artery", "vein", "abdomen", "thorax", "spine", "muscle",
+})
+
+Span = Tuple[int, int]
+
+# ---------- multi-pattern matching ----------
+
+try:  # optional C automaton (pip install pyahocorasick)
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# Below this many needles, per-needle str.find beats building an automaton
+# (measured on ~2k-char slide texts); typical records have 5-30 candidates.
+AC_MIN_NEEDLES = 512
+
+def find_all(needles: List[str], haystack: str) -> Dict[str, List[Span]]:
+    """
+    Every (overlapping) occurrence of every needle: one Aho-Corasick pass for
+    large needle sets when pyahocorasick is installed, else one C-level
+    str.find scan per needle (a pure-Python automaton is slower than either).
+    """
+    spans: Dict[str, List[Span]] = {}
+    if ahocorasick is not None and len(needles) >= AC_MIN_NEEDLES:
+        A = ahocorasick.Automaton()
+        for i, n in enumerate(needles):
+            A.add_word(n, i)
+        A.make_automaton()
+        for end, i in A.iter(haystack):
+            n = needles[i]
+            spans.setdefault(n, []).append((end + 1 - len(n), end + 1))
+        for v in spans.values():
+            v.sort()
+        return spans
+    for n in needles:
+        i = haystack.find(n)
+        while i != -1:
+            spans.setdefault(n, []).append((i, i + len(n)))
+            i = haystack.find(n, i + 1)
+    return spans
+
+# ---------- grounding filter ----------
+
+class GroundingFilter:
+    """
+    Denoise/validation applied to parsed model output: a concept or triple
+    subject/object is kept only if it appears (case-insensitively) in the slide
+    text, plus the stop-word / category / predicate rules. The rule tables are
+    built once; all candidates of a record are grounded in one find_all call.
+    Offsets index slide_text.lower().
+    """
+
+    def __init__(self, stop_terms=STOP_TERMS, geo_terms=GEO_TERMS, allowed_cats=ALLOWED_CATS,
+                 allowed_p=ALLOWED_P, acronym_keep=ACRONYM_KEEP, anatomy_hints=ANATOMY_HINTS,
+                 min_term_len: int = 4):
+        self.blocked = frozenset(stop_terms) | frozenset(geo_terms)
+        self.allowed_cats = frozenset(allowed_cats)
+        self.allowed_p = frozenset(allowed_p)
+        self.acronym_keep = frozenset(acronym_keep)
+        self.anatomy_hints = tuple(sorted(anatomy_hints))
+        self.min_term_len = min_term_len
+
+    def ground(self, candidates: Iterable[str], slide_text: str) -> Dict[str, List[Span]]:
+        """Lowercased candidate -> (start, end) offsets of every occurrence; absent terms are omitted."""
+        needles = sorted({c.lower() for c in candidates if c})
+        if not needles:
+            return {}
+        return find_all(needles, slide_text.lower())
+
+    def filter(self, parsed_obj: Optional[dict], slide_text: str, prompt_id: str,
+               with_spans: bool = False) -> Optional[dict]:
+        """
+        Same contract as the runners' post_filter_parsed. With with_spans=True,
+        kept concepts get "spans" and kept triples get "s_spans" / "o_spans".
+        """
+        if not isinstance(parsed_obj, dict):
+            return None
+
+        if prompt_id == "concepts" and "concepts" in parsed_obj:
+            items = parsed_obj["concepts"]
+            found = self.ground((c.get("term", "").strip() for c in items), slide_text)
+            kept = []
+            for c in items:
+                term = c.get("term", "").strip()
+                cat = c.get("category", "").strip().lower()
+                tl = term.lower()
+                if not term or not cat or cat not in self.allowed_cats:
+                    continue
+                if tl not in found:
+                    continue
+                if tl in self.blocked:
+                    continue
+                if len(term) < self.min_term_len and tl not in self.acronym_keep:
+                    continue
+                if cat == "anatomy" and not any(h in tl for h in self.anatomy_hints):
+                    continue
+                rec = {"term": term, "category": cat}
+                if with_spans:
+                    rec["spans"] = [list(sp) for sp in found[tl]]
+                kept.append(rec)
+            parsed_obj["concepts"] = kept
+
+        if prompt_id == "triples" and "triples" in parsed_obj:
+            items = parsed_obj["triples"]
+            cands = []
+            for t in items:
+                cands.append(t.get("s", "").strip())
+                cands.append(t.get("o", "").strip())
+            found = self.ground(cands, slide_text)
+            kept_t = []
+            for t in items:
+                s = t.get("s", "").strip()
+                p = t.get("p", "").strip().lower()
+                o = t.get("o", "").strip()
+                if not s or not o or p not in self.allowed_p:
+                    continue
+                if s.lower() not in found or o.lower() not in found:
+                    continue
+                mods = t.get("modalities", ["text"])
+                if isinstance(mods, str):
+                    mods = [mods]
+                rec = {
+                    "s": s, "p": p, "o": o,
+                    "modalities": [m for m in mods if m in ("text", "image")],
+                    "confidence": float(t.get("confidence", 0.0)),
+                    "evidence": t.get("evidence", ""),
+                }
+                if with_spans:
+                    rec["s_spans"] = [list(sp) for sp in found[s.lower()]]
+                    rec["o_spans"] = [list(sp) for sp in found[o.lower()]]
+                kept_t.append(rec)
+            parsed_obj["triples"] = kept_t
+
+        return parsed_obj
+
+_DEFAULT_FILTER = GroundingFilter()
+
+def post_filter_parsed(parsed_obj: Optional[dict], slide_text: str, prompt_id: str) -> Optional[dict]:
+    """Drop ungrounded / off-topic concepts and triples (shared rules, compiled once)."""
+    return _DEFAULT_FILTER.filter(parsed_obj, slide_text, prompt_id)
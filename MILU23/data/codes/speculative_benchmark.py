@@ -0,0 +1,96 @@
+# speculative_benchmark.py
+import csv, os
+from typing import Any, Dict, List
+
+from shared_config import MILU, ANALYSIS_DIR, log_line
+from job_queue import load_runner_config
+from inference_engine import InferenceEngine
+from qwen_resolution_sweep import list_lectures, sample_slides, timed_run
+
+SCRIPT = "speculative_benchmark"
+
+# Runs a sample of slides through TARGET_ID twice, plain greedy and assisted
+# by DRAFT_ID, and reports speedup, draft acceptance rate and tokens per
+# target pass. Every assisted output is compared with the plain one; greedy
+# assisted decoding should reproduce it exactly, and a mismatch (fp16
+# rounding in the batched verification pass) is reported per call.
+TARGET_ID = "Qwen/Qwen3-VL-4B-Instruct"
+DRAFT_ID = "Qwen/Qwen3-VL-2B-Instruct"
+NUM_ASSISTANT_TOKENS = None    # draft tokens per round; None = transformers' adaptive default
+LECTURES = None
+N_SLIDES = 30
+SEED = 0
+WARMUP = 2                     # slides run (and discarded) before timing
+
+OUT_ROWS = os.path.join(ANALYSIS_DIR, "speculative_benchmark_rows.csv")
+OUT_SUMMARY = os.path.join(ANALYSIS_DIR, "speculative_benchmark.csv")
+
+def summarize(name: str, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    plain = sum(r["plain_s"] for r in rows)
+    spec = sum(r["assisted_s"] for r in rows)
+    drafted = sum(r["draft_tokens"] for r in rows)
+    passes = sum(r["target_passes"] for r in rows)
+    new = sum(r["new_tokens"] for r in rows)
+    return {
+        "group": name,
+        "calls": len(rows),
+        "plain_s": round(plain, 2),
+        "assisted_s": round(spec, 2),
+        "speedup": round(plain / spec, 3) if spec else "",
+        "acceptance_rate": round(sum(r["accepted_tokens"] for r in rows) / drafted, 4) if drafted else "",
+        "tokens_per_target_pass": round(new / passes, 3) if passes else "",
+        "identical_rate": round(sum(r["identical"] for r in rows) / len(rows), 4),
+    }
+
+def main():
+    lectures = LECTURES or list_lectures(MILU)
+    slides = sample_slides(lectures, N_SLIDES + WARMUP, SEED)
+    cfg = load_runner_config(os.path.join(MILU, slides[0][0]), "qwen")
+    prompts, gen_kw = cfg["prompts"], cfg["gen_kw"]
+
+    engine = InferenceEngine(TARGET_ID, family="qwen")
+    wrapper = engine.wrapper
+    wrapper.load_draft(DRAFT_ID, num_assistant_tokens=NUM_ASSISTANT_TOKENS)
+    log_line(SCRIPT, f"✅ Loaded: {TARGET_ID} with draft {DRAFT_ID} — "
+                     f"{len(slides) - WARMUP} slides × {len(prompts)} prompts")
+
+    rows: List[Dict[str, Any]] = []
+    for i, (lec, slide_file) in enumerate(slides):
+        lec_dir = os.path.join(MILU, lec)
+        for prompt_id, prompt_tpl in prompts.items():
+            wrapper.speculative = False
+            plain, plain_s = timed_run(engine, lec_dir, slide_file, prompt_id, prompt_tpl, gen_kw)
+            wrapper.speculative = True
+            spec, spec_s = timed_run(engine, lec_dir, slide_file, prompt_id, prompt_tpl, gen_kw)
+            if i < WARMUP:
+                continue
+            identical = spec["raw_output"] == plain["raw_output"]
+            if not identical:
+                log_line(SCRIPT, f"⚠️ {lec}/{plain['slide_id']}/{prompt_id}: assisted output differs from plain greedy")
+            st = wrapper.last_stats
+            rows.append({
+                "lecture": lec, "slide_id": plain["slide_id"], "prompt": prompt_id,
+                "plain_s": round(plain_s, 4), "assisted_s": round(spec_s, 4),
+                "new_tokens": st["new_tokens"], "target_passes": st.get("target_passes", 0),
+                "draft_tokens": st.get("draft_tokens", 0), "accepted_tokens": st.get("accepted_tokens", 0),
+                "identical": int(identical),
+            })
+    engine.unload()
+
+    with open(OUT_ROWS, "w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=list(rows[0]))
+        w.writeheader()
+        w.writerows(rows)
+    summary = [summarize("all", rows)] + [summarize(p, [r for r in rows if r["prompt"] == p]) for p in prompts]
+    with open(OUT_SUMMARY, "w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=list(summary[0]))
+        w.writeheader()
+        w.writerows(summary)
+
+    for s in summary:
+        log_line(SCRIPT, f"{s['group']:>9}: {s['speedup']}× speedup, acceptance {s['acceptance_rate']}, "
+                         f"{s['tokens_per_target_pass']} tokens/target pass, identical {s['identical_rate']:.0%}")
+    log_line(SCRIPT, f"✅ Wrote {OUT_SUMMARY} and {OUT_ROWS}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# stage_profiler.py
+import cProfile, json, os, re, time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+
+try:
+    import torch
+except ImportError:  # CPU-only tooling (scripted backend, benchmarks); traces fall back to cProfile
+    torch = None
+
+from pipeline_logging import log_line
+
+# Where a runner's time goes, per stage of its slide loop. The runners time
+# image_load / parse / write around each slide, and the wrappers (their
+# .profiler attribute) time preprocess / generate / decode inside generate()
+# and generate_batch(). Each stage keeps count, total, min and max; counters
+# hold anything else worth summing (tokens, skipped slides, ...). One
+# profiler covers one lecture run: report() logs a table to pipeline.jsonl
+# and save() writes it as JSON.
+#
+# Traces: with trace_every=N every Nth slide that goes through slide() runs
+# under torch.profiler and is written to trace_dir as
+#   <label>.trace.json   Chrome trace (Perfetto / chrome://tracing, the same
+#                        format `py-spy record --format chrometrace` writes)
+#   <label>.stacks.txt   collapsed Python stacks by self CPU time (flamegraph.pl /
+#                        speedscope, like `py-spy record --format raw`)
+# Stages show up in the trace as record_function ranges. Without torch the
+# slide is profiled with cProfile instead (<label>.prof, for snakeviz / pstats).
+#
+#   prof = StageProfiler(trace_dir=os.path.join(ROOT, "Profile", "traces"), trace_every=50)
+#   wrapper.profiler = prof
+#   with prof.slide("Slide7"):
+#       with prof.stage("image_load"):
+#           ...
+#   prof.report("compare_qwen"); prof.save(os.path.join(ROOT, "Profile", "stage_profile.json"))
+
+STAGE_ORDER = ["image_load", "preprocess", "generate", "decode", "parse", "write"]
+
+class StageProfiler:
+    def __init__(self, trace_dir: Optional[str] = None, trace_every: int = 0, sync_cuda: bool = False):
+        self.trace_dir = trace_dir
+        self.trace_every = trace_every if trace_dir else 0
+        # synchronize at the end of each stage so queued GPU kernels are charged to the stage that launched them
+        self.sync_cuda = sync_cuda and torch is not None and torch.cuda.is_available()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, float] = {}
+        self.n_slides = 0
+        self.traces: List[str] = []
+        self._tracing = False
+        self.t_start = time.perf_counter()
+
+    # ---------- timers / counters ----------
+
+    def _add(self, name: str, dt: float) -> None:
+        s = self.stages.get(name)
+        if s is None:
+            self.stages[name] = {"count": 1, "total_s": dt, "min_s": dt, "max_s": dt}
+        else:
+            s["count"] += 1
+            s["total_s"] += dt
+            s["min_s"] = min(s["min_s"], dt)
+            s["max_s"] = max(s["max_s"], dt)
+
+    @contextmanager
+    def stage(self, name: str):
+        label = torch.profiler.record_function(name) if self._tracing else nullcontext()
+        t0 = time.perf_counter()
+        try:
+            with label:
+                yield
+        finally:
+            if self.sync_cuda:
+                torch.cuda.synchronize()
+            self._add(name, time.perf_counter() - t0)
+
+    def count(self, name: str, n: float = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    # ---------- traces ----------
+
+    @contextmanager
+    def slide(self, label: str):
+        """One slide's work; traced when it is the trace_every-th slide."""
+        self.n_slides += 1
+        if not self.trace_every or self.n_slides % self.trace_every or self._tracing:
+            yield
+            return
+        os.makedirs(self.trace_dir, exist_ok=True)
+        base = os.path.join(self.trace_dir, re.sub(r"[^\w.\-]+", "_", label))
+        self._tracing = torch is not None
+        try:
+            if torch is None:
+                prof = cProfile.Profile()
+                prof.enable()
+                try:
+                    yield
+                finally:
+                    prof.disable()
+                    prof.dump_stats(base + ".prof")
+                    self.traces.append(base + ".prof")
+                return
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            with torch.profiler.profile(activities=activities, record_shapes=True, with_stack=True) as prof:
+                yield
+            prof.export_chrome_trace(base + ".trace.json")
+            prof.export_stacks(base + ".stacks.txt", "self_cpu_time_total")
+            self.traces.append(base + ".trace.json")
+        finally:
+            self._tracing = False
+
+    # ---------- summary ----------
+
+    def rows(self) -> List[Dict[str, Any]]:
+        total = sum(s["total_s"] for s in self.stages.values()) or 1.0
+        order = [n for n in STAGE_ORDER if n in self.stages] + sorted(n for n in self.stages if n not in STAGE_ORDER)
+        return [{"stage": n, "count": int(self.stages[n]["count"]),
+                 "total_s": round(self.stages[n]["total_s"], 6),
+                 "mean_s": round(self.stages[n]["total_s"] / self.stages[n]["count"], 6),
+                 "min_s": round(self.stages[n]["min_s"], 6), "max_s": round(self.stages[n]["max_s"], 6),
+                 "share": round(self.stages[n]["total_s"] / total, 4)} for n in order]
+
+    def summary(self) -> Dict[str, Any]:
+        return {"wall_s": round(time.perf_counter() - self.t_start, 3), "slides": self.n_slides,
+                "stages": self.rows(), "counters": self.counters, "traces": self.traces}
+
+    def report(self, script: str, **fields: Any) -> None:
+        """One log record per stage (stage=, duration_s=, count=, ...) and a per-stage table on stdout."""
+        s = self.summary()
+        log_line(script, f"⏱️  Stage times over {s['slides']} slides ({s['wall_s']:.1f}s wall):",
+                 wall_s=s["wall_s"], slides=s["slides"], counters=s["counters"], **fields)
+        for r in s["stages"]:
+            log_line(script, f"   {r['stage']:<11} {r['count']:>6}× {r['total_s']:>9.2f}s total "
+                             f"{r['mean_s'] * 1e3:>9.1f}ms mean {r['max_s'] * 1e3:>9.1f}ms max {r['share']:>6.1%}",
+                     stage=r["stage"], duration_s=r["total_s"], count=r["count"], mean_s=r["mean_s"],
+                     min_s=r["min_s"], max_s=r["max_s"], share=r["share"], **fields)
+        if self.traces:
+            log_line(script, f"⏱️  {len(self.traces)} traces in {self.trace_dir}", **fields)
+
+    def save(self, path: str, **meta: Any) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(meta, **self.summary()), f, indent=2)
+
+def timed(profiler: Optional[StageProfiler], name: str):
+    """profiler.stage(name), or a no-op when profiling is off (wrapper.profiler is None)."""
+    return profiler.stage(name) if profiler is not None else nullcontext()
@@ -0,0 +1,917 @@
+# vlm_wrappers.py
+import contextlib, math, os, tempfile, time
+from typing import Any, Dict, List, Optional, Protocol, Tuple
+
+import torch
+from PIL import Image
+from transformers import AutoProcessor, AutoTokenizer, AutoModel, AutoModelForVision2Seq, GenerationConfig
+
+from tensor_cache import config_digest, digest, image_digest
+from scripted_backend import ScriptedVLM
+from pipeline_logging import log_line
+from stage_profiler import timed
+
+# Heads that only exist in newer transformers releases; the wrappers that need
+# them fail at load time instead of breaking imports for every family.
+try:
+    from transformers import AutoModelForImageTextToText   # ✅ correct head for Qwen2/3-VL
+except ImportError:
+    AutoModelForImageTextToText = None
+try:
+    from transformers.models.llava_onevision.modeling_llava_onevision import LlavaOnevisionForConditionalGeneration
+except ImportError:
+    LlavaOnevisionForConditionalGeneration = None
+try:
+    import torchvision.transforms as T
+    from torchvision.transforms.functional import InterpolationMode
+except ImportError:
+    T = InterpolationMode = None
+
+SCRIPT = "vlm_wrappers"
+
+# One wrapper per model family, shared by the per-lecture runners
+# (MILU23/Lecture N/<family>_code_to_compare_models.py) and queue workers.
+# Every wrapper exposes generate(image, prompt_text, gen_kw) -> str;
+# image=None runs the same prompt text-only (see image_router.py).
+# generate_batch(images, prompt_texts, gen_kw) -> [str] runs several slides in
+# one left-padded call (all images, or all None) and visual_tokens(image)
+# estimates the image's share of the prompt for inference_engine.MemoryPlanner.
+# The full contract is VLMBackend below; scripted_backend.ScriptedVLM
+# implements it without weights for CPU-only load tests ("scripted/..." ids).
+
+class VLMBackend(Protocol):
+    """What InferenceEngine (and everything built on it) needs from a model family."""
+
+    model_id: str
+    device: str
+    model: Any                       # the torch module (for MemoryPlanner / ModelPool), or None
+    last_stats: Dict[str, float]     # prompt_tokens / new_tokens (+ preprocess_s for batches) of the last call
+    profiler: Any                    # stage_profiler.StageProfiler timing preprocess / generate / decode, or None
+
+    def generate(self, image: Optional[Image.Image], prompt_text: str, gen_kw: Dict[str, Any]) -> str: ...
+
+    def generate_batch(self, images: List[Optional[Image.Image]], prompt_texts: List[str],
+                       gen_kw: Dict[str, Any]) -> List[str]: ...
+
+    def visual_tokens(self, image: Optional[Image.Image]) -> int: ...
+
+    def count_tokens(self, text: str) -> int: ...
+
+# ---------- helpers ----------
+
+def sanitize_gen_kwargs(model, gen_kw: dict) -> dict:
+    try:
+        allowed = set(model.generation_config.to_dict().keys())
+        return {k: v for k, v in gen_kw.items() if k in allowed}
+    except Exception:
+        return gen_kw
+
+def cached_image_tensors(wrapper, image: Image.Image, compute, settings: str = "") -> Dict[str, torch.Tensor]:
+    """
+    Image-only preprocessing (compute() -> tensors) served from wrapper.tensor_cache.
+    Keyed by model id, image-processor config, wrapper `settings` and the decoded pixels.
+    """
+    cache = wrapper.tensor_cache
+    proc = getattr(getattr(wrapper, "processor", None), "image_processor", None)
+    key = digest(wrapper.model_id, config_digest(proc) if proc is not None else "", settings, image_digest(image))
+    hit = cache.get(key)
+    if hit is not None:
+        return {k: torch.from_numpy(v) for k, v in hit.items()}
+    out = {k: v for k, v in dict(compute()).items() if torch.is_tensor(v)}
+    if all(v.dtype != torch.bfloat16 for v in out.values()):   # numpy has no bfloat16
+        cache.put(key, {k: v.detach().cpu().numpy() for k, v in out.items()}, {"model": wrapper.model_id})
+    return out
+
+def token_stats(inputs: Dict[str, torch.Tensor], output_ids: torch.Tensor, tokenizer) -> Dict[str, int]:
+    """Prompt / generated token counts of a (left-padded) generate call, padding excluded."""
+    n_in = inputs["input_ids"].shape[1]
+    mask = inputs.get("attention_mask")
+    new = output_ids[:, n_in:]
+    pad = tokenizer.pad_token_id
+    return {
+        "prompt_tokens": int(mask.sum()) if mask is not None else inputs["input_ids"].numel(),
+        "new_tokens": int((new != pad).sum()) if pad is not None else new.numel(),
+    }
+
+def _cache_failed(wrapper, e: Exception) -> None:
+    log_line(SCRIPT, f"ℹ️  Tensor cache disabled for {wrapper.model_id} ({e.__class__.__name__}: {e})")
+    wrapper.tensor_cache = None
+
+# ---------- performance profiles ----------
+#
+# attn:         "sdpa" | "eager" attention (unset = from_pretrained's choice)
+# static_cache: preallocated KV cache, fixed decode shapes (needed for compile
+#               to pay off; not used with a speculative draft)
+# compile:      torch.compile mode for the language decoder (prefill shapes
+#               still vary per slide, so expect a recompile per new length)
+PERF_PROFILES: Dict[str, Dict[str, Any]] = {
+    "default":        {},
+    "eager":          {"attn": "eager"},
+    "sdpa":           {"attn": "sdpa"},
+    "sdpa_static":    {"attn": "sdpa", "static_cache": True},
+    "sdpa_compile":   {"attn": "sdpa", "static_cache": True, "compile": "reduce-overhead"},
+}
+
+# language decoder of the wrapped HF model, newest layout first
+DECODER_PATHS = ("model.language_model", "language_model", "model.text_model", "model.model")
+
+def resolve_perf_profile(profile: Any) -> Dict[str, Any]:
+    """Profile name or dict -> settings dict (None = "default")."""
+    if profile is None:
+        return {}
+    if isinstance(profile, dict):
+        return profile
+    if profile not in PERF_PROFILES:
+        raise ValueError(f"Unknown perf profile {profile!r} (expected one of {sorted(PERF_PROFILES)})")
+    return PERF_PROFILES[profile]
+
+def device_map_for(device: str) -> Any:
+    # "auto" spreads over visible GPUs; an explicit "cpu" must stay on CPU even when a GPU exists
+    return "auto" if device == "cuda" else device
+
+def load_kwargs(profile: Dict[str, Any]) -> Dict[str, Any]:
+    return {"attn_implementation": profile["attn"]} if profile.get("attn") else {}
+
+def _decoder(model) -> Optional[torch.nn.Module]:
+    for dotted in DECODER_PATHS:
+        found = _resolve(model, dotted)
+        if found is not None and found[1] == "forward":
+            return found[0]
+    return None
+
+def apply_perf_profile(model, profile: Dict[str, Any], model_id: str) -> None:
+    """Post-load part of a profile: static KV cache and decoder compilation."""
+    decoder = _decoder(model)
+    if profile.get("static_cache"):
+        for m in (model, decoder):
+            if isinstance(getattr(m, "generation_config", None), GenerationConfig):
+                m.generation_config.cache_implementation = "static"
+    if profile.get("compile"):
+        if decoder is None:
+            log_line(SCRIPT, f"ℹ️  No language decoder found to compile in {model_id}")
+            return
+        decoder.forward = torch.compile(decoder.forward, mode=profile["compile"])
+
+# ---------- vision embedding cache ----------
+#
+# embed_cache (an embedding_cache.EmbeddingCache, off by default) replaces the
+# model's vision entry point — vision tower + projector — with a lookup keyed
+# by (model, image, resolution setting). On a hit the cached visual tokens
+# are returned and the encoder never runs; generation is otherwise unchanged.
+
+# family -> dotted attributes of the wrapped HF model, first match is patched
+VISION_ENTRY = {
+    "qwen":     ("model.visual", "visual"),
+    "intern":   ("extract_feature",),
+    "llava":    ("model.get_image_features", "get_image_features"),
+    "idefics2": ("model.get_image_features",),   # transformers >= 4.52
+}
+
+def _flatten(obj: Any, out: List[torch.Tensor]) -> Any:
+    if torch.is_tensor(obj):
+        out.append(obj)
+        return {"t": len(out) - 1}
+    if isinstance(obj, (list, tuple)):
+        return {"seq": [_flatten(o, out) for o in obj], "tuple": isinstance(obj, tuple)}
+    if obj is None:
+        return None
+    raise TypeError(f"cannot cache vision output of type {type(obj).__name__}")
+
+def _unflatten(spec: Any, tensors: List[torch.Tensor]) -> Any:
+    if spec is None:
+        return None
+    if "t" in spec:
+        return tensors[spec["t"]]
+    seq = [_unflatten(o, tensors) for o in spec["seq"]]
+    return tuple(seq) if spec["tuple"] else seq
+
+def _resolve(root: Any, dotted: str) -> Optional[Tuple[Any, str]]:
+    *path, name = dotted.split(".")
+    for part in path:
+        root = getattr(root, part, None)
+        if root is None:
+            return None
+    target = getattr(root, name, None)
+    if target is None:
+        return None
+    return (target, "forward") if isinstance(target, torch.nn.Module) else (root, name)
+
+def _install_vision_tap(wrapper, family: str) -> bool:
+    for dotted in VISION_ENTRY.get(family, ()):
+        found = _resolve(wrapper.model, dotted)
+        if found is not None:
+            break
+    else:
+        log_line(SCRIPT, f"ℹ️  Embedding cache not supported for {wrapper.model_id} (no vision entry point found)")
+        wrapper.embed_cache = None
+        return False
+    owner, name = found
+    original = getattr(owner, name)
+
+    def tapped(*args, **kwargs):
+        key, cache = wrapper._vision_key, wrapper.embed_cache
+        if key is None or cache is None:
+            return original(*args, **kwargs)
+        hit = cache.get(key)
+        if hit is not None:
+            arrays, spec = hit
+            tensors = [torch.from_numpy(a).view(getattr(torch, d)).to(wrapper._vision_device)
+                       for a, d in zip(arrays, spec["dtypes"])]
+            return _unflatten(spec["out"], tensors)
+        out = original(*args, **kwargs)
+        tensors: List[torch.Tensor] = []
+        try:
+            layout = _flatten(out, tensors)
+        except TypeError as e:
+            log_line(SCRIPT, f"ℹ️  Embedding cache disabled for {wrapper.model_id} ({e})")
+            wrapper.embed_cache = None
+            return out
+        if tensors:
+            wrapper._vision_device = tensors[0].device
+        # numpy has no bfloat16: store the raw 16-bit pattern and view it back on load
+        arrays = [t.detach().cpu().view(torch.int16).numpy() if t.dtype == torch.bfloat16
+                  else t.detach().cpu().numpy() for t in tensors]
+        cache.put(key, arrays, {"out": layout, "dtypes": [str(t.dtype).replace("torch.", "") for t in tensors]})
+        return out
+
+    setattr(owner, name, tapped)
+    if wrapper._vision_device is None:
+        wrapper._vision_device = next(wrapper.model.parameters()).device
+    return True
+
+@contextlib.contextmanager
+def vision_cached(wrapper, family: str, image: Optional[Image.Image], settings: str = ""):
+    """Serve the vision entry point from wrapper.embed_cache for one generate() call on `image`."""
+    if image is None or wrapper.embed_cache is None or (
+            not wrapper._vision_tapped and not _install_vision_tap(wrapper, family)):
+        yield
+        return
+    wrapper._vision_tapped = True
+    wrapper._vision_key = digest("vision", wrapper.model_id, settings, image_digest(image))
+    try:
+        yield
+    finally:
+        wrapper._vision_key = None
+
+# ---------- wrappers ----------
+#
+# tensor_cache (a tensor_cache.TensorCache, off by default) skips image
+# preprocessing on repeat runs: the image part of the processor output is
+# cached and only the prompt is tokenized. Any failure on that path switches
+# the cache off for the wrapper and falls back to the plain processor call.
+
+class QwenVLModel:
+    tensor_cache = None
+    embed_cache = None
+    profiler = None                  # stage_profiler.StageProfiler, set by the runner
+    _vision_key = _vision_device = None
+    _vision_tapped = False
+
+    def __init__(self, model_id: str, device: str, pixel_budget: Optional[Dict[str, int]] = None,
+                 draft_model_id: Optional[str] = None, perf_profile: Any = None):
+        self.model_id = model_id
+        self.device = device
+        self.perf = resolve_perf_profile(perf_profile)
+        self.last_stats: Dict[str, int] = {}
+        log_line(SCRIPT, f"🔹 Loading: {model_id}")
+
+        # Processor
+        self.processor = AutoProcessor.from_pretrained(
+            model_id, trust_remote_code=True, use_fast=True
+        )
+
+        self.model = self._load_model(model_id, device, **load_kwargs(self.perf))
+        apply_perf_profile(self.model, self.perf, model_id)
+        self._default_pixels = self._pixel_range()
+        if pixel_budget:
+            self.set_pixel_budget(**pixel_budget)
+
+        self.draft = None
+        self.draft_model_id = None
+        self.speculative = True
+        if draft_model_id:
+            self.load_draft(draft_model_id)
+
+    @staticmethod
+    def _load_model(model_id: str, device: str, **kwargs):
+        # Model: prefer ImageTextToText, then Vision2Seq
+        try:
+            model = AutoModelForImageTextToText.from_pretrained(
+                model_id,
+                trust_remote_code=True,
+                dtype=(torch.float16 if device == "cuda" else torch.float32),
+                device_map=device_map_for(device),
+                **kwargs,
+            )
+        except Exception as e1:
+            log_line(SCRIPT, f"ℹ️  ImageTextToText failed ({e1.__class__.__name__}). Falling back to Vision2Seq...")
+            model = AutoModelForVision2Seq.from_pretrained(
+                model_id,
+                trust_remote_code=True,
+                dtype=(torch.float16 if device == "cuda" else torch.float32),
+                device_map=device_map_for(device),
+                **kwargs,
+            )
+
+        # Greedy defaults
+        if hasattr(model, "generation_config") and isinstance(model.generation_config, GenerationConfig):
+            gc = model.generation_config
+            gc.do_sample = False; gc.temperature = 1.0; gc.top_p = 1.0; gc.top_k = 0; gc.num_beams = 1
+
+        model.eval()
+        return model
+
+    # Speculative (assisted) decoding: a smaller sibling proposes tokens and the
+    # target checks them in one forward pass. Under greedy decoding the target
+    # keeps the argmax at every position, so the text is the target's own.
+    # The draft gets the same pixel_values/grid inputs, so it must share the
+    # processor (same Qwen-VL generation, same tokenizer).
+    def load_draft(self, draft_model_id: str, num_assistant_tokens: Optional[int] = None) -> None:
+        log_line(SCRIPT, f"🔹 Loading draft: {draft_model_id}")
+        draft = self._load_model(draft_model_id, self.device, **load_kwargs(self.perf))
+        if draft.config.get_text_config().vocab_size != self.model.config.get_text_config().vocab_size:
+            raise ValueError(f"Draft {draft_model_id} does not share the vocabulary of {self.model_id}")
+        if num_assistant_tokens:
+            draft.generation_config.num_assistant_tokens = num_assistant_tokens
+        if self.perf.get("static_cache"):
+            log_line(SCRIPT, "ℹ️  Static KV cache is not used with a draft model; keeping the dynamic cache")
+            for m in (self.model, _decoder(self.model)):
+                if isinstance(getattr(m, "generation_config", None), GenerationConfig):
+                    m.generation_config.cache_implementation = None
+        for h in getattr(self, "_spec_hooks", []):
+            h.remove()
+        self.draft, self.draft_model_id = draft, draft_model_id
+        # verification passes of the target / single-token steps of the draft
+        self._spec_counts = {"target": 0, "draft": 0}
+        self._spec_hooks = [self.model.register_forward_pre_hook(lambda m, a: self._count_pass("target")),
+                            self.draft.register_forward_pre_hook(lambda m, a: self._count_pass("draft"))]
+
+    def _count_pass(self, which: str) -> None:
+        self._spec_counts[which] += 1
+
+    # The image processor resizes every image to min_pixels <= h*w <= max_pixels
+    # (aspect kept), and each (patch_size*merge_size)^2 pixels become one visual
+    # token, so these bounds fix the prefill cost per slide.
+    def _pixel_range(self) -> Tuple[int, int]:
+        ip = self.processor.image_processor
+        size = getattr(ip, "size", None)
+        if isinstance(size, dict) and "longest_edge" in size:
+            return size["shortest_edge"], size["longest_edge"]
+        return ip.min_pixels, ip.max_pixels
+
+    def pixels_per_token(self) -> int:
+        ip = self.processor.image_processor
+        return (ip.patch_size * ip.merge_size) ** 2
+
+    def set_pixel_budget(self, min_pixels: Optional[int] = None, max_pixels: Optional[int] = None,
+                         min_visual_tokens: Optional[int] = None,
+                         max_visual_tokens: Optional[int] = None) -> Tuple[int, int]:
+        """Bound the resized image area; unset bounds fall back to the processor defaults."""
+        lo, hi = self._default_pixels
+        if min_pixels:
+            lo = min_pixels
+        if max_pixels:
+            hi = max_pixels
+        if min_visual_tokens:
+            lo = max(lo, min_visual_tokens * self.pixels_per_token())
+        if max_visual_tokens:
+            hi = min(hi, max_visual_tokens * self.pixels_per_token())
+        if lo > hi:
+            raise ValueError(f"Empty pixel budget for {self.model_id}: min {lo} > max {hi}")
+        ip = self.processor.image_processor
+        # older processors read min_pixels/max_pixels, newer ones size; keep both in step
+        ip.min_pixels, ip.max_pixels = lo, hi
+        if isinstance(getattr(ip, "size", None), dict) and "longest_edge" in ip.size:
+            ip.size = {"shortest_edge": lo, "longest_edge": hi}
+        return lo, hi
+
+    def visual_tokens(self, image: Optional[Image.Image]) -> int:
+        """Visual tokens the processor will emit for image (smart_resize arithmetic)."""
+        if image is None:
+            return 0
+        lo, hi = self._pixel_range()
+        f = int(math.sqrt(self.pixels_per_token()))
+        w, h = image.size
+        h_bar, w_bar = max(f, round(h / f) * f), max(f, round(w / f) * f)
+        if h_bar * w_bar > hi:
+            beta = math.sqrt(h * w / hi)
+            h_bar, w_bar = max(f, math.floor(h / beta / f) * f), max(f, math.floor(w / beta / f) * f)
+        elif h_bar * w_bar < lo:
+            beta = math.sqrt(lo / (h * w))
+            h_bar, w_bar = math.ceil(h * beta / f) * f, math.ceil(w * beta / f) * f
+        return (h_bar // f) * (w_bar // f)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.processor.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def _chat_text(self, image: Optional[Image.Image], prompt_text: str) -> str:
+        # Qwen chat-format with an image + text
+        messages = [
+            {"role": "system", "content": "You are a helpful AI for medical imaging."},
+            {"role": "user", "content": ([{"type": "image"}] if image is not None else [])
+                                        + [{"type": "text", "text": prompt_text}]}
+        ]
+        return self.processor.apply_chat_template(messages, add_generation_prompt=True)
+
+    @torch.no_grad()
+    def generate_batch(self, images: List[Optional[Image.Image]], prompt_texts: List[str],
+                       gen_kw: Dict[str, Any]) -> List[str]:
+        # no draft (assisted generation is single-sequence) and no per-image caches here
+        t0 = time.perf_counter()
+        with timed(self.profiler, "preprocess"):
+            texts = [self._chat_text(img, p) for img, p in zip(images, prompt_texts)]
+            self.processor.tokenizer.padding_side = "left"
+            imgs = [img for img in images if img is not None]
+            inputs = self.processor(text=texts, images=imgs or None, return_tensors="pt", padding=True).to(self.device)
+        prep_s = time.perf_counter() - t0
+        with timed(self.profiler, "generate"):
+            output_ids = self.model.generate(**inputs, **sanitize_gen_kwargs(self.model, gen_kw))
+        self.last_stats = dict(token_stats(inputs, output_ids, self.processor.tokenizer), preprocess_s=prep_s)
+        with timed(self.profiler, "decode"):
+            return [t.strip() for t in self.processor.batch_decode(output_ids, skip_special_tokens=True)]
+
+    @torch.no_grad()
+    def generate(self, image: Optional[Image.Image], prompt_text: str, gen_kw: Dict[str, Any]) -> str:
+        with timed(self.profiler, "preprocess"):
+            text = self._chat_text(image, prompt_text)
+
+            # Build inputs
+            inputs = None
+            if self.tensor_cache is not None and image is not None:
+                try:
+                    inputs = self._inputs_from_cache(text, image)
+                except Exception as e:
+                    _cache_failed(self, e)
+            if inputs is None:
+                inputs = self.processor(
+                    text=[text],
+                    images=[image] if image is not None else None,
+                    return_tensors="pt"
+                ).to(self.device)
+
+        # Sanitize kwargs
+        gen_kw_sanitized = sanitize_gen_kwargs(self.model, gen_kw)
+        # only greedy single-beam decoding keeps assisted outputs identical
+        assisted = (self.draft is not None and self.speculative and not gen_kw_sanitized.get("do_sample")
+                    and gen_kw_sanitized.get("num_beams", 1) == 1)
+        if assisted:
+            gen_kw_sanitized["assistant_model"] = self.draft
+            self._spec_counts = {"target": 0, "draft": 0}
+
+        # Generate
+        with timed(self.profiler, "generate"), \
+                vision_cached(self, "qwen", image, config_digest(self.processor.image_processor)):
+            output_ids = self.model.generate(**inputs, **gen_kw_sanitized)
+        n_prompt = inputs["input_ids"].shape[1]
+        self.last_stats = {
+            "visual_tokens": (int(inputs["image_grid_thw"][0].prod()) // (self.processor.image_processor.merge_size ** 2)
+                              if "image_grid_thw" in inputs else 0),
+            "prompt_tokens": n_prompt,
+            "new_tokens": output_ids.shape[1] - n_prompt,
+        }
+        if assisted:
+            # each target pass accepts some drafted tokens and adds one of its own
+            passes, drafted = self._spec_counts["target"], self._spec_counts["draft"]
+            self.last_stats.update({
+                "target_passes": passes,
+                "draft_tokens": drafted,
+                "accepted_tokens": max(self.last_stats["new_tokens"] - passes, 0),
+            })
+        with timed(self.profiler, "decode"):
+            out_text = self.processor.batch_decode(output_ids, skip_special_tokens=True)[0]
+        return out_text.strip()
+
+    def _inputs_from_cache(self, text: str, image: Image.Image) -> Dict[str, torch.Tensor]:
+        img = cached_image_tensors(
+            self, image, lambda: self.processor.image_processor(images=[image], return_tensors="pt"))
+        # expand the single image placeholder to one token per merged patch, as the processor does
+        n_tokens = int(img["image_grid_thw"][0].prod()) // (self.processor.image_processor.merge_size ** 2)
+        tok = self.processor.image_token
+        text = text.replace(tok, "<|placeholder|>" * n_tokens, 1).replace("<|placeholder|>", tok)
+        enc = self.processor.tokenizer([text], return_tensors="pt")
+        return {k: v.to(self.device) for k, v in {**enc, **img}.items()}
+
+class InternVLModel:
+    tensor_cache = None
+    embed_cache = None
+    profiler = None
+    last_stats: Dict[str, int] = {}
+    _vision_key = _vision_device = None
+    _vision_tapped = False
+
+    def __init__(self, model_id: str, device: str, perf_profile: Any = None):
+        self.model_id = model_id
+        self.device = device
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=True, use_fast=False)
+        self.perf = resolve_perf_profile(perf_profile)
+        # the remote code picks flash-attn or eager itself (use_flash_attn); with a
+        # profile, load eager and switch the decoder's dispatch afterwards
+        self.model = AutoModel.from_pretrained(
+            model_id,
+            trust_remote_code=True,
+            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+            device_map=device_map_for(device),
+            **({"use_flash_attn": False} if self.perf.get("attn") else {})
+        )
+        if self.perf.get("attn") and _decoder(self.model) is not None:
+            _decoder(self.model).config._attn_implementation = self.perf["attn"]
+        apply_perf_profile(self.model, self.perf, model_id)
+        self.model.eval()
+
+    def _load_image(self, image_path: str, input_size=448, max_num=12):
+        IMAGENET_MEAN = (0.485, 0.456, 0.406)
+        IMAGENET_STD = (0.229, 0.224, 0.225)
+
+        def build_transform(input_size):
+            return T.Compose([
+                T.Lambda(lambda img: img.convert('RGB') if img.mode != 'RGB' else img),
+                T.Resize((input_size, input_size), interpolation=InterpolationMode.BICUBIC),
+                T.ToTensor(),
+                T.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+            ])
+
+        def find_closest_aspect_ratio(aspect_ratio, target_ratios, width, height, image_size):
+            best_ratio_diff = float('inf')
+            best_ratio = (1, 1)
+            area = width * height
+            for ratio in target_ratios:
+                target_aspect_ratio = ratio[0] / ratio[1]
+                ratio_diff = abs(aspect_ratio - target_aspect_ratio)
+                if ratio_diff < best_ratio_diff:
+                    best_ratio_diff = ratio_diff
+                    best_ratio = ratio
+                elif ratio_diff == best_ratio_diff:
+                    if area > 0.5 * image_size * image_size * ratio[0] * ratio[1]:
+                        best_ratio = ratio
+            return best_ratio
+
+        def dynamic_preprocess(image, min_num=1, max_num=12, image_size=448, use_thumbnail=False):
+            orig_width, orig_height = image.size
+            aspect_ratio = orig_width / orig_height
+            target_ratios = set(
+                (i, j) for n in range(min_num, max_num + 1)
+                for i in range(1, n + 1)
+                for j in range(1, n + 1)
+                if i * j <= max_num and i * j >= min_num
+            )
+            target_ratios = sorted(target_ratios, key=lambda x: x[0] * x[1])
+            target_aspect_ratio = find_closest_aspect_ratio(
+                aspect_ratio, target_ratios, orig_width, orig_height, image_size
+            )
+            target_width = image_size * target_aspect_ratio[0]
+            target_height = image_size * target_aspect_ratio[1]
+            blocks = target_aspect_ratio[0] * target_aspect_ratio[1]
+            resized_img = image.resize((target_width, target_height))
+            processed_images = []
+            for i in range(blocks):
+                box = (
+                    (i % (target_width // image_size)) * image_size,
+                    (i // (target_width // image_size)) * image_size,
+                    ((i % (target_width // image_size)) + 1) * image_size,
+                    ((i // (target_width // image_size)) + 1) * image_size
+                )
+                split_img = resized_img.crop(box)
+                processed_images.append(split_img)
+            assert len(processed_images) == blocks
+            if use_thumbnail and len(processed_images) != 1:
+                thumbnail_img = image.resize((image_size, image_size))
+                processed_images.append(thumbnail_img)
+            return processed_images
+
+        image = Image.open(image_path).convert('RGB')
+        transform = build_transform(input_size=input_size)
+        images = dynamic_preprocess(image, image_size=input_size, use_thumbnail=True, max_num=max_num)
+        pixel_values = [transform(img) for img in images]
+        pixel_values = torch.stack(pixel_values)
+        return pixel_values
+
+
+    def _pixel_values(self, image: Image.Image, input_size: int = 448, max_num: int = 12) -> torch.Tensor:
+        # tiles are cut from a JPEG round-trip of the image, as they always were
+        def compute():
+            with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
+                image.save(tmp.name)
+                tmp_path = tmp.name
+            try:
+                return {"pixel_values": self._load_image(tmp_path, input_size=input_size, max_num=max_num)}
+            finally:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+
+        if self.tensor_cache is not None:
+            try:
+                return cached_image_tensors(self, image, compute, f"jpg|{input_size}|{max_num}")["pixel_values"]
+            except Exception as e:
+                _cache_failed(self, e)
+        return compute()["pixel_values"]
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def visual_tokens(self, image: Optional[Image.Image], input_size: int = 448, max_num: int = 12) -> int:
+        """Tiles dynamic_preprocess will cut (+ thumbnail) × tokens per tile."""
+        if image is None:
+            return 0
+        w, h = image.size
+        ratios = sorted({(i, j) for i in range(1, max_num + 1) for j in range(1, max_num + 1) if i * j <= max_num},
+                        key=lambda r: r[0] * r[1])
+        best, best_diff = (1, 1), float("inf")
+        for r in ratios:
+            diff = abs(w / h - r[0] / r[1])
+            if diff < best_diff:
+                best, best_diff = r, diff
+            elif diff == best_diff and w * h > 0.5 * input_size * input_size * r[0] * r[1]:
+                best = r
+        tiles = best[0] * best[1]
+        return (tiles + (tiles != 1)) * getattr(self.model, "num_image_token", 256)
+
+    @torch.no_grad()
+    def generate_batch(self, images: List[Optional[Image.Image]], prompt_texts: List[str],
+                       gen_kw: Dict[str, Any]) -> List[str]:
+        # errors propagate here (generate() swallows them) so callers can split on OOM
+        if images[0] is None:
+            # chat() takes one pure-text turn at a time
+            responses, stats = [], {"prompt_tokens": 0, "new_tokens": 0}
+            for p in prompt_texts:
+                responses.append(self._generate(None, p, gen_kw))
+                for k in stats:
+                    stats[k] += self.last_stats[k]
+            self.last_stats = stats
+            return responses
+        t0 = time.perf_counter()
+        with timed(self.profiler, "preprocess"):
+            dtype = getattr(self.model, 'dtype', torch.float16)
+            tiles = [self._pixel_values(img, input_size=448, max_num=12) for img in images]
+            pixel_values = torch.cat(tiles).to(dtype).to(self.device)
+        prep_s = time.perf_counter() - t0          # image side only; batch_chat tokenizes internally
+        generation_config = dict(
+            max_new_tokens=gen_kw.get('max_new_tokens', 256),
+            do_sample=gen_kw.get('do_sample', False)
+        )
+        # batch_chat tokenizes, generates and decodes in one call: all of it is "generate"
+        with timed(self.profiler, "generate"):
+            responses = self.model.batch_chat(
+                self.tokenizer,
+                pixel_values,
+                num_patches_list=[t.shape[0] for t in tiles],
+                questions=['<image>\n' + p for p in prompt_texts],
+                generation_config=generation_config
+            )
+        # chat() / batch_chat() return text only; count tokens back from it
+        self.last_stats = {
+            "prompt_tokens": sum(self.count_tokens(p) + self.visual_tokens(img) for img, p in zip(images, prompt_texts)),
+            "new_tokens": sum(self.count_tokens(r) for r in responses),
+            "preprocess_s": prep_s,
+        }
+        return [r.strip() for r in responses]
+
+    def _generate(self, image: Optional[Image.Image], prompt_text: str, gen_kw: Dict[str, Any]) -> str:
+        """One chat() turn; errors propagate (generate() is the catch-all entry point)."""
+        with timed(self.profiler, "preprocess"):
+            if image is not None:
+                pixel_values = self._pixel_values(image, input_size=448, max_num=12)
+                dtype = getattr(self.model, 'dtype', torch.float16)
+                pixel_values = pixel_values.to(dtype).to(self.device)
+                question = '<image>\n' + prompt_text
+            else:
+                pixel_values, question = None, prompt_text   # chat() handles pure-text turns
+        generation_config = dict(
+            max_new_tokens=gen_kw.get('max_new_tokens', 256),
+            do_sample=gen_kw.get('do_sample', False)
+        )
+        with timed(self.profiler, "generate"), vision_cached(self, "intern", image, "jpg|448|12"):
+            response = self.model.chat(
+                self.tokenizer,
+                pixel_values,
+                question,
+                generation_config
+            )
+        self.last_stats = {"prompt_tokens": self.count_tokens(prompt_text) + self.visual_tokens(image),
+                           "new_tokens": self.count_tokens(response)}
+        return response.strip()
+
+    @torch.no_grad()
+    def generate(self, image: Optional[Image.Image], prompt_text: str, gen_kw: Dict[str, Any]):
+        try:
+            return self._generate(image, prompt_text, gen_kw)
+        except Exception as e:
+            log_line(SCRIPT, f"❌ InternVL generation failed: {e}")
+            return ""
+
+class LLaVAOneVisionModel:
+    # anyres: how many image tokens the prompt gets is decided inside the
+    # processor from the image size, so there is no separable image part to cache
+    tensor_cache = None
+    embed_cache = None
+    profiler = None
+    last_stats: Dict[str, int] = {}
+    _vision_key = _vision_device = None
+    _vision_tapped = False
+
+    def __init__(self, model_id: str, device: str, perf_profile: Any = None):
+        self.model_id = model_id
+        self.device = device
+        self.processor = AutoProcessor.from_pretrained(model_id, trust_remote_code=True)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=True)
+        self.perf = resolve_perf_profile(perf_profile)
+        self.model = LlavaOnevisionForConditionalGeneration.from_pretrained(
+            model_id,
+            trust_remote_code=True,
+            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+            device_map=device_map_for(device),
+            **load_kwargs(self.perf)
+        )
+        apply_perf_profile(self.model, self.perf, model_id)
+        self.model.eval()
+
+    def visual_tokens(self, image: Optional[Image.Image]) -> int:
+        """Upper bound: anyres_max_9 = base view + up to 9 crops of (image_size/patch_size)^2 tokens."""
+        if image is None:
+            return 0
+        vc = self.model.config.vision_config
+        return 10 * (vc.image_size // vc.patch_size) ** 2
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.processor.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    @torch.no_grad()
+    def generate_batch(self, images: List[Optional[Image.Image]], prompt_texts: List[str],
+                       gen_kw: Dict[str, Any]) -> List[str]:
+        t0 = time.perf_counter()
+        with timed(self.profiler, "preprocess"):
+            prompts = [
+                self.processor.apply_chat_template([{
+                    "role": "user",
+                    "content": ([{"type": "image"}] if img is not None else []) + [{"type": "text", "text": p}],
+                }], add_generation_prompt=True)
+                for img, p in zip(images, prompt_texts)
+            ]
+            self.processor.tokenizer.padding_side = "left"
+            imgs = [img for img in images if img is not None]
+            inputs = self.processor(images=imgs or None, text=prompts, padding=True, return_tensors="pt")
+            inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+        prep_s = time.perf_counter() - t0
+        with timed(self.profiler, "generate"):
+            output_ids = self.model.generate(**inputs, **sanitize_gen_kwargs(self.model, gen_kw))
+        self.last_stats = dict(token_stats(inputs, output_ids, self.processor.tokenizer), preprocess_s=prep_s)
+        with timed(self.profiler, "decode"):
+            return [self.processor.decode(o, skip_special_tokens=True).strip() for o in output_ids]
+
+    @torch.no_grad()
+    def generate(self, image: Optional[Image.Image], prompt_text: str, gen_kw: Dict[str, Any]) -> str:
+        conversation = [
+            {
+                "role": "user",
+                "content": ([{"type": "image", "image": image}] if image is not None else []) + [
+                    {"type": "text", "text": prompt_text}
+                ]
+            }
+        ]
+        with timed(self.profiler, "preprocess"):
+            inputs = self.processor.apply_chat_template(
+                conversation,
+                add_generation_prompt=True,
+                tokenize=True,
+                return_tensors="pt",
+            )
+            # Check inputs type:
+            if isinstance(inputs, torch.Tensor):
+                # wrap into dict with input_ids as example (adjust if needed)
+                inputs = {"input_ids": inputs.to(self.model.device)}
+            else:
+                inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+
+        gen_kwargs = sanitize_gen_kwargs(self.model, gen_kw)
+        with timed(self.profiler, "generate"), \
+                vision_cached(self, "llava", image, config_digest(self.processor.image_processor)):
+            output_ids = self.model.generate(**inputs, **gen_kwargs)
+        self.last_stats = token_stats(inputs, output_ids, self.processor.tokenizer)
+        with timed(self.profiler, "decode"):
+            response = self.processor.decode(output_ids[0], skip_special_tokens=True)
+        return response.strip()
+
+class Idefics2Model:
+    tensor_cache = None
+    embed_cache = None
+    profiler = None
+    last_stats: Dict[str, int] = {}
+    _vision_key = _vision_device = None
+    _vision_tapped = False
+
+    def __init__(self, model_id: str, device: str, perf_profile: Any = None):
+        self.model_id = model_id
+        self.device = device
+        self.processor = AutoProcessor.from_pretrained(model_id, trust_remote_code=True)
+        self.perf = resolve_perf_profile(perf_profile)
+        self.model = AutoModelForVision2Seq.from_pretrained(
+            model_id,
+            trust_remote_code=True,
+            dtype=(torch.float16 if device == "cuda" else torch.float32),  # use 'dtype' (not deprecated)
+            device_map=device_map_for(device),
+            **load_kwargs(self.perf),
+        )
+        apply_perf_profile(self.model, self.perf, model_id)
+        self.model.eval()  # device_map handles placement
+
+    def visual_tokens(self, image: Optional[Image.Image]) -> int:
+        """image_seq_len per split; splitting cuts 4 crops + the full view."""
+        if image is None:
+            return 0
+        splits = 5 if getattr(self.processor.image_processor, "do_image_splitting", False) else 1
+        return splits * self.processor.image_seq_len
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.processor.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    @torch.no_grad()
+    def generate_batch(self, images: List[Optional[Image.Image]], prompt_texts: List[str],
+                       gen_kw: Dict[str, Any]) -> List[str]:
+        t0 = time.perf_counter()
+        with timed(self.profiler, "preprocess"):
+            with_images = images[0] is not None
+            self.processor.tokenizer.padding_side = "left"
+            inputs = self.processor(
+                text=[f"<image>\n{p}" if with_images else p for p in prompt_texts],
+                images=[[img] for img in images] if with_images else None,
+                return_tensors="pt",
+                padding=True,
+            )
+            inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+        prep_s = time.perf_counter() - t0
+        with timed(self.profiler, "generate"):
+            output_ids = self.model.generate(**inputs, **sanitize_gen_kwargs(self.model, gen_kw))
+        self.last_stats = dict(token_stats(inputs, output_ids, self.processor.tokenizer), preprocess_s=prep_s)
+        with timed(self.profiler, "decode"):
+            return [t.strip() for t in self.processor.batch_decode(output_ids, skip_special_tokens=True)]
+
+    @torch.no_grad()
+    def generate(self, image: Optional[Image.Image], prompt_text: str, gen_kw: Dict[str, Any]) -> str:
+        # Idefics2 prompt format: prepend <image>
+        input_text = f"<image>\n{prompt_text}" if image is not None else prompt_text
+
+        with timed(self.profiler, "preprocess"):
+            inputs = None
+            if self.tensor_cache is not None and image is not None:
+                try:
+                    inputs = self._inputs_from_cache(input_text, image)
+                except Exception as e:
+                    _cache_failed(self, e)
+            if inputs is None:
+                inputs = self.processor(
+                    text=[input_text],
+                    images=[image] if image is not None else None,
+                    return_tensors="pt",
+                    padding=True,
+                )
+
+            # Send to correct device(s)
+            inputs = {k: v.to(self.model.device) for k, v in inputs.items()}
+
+        # Sanitize generation kwargs for this model
+        gen_kw_sanitized = sanitize_gen_kwargs(self.model, gen_kw)
+
+        with timed(self.profiler, "generate"), \
+                vision_cached(self, "idefics2", image, config_digest(self.processor.image_processor)):
+            output_ids = self.model.generate(**inputs, **gen_kw_sanitized)
+        self.last_stats = token_stats(inputs, output_ids, self.processor.tokenizer)
+        with timed(self.profiler, "decode"):
+            output_text = self.processor.batch_decode(output_ids, skip_special_tokens=True)[0]
+        return output_text.strip()
+
+    def _inputs_from_cache(self, input_text: str, image: Image.Image) -> Dict[str, torch.Tensor]:
+        img = cached_image_tensors(
+            self, image, lambda: self.processor.image_processor(images=[image], return_tensors="pt"))
+        # the processor expands <image> into image_seq_len tokens per split without needing pixels
+        enc = self.processor(text=[input_text], return_tensors="pt", padding=True)
+        image_id = self.processor.tokenizer.convert_tokens_to_ids(self.processor.image_token.content)
+        n_tokens = int((enc["input_ids"] == image_id).sum())
+        expected = img["pixel_values"].shape[1] * self.processor.image_seq_len
+        if n_tokens != expected:
+            raise ValueError(f"{n_tokens} image tokens in prompt, {expected} expected")
+        return {**enc, **img}
+
+# ---------- family registry ----------
+
+# family -> (wrapper, model-id prefixes)
+FAMILIES = {
+    "qwen":     (QwenVLModel,         ("Qwen/",)),
+    "intern":   (InternVLModel,       ("OpenGVLab/",)),
+    "llava":    (LLaVAOneVisionModel, ("llava-hf/",)),
+    "idefics2": (Idefics2Model,       ("HuggingFaceM4/idefics2",)),
+    "scripted": (ScriptedVLM,         ("scripted/",)),
+}
+
+def family_for(model_id: str) -> Optional[str]:
+    for fam, (_, prefixes) in FAMILIES.items():
+        if model_id.startswith(prefixes):
+            return fam
+    return None
+
+def load_wrapper(model_id: str, device: str, family: Optional[str] = None, **kwargs):
+    """kwargs go to the wrapper's constructor (e.g. pixel_budget for Qwen)."""
+    fam = family or family_for(model_id)
+    if fam not in FAMILIES:
+        raise ValueError(f"No wrapper for model {model_id!r}")
+    return FAMILIES[fam][0](model_id, device, **kwargs)
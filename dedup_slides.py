@@ -0,0 +1,61 @@
+# dedup_slides.py
+import os, re
+from typing import List
+
+from shared_config import MILU, log_line
+from job_queue import RUNNER_SCRIPTS, load_runner_config
+from slide_dedup import HAMMING_THRESHOLD, find_duplicates, hash_lecture, write_dedup_map
+
+SCRIPT = "dedup_slides"
+
+# Writes Lecture N/slide_dedup.json for every lecture. Runners (and queue
+# workers) then copy a duplicate slide's record from its canonical slide
+# instead of generating it, tagging it with "reused_from".
+THRESHOLD = HAMMING_THRESHOLD      # max differing dHash bits (of 64) between duplicates
+CROSS_LECTURE = False              # also match slides repeated in other lectures
+
+def list_lectures(base: str) -> List[str]:
+    out = []
+    for name in os.listdir(base):
+        p = os.path.join(base, name)
+        if name.lower().startswith("lecture ") and os.path.isdir(p):
+            out.append(name)
+    out.sort(key=lambda x: int(re.findall(r"\d+", x)[-1]))
+    return out
+
+def generations_per_slide(lecture_dir: str) -> int:
+    """models × prompts over the runner scripts present in the lecture."""
+    n = 0
+    for fam, script in RUNNER_SCRIPTS.items():
+        if os.path.isfile(os.path.join(lecture_dir, script)):
+            cfg = load_runner_config(lecture_dir, fam)
+            n += len(cfg["models"]) * len(cfg["prompts"])
+    return n
+
+def main():
+    lectures = list_lectures(MILU)
+    hashed = [(lec, hash_lecture(os.path.join(MILU, lec))) for lec in lectures]
+    dups = find_duplicates(hashed, threshold=THRESHOLD, cross_lecture=CROSS_LECTURE)
+
+    n_slides = n_dups = saved = 0
+    for lec, slides in hashed:
+        if not slides:
+            continue
+        lec_dir = os.path.join(MILU, lec)
+        d = dups.get(lec, {})
+        write_dedup_map(lec_dir, slides, d, THRESHOLD)
+        per_slide = generations_per_slide(lec_dir)
+        n_slides += len(slides)
+        n_dups += len(d)
+        saved += len(d) * per_slide
+        if d:
+            pairs = ", ".join(f"{sid}→{v['canonical']['slide_id']}" for sid, v in list(d.items())[:6])
+            log_line(SCRIPT, f"{lec}: {len(d)}/{len(slides)} duplicates "
+                             f"({len(d) * per_slide} generations saved) — {pairs}{' …' if len(d) > 6 else ''}")
+
+    log_line(SCRIPT, f"✅ {n_dups}/{n_slides} slides reuse a canonical slide "
+                     f"(threshold {THRESHOLD} bits{', cross-lecture' if CROSS_LECTURE else ''})")
+    log_line(SCRIPT, f"✅ GPU generate() calls saved per full pass: {saved}")
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,18 @@
 # superlearner_fusion.py
 import os, json
-from collections import Counter, defaultdict
 from tqdm import tqdm
 
+from shared_config import SELECTED_MODELS, log_line
+from fusion_engine import ThresholdVote, fuse_corpus
+
+SCRIPT = "superlearner_fusion"
+
 ROOT = os.path.join("MILU23", "data", "by_slide")
 OUT_DIR = os.path.join("MILU23", "data", "superlearner")
 os.makedirs(OUT_DIR, exist_ok=True)
 
-MODELS = [
-    "OpenGVLab__InternVL3-8B",
-    "OpenGVLab__InternVL3-14B",
-    "Qwen__Qwen2-VL-7B-Instruct",
-    "Qwen__Qwen3-VL-4B-Instruct",
-]
+# same model set and voting engine as fuse_models_multi
+MODELS = SELECTED_MODELS
 
 def read_json(path):
     try:
@@ -31,46 +31,56 @@ def unique_key_triple(t):
         t.get("o", "").lower().strip(),
     )
 
-def fuse_slide(model_data_list):
-    """Combine outputs from multiple models by majority vote."""
-    all_concepts, all_triples = [], []
-    for d in model_data_list:
-        if not d or "parsed" not in d: 
-            continue
-        parsed = d["parsed"]
+def _parsed_lists(d):
+    """(concepts, triples) lists from a model entry: flat {"parsed": ...} or by_slide layout."""
+    concepts, triples = [], []
+    blocks = [d] if "parsed" in d else [d.get("concepts"), d.get("triples")]
+    for b in blocks:
+        parsed = b.get("parsed") if isinstance(b, dict) else None
         if isinstance(parsed, dict):
             if "concepts" in parsed and isinstance(parsed["concepts"], list):
-                all_concepts.extend(parsed["concepts"])
+                concepts.extend(parsed["concepts"])
             if "triples" in parsed and isinstance(parsed["triples"], list):
-                all_triples.extend(parsed["triples"])
-
-    fused = {"concepts": [], "triples": []}
-
-    # Majority vote for concepts
-    term_counts = Counter(unique_key_concept(c) for c in all_concepts if c)
-    for key, count in term_counts.items():
-        if count >= 2:
-            fused["concepts"].append({"term": key[0], "category": key[1]})
-
-    # Majority vote for triples
-    triple_counts = Counter(unique_key_triple(t) for t in all_triples if t)
-    for key, count in triple_counts.items():
-        if count >= 2:
-            fused["triples"].append({"s": key[0], "p": key[1], "o": key[2]})
-
-    return fused
+                triples.extend(parsed["triples"])
+    return concepts, triples
+
+def fuse_slides(slides, rule=None):
+    """
+    Combine the models' outputs for many slides by vote (default: majority,
+    >= 2 models). slides[i] maps model -> its entry in the slide file; all
+    slides go through one fuse_corpus pass for concepts and one for triples.
+    """
+    rule = rule or ThresholdVote(2)
+    conc_votes, trip_votes = [], []
+    for per_model in slides:
+        conc, trip = {}, {}
+        for m, d in per_model.items():
+            if not d:
+                continue
+            concepts, triples = _parsed_lists(d)
+            conc[m] = {unique_key_concept(c) for c in concepts if c}
+            trip[m] = {unique_key_triple(t) for t in triples if t}
+        conc_votes.append(conc)
+        trip_votes.append(trip)
+
+    fused_c = fuse_corpus(conc_votes, MODELS, rule)
+    fused_t = fuse_corpus(trip_votes, MODELS, rule)
+    return [{"concepts": [{"term": term, "category": category} for term, category in keys_c],
+             "triples": [{"s": s, "p": p, "o": o} for s, p, o in keys_t]}
+            for keys_c, keys_t in zip(fused_c, fused_t)]
 
 def run():
     total_slides = 0
+    outputs, slides = [], []      # (out_path, slide_id) and per-model data, fused together at the end
     for lecture in sorted(os.listdir(ROOT)):
         lec_path = os.path.join(ROOT, lecture)
         if not os.path.isdir(lec_path):
             continue
-        slides = [f for f in os.listdir(lec_path) if f.endswith(".json")]
+        slide_files = [f for f in os.listdir(lec_path) if f.endswith(".json")]
         out_lec = os.path.join(OUT_DIR, lecture)
         os.makedirs(out_lec, exist_ok=True)
 
-        for slide_file in tqdm(slides, desc=lecture):
+        for slide_file in tqdm(slide_files, desc=lecture):
             total_slides += 1
             slide_path = os.path.join(lec_path, slide_file)
             # each slide file should contain per-model outputs under parsed
@@ -78,15 +88,15 @@ def run():
             if not data or "models" not in data:
                 continue
 
-            model_data = [data["models"].get(m) for m in MODELS if m in data["models"]]
-            fused = fuse_slide(model_data)
+            outputs.append((os.path.join(out_lec, slide_file), slide_file.replace(".json", "")))
+            slides.append({m: data["models"][m] for m in MODELS if m in data["models"]})
 
-            out_path = os.path.join(out_lec, slide_file)
-            with open(out_path, "w", encoding="utf-8") as f:
-                json.dump({"slide_id": slide_file.replace(".json", ""), "superlearner": fused}, f, indent=2)
+    for (out_path, slide_id), fused in zip(outputs, fuse_slides(slides)):
+        with open(out_path, "w", encoding="utf-8") as f:
+            json.dump({"slide_id": slide_id, "superlearner": fused}, f, indent=2)
 
-    print(f"✅ Superlearner fusion complete for {total_slides} slides.")
-    print(f"✅ Outputs saved in: {OUT_DIR}")
+    log_line(SCRIPT, f"✅ Superlearner fusion complete for {total_slides} slides.")
+    log_line(SCRIPT, f"✅ Outputs saved in: {OUT_DIR}")
 
 if __name__ == "__main__":
     run()
@@ -0,0 +1,38 @@
+# export_outputs.py
+import os, re
+from typing import List
+
+from shared_config import MILU, log_line
+from output_store import export_outputs, list_shards
+
+SCRIPT = "export_outputs"
+
+# Write every JSONL shard (Outputs/<model>/<prompt>.jsonl) back out as the
+# original per-slide files (Outputs/<model>/<prompt>/SlideN.json, indent=2)
+# for tools that still expect one file per slide.
+OVERWRITE = True
+
+def list_lectures(base: str) -> List[str]:
+    out = []
+    for name in os.listdir(base):
+        p = os.path.join(base, name)
+        if name.lower().startswith("lecture ") and os.path.isdir(p):
+            out.append(name)
+    out.sort(key=lambda x: int(re.findall(r"\d+", x)[-1]))
+    return out
+
+def main():
+    n_shards = n_files = 0
+    for lec in list_lectures(MILU):
+        out_root = os.path.join(MILU, lec, "Outputs")
+        shards = list_shards(out_root)
+        if not shards:
+            continue
+        written = export_outputs(out_root, overwrite=OVERWRITE)
+        log_line(SCRIPT, f"{lec}: {len(shards)} shards → {written} slide files")
+        n_shards += len(shards)
+        n_files += written
+    log_line(SCRIPT, f"✅ Exported {n_files} slide files from {n_shards} shards")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,31 @@
 # fuse_models_multi.py
 import os, json, re
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 
-from shared_config import BY_SLIDE_DIR, FUSION_PATH, SELECTED_MODELS, log_line
+from shared_config import (BY_SLIDE_DIR, FUSION_PATH, ANALYSIS_DIR, HUMAN_REF_DIR,
+                           SELECTED_MODELS, TERM_MATCHING, TERM_INDEX_PATH, TERM_SIMILARITY,
+                           log_line)
+from fusion_engine import ThresholdVote, WeightedVote, load_model_reliability, fuse_corpus
+from term_normalization import TermIndex, CanonicalInterner, tree_fingerprint
 
 SCRIPT = "fuse_models_multi"
 
+# ---------- fusion settings ----------
+# "threshold": keep items emitted by >= FUSION_MIN_VOTES models (original consensus)
+# "weighted":  per-model reliability weights, keep items reaching WEIGHTED_QUORUM of total weight
+FUSION_RULE = "threshold"
+FUSION_MIN_VOTES = 2
+WEIGHTED_QUORUM = 0.5
+# reliability source for "weighted": "superlearner" (superlearner_evaluation.csv)
+# or "human" (human_ref_eval_global_summary.csv)
+RELIABILITY_SOURCE = "superlearner"
+# scale each model's triple vote by the confidence it emitted for that triple, relative
+# to that model's mean confidence (so an average-confidence vote counts 1.0). Triples are
+# then kept by WeightedVote against the quorum (FUSION_MIN_VOTES / number of models for
+# "threshold"). Non-positive confidences (models often echo the template's 0.0) count
+# as the model's mean, i.e. as a plain vote.
+CONFIDENCE_WEIGHTED_TRIPLES = False
+
 def safe_jload(path: str):
     try:
         with open(path, "r", encoding="utf-8") as f:
@@ -88,60 +108,194 @@ def extract_triples(model_dict: Dict[str, Any]) -> List[str]:
             out.append(key)
     return sorted(set(out))
 
+def max_confidence(a: Optional[float], b: Optional[float]) -> Optional[float]:
+    return b if a is None else a if b is None else max(a, b)
+
+def extract_triple_confidences(model_dict: Dict[str, Any]) -> Dict[str, Optional[float]]:
+    """canon_triple key -> highest confidence the model emitted for it (None: no usable confidence)."""
+    tr = model_dict.get("triples")
+    parsed = tr.get("parsed") if isinstance(tr, dict) else None
+    if isinstance(parsed, dict):
+        items = parsed.get("triples") if isinstance(parsed.get("triples"), list) else [parsed]
+    elif isinstance(parsed, list):
+        items = parsed
+    else:
+        return {}
+
+    out: Dict[str, Optional[float]] = {}
+    for obj in items:
+        if not isinstance(obj, dict):
+            continue
+        key = canon_triple(obj)
+        if not key.strip("||"):
+            continue
+        try:
+            conf = float(obj.get("confidence") or 0.0)
+        except (TypeError, ValueError):
+            conf = 0.0
+        out[key] = max_confidence(out.get(key), min(conf, 1.0) if conf > 0 else None)
+    return out
+
+def relative_confidences(votes: List[Dict[str, Dict[str, Optional[float]]]]) -> List[Dict[str, Dict[str, float]]]:
+    """Divide each model's confidences by its corpus-wide mean; missing ones become 1.0 (a plain vote)."""
+    sums: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
+    for per_model in votes:
+        for m, confs in per_model.items():
+            for c in confs.values():
+                if c is not None:
+                    sums[m] = sums.get(m, 0.0) + c
+                    counts[m] = counts.get(m, 0) + 1
+    means = {m: sums[m] / counts[m] for m in sums}
+    return [{m: {k: (c / means[m] if c is not None else 1.0) for k, c in confs.items()}
+             for m, confs in per_model.items()} for per_model in votes]
+
+# ---------- term matching ----------
+
+def load_term_index(rebuild: bool = False) -> TermIndex:
+    """
+    Corpus-wide TermIndex over every concept and triple subject/object in by_slide.
+    Reused from TERM_INDEX_PATH while by_slide and TERM_SIMILARITY are unchanged.
+    """
+    fp = tree_fingerprint(BY_SLIDE_DIR)
+    idx = None if rebuild else TermIndex.load(TERM_INDEX_PATH)
+    if idx is not None and idx.fingerprint == fp and idx.threshold == TERM_SIMILARITY:
+        return idx
+
+    terms: List[str] = []
+    for lec in list_lectures(BY_SLIDE_DIR):
+        lec_dir = os.path.join(BY_SLIDE_DIR, lec)
+        for sf in list_slide_jsons(lec_dir):
+            j = safe_jload(os.path.join(lec_dir, sf))
+            if not j or "models" not in j:
+                continue
+            for md in j["models"].values():
+                if not isinstance(md, dict):
+                    continue
+                terms.extend(extract_concepts(md))
+                for key in extract_triples(md):
+                    s, _, o = key.split("||")
+                    terms.extend(x for x in (s, o) if x)
+
+    idx = TermIndex(threshold=TERM_SIMILARITY).build(terms)
+    idx.fingerprint = fp
+    idx.save(TERM_INDEX_PATH)
+    log_line(SCRIPT, f"Term index rebuilt: {len(idx.key_to_cid)} keys -> "
+                     f"{len(idx.canonical_forms)} canonical terms ({idx.n_merged()} merged)")
+    return idx
+
+def term_interners(mode: str = None
+                   ) -> Tuple[Optional[TermIndex], Optional[CanonicalInterner], Optional[CanonicalInterner]]:
+    """(index, concept interner, triple interner) for TERM_MATCHING; all None for "exact"."""
+    mode = mode or TERM_MATCHING
+    if mode == "exact":
+        return None, None, None
+    if mode == "fuzzy":
+        idx = load_term_index()
+        return idx, CanonicalInterner(idx.canonical), CanonicalInterner(idx.canonical_triple)
+    raise ValueError(f"Unknown TERM_MATCHING: {mode}")
+
 # ---------- fusion ----------
 
+def build_vote_rule(kind: str = None):
+    """Voting rule from the settings above (see fusion_engine for the rule classes)."""
+    kind = kind or FUSION_RULE
+    if kind == "threshold":
+        return ThresholdVote(FUSION_MIN_VOTES)
+    if kind == "weighted":
+        if RELIABILITY_SOURCE == "human":
+            path = os.path.join(HUMAN_REF_DIR, "human_ref_eval_global_summary.csv")
+            c_w = load_model_reliability(path, "global_avg_concept_jaccard")
+            t_w = load_model_reliability(path, "global_avg_triple_f1")
+        else:
+            path = os.path.join(ANALYSIS_DIR, "superlearner_evaluation.csv")
+            c_w = load_model_reliability(path, "concept_jaccard")
+            t_w = load_model_reliability(path, "triple_f1")
+        if not c_w:
+            log_line(SCRIPT, f"⚠️ No reliability scores in {path}; using equal weights")
+        return WeightedVote(c_w, WEIGHTED_QUORUM), WeightedVote(t_w, WEIGHTED_QUORUM)
+    raise ValueError(f"Unknown FUSION_RULE: {kind}")
+
+def confidence_vote_rule(rule):
+    """WeightedVote for confidence-weighted triples: a model-count threshold k becomes quorum k / n_models."""
+    if isinstance(rule, ThresholdVote):
+        return WeightedVote({}, rule.k / len(SELECTED_MODELS))
+    return rule
+
 def main():
     os.makedirs(os.path.dirname(FUSION_PATH), exist_ok=True)
-    total_slides = 0
 
-    with open(FUSION_PATH, "w", encoding="utf-8") as fout:
-        for lec in list_lectures(BY_SLIDE_DIR):
-            lec_dir = os.path.join(BY_SLIDE_DIR, lec)
-            for sf in list_slide_jsons(lec_dir):
-                p = os.path.join(lec_dir, sf)
-                j = safe_jload(p)
-                if not j or "models" not in j:
+    rule = build_vote_rule()
+    conc_rule, trip_rule = rule if isinstance(rule, tuple) else (rule, rule)
+    if CONFIDENCE_WEIGHTED_TRIPLES:
+        trip_rule = confidence_vote_rule(trip_rule)
+    term_idx, conc_interner, trip_interner = term_interners()
+
+    # one pass over by_slide, then a single vectorized vote over all slides
+    records: List[Dict[str, Any]] = []
+    conc_votes: List[Dict[str, Any]] = []
+    trip_votes: List[Dict[str, Any]] = []
+
+    for lec in list_lectures(BY_SLIDE_DIR):
+        lec_dir = os.path.join(BY_SLIDE_DIR, lec)
+        for sf in list_slide_jsons(lec_dir):
+            p = os.path.join(lec_dir, sf)
+            j = safe_jload(p)
+            if not j or "models" not in j:
+                continue
+            models = j["models"]
+
+            parsed_conc = {}
+            parsed_trip = {}
+            trip_conf = {}
+
+            for m in SELECTED_MODELS:
+                md = models.get(m, {})
+                if not isinstance(md, dict):
                     continue
-                models = j["models"]
-
-                parsed_conc = {}
-                parsed_trip = {}
-
-                for m in SELECTED_MODELS:
-                    md = models.get(m, {})
-                    if not isinstance(md, dict):
-                        continue
-                    parsed_conc[m] = extract_concepts(md)
-                    parsed_trip[m] = extract_triples(md)
-
-                # consensus (>=2 models must agree)
-                concept_counts = {}
-                triple_counts = {}
-
-                for cset in parsed_conc.values():
-                    for c in cset:
-                        concept_counts[c] = concept_counts.get(c, 0) + 1
-
-                for tset in parsed_trip.values():
-                    for t in tset:
-                        triple_counts[t] = triple_counts.get(t, 0) + 1
-
-                fused_concepts = sorted([c for c, n in concept_counts.items() if n >= 2])
-                fused_triples = sorted([t for t, n in triple_counts.items() if n >= 2])
-
-                out_rec = {
-                    "lecture": j.get("lecture"),
-                    "slide_id": j.get("slide_id"),
-                    "paths": j.get("paths", {}),
-                    "models": parsed_conc,
-                    "triples": parsed_trip,
-                    "superlearner": {
-                        "concepts": fused_concepts,
-                        "triples": fused_triples,
-                    },
-                }
-                fout.write(json.dumps(out_rec) + "\n")
-                total_slides += 1
+                parsed_conc[m] = extract_concepts(md)
+                parsed_trip[m] = extract_triples(md)
+                if term_idx is not None:
+                    # store canonical forms so downstream scoring compares like with like
+                    parsed_conc[m] = sorted({term_idx.canonical(x) for x in parsed_conc[m]})
+                    parsed_trip[m] = sorted({term_idx.canonical_triple(x) for x in parsed_trip[m]})
+                if CONFIDENCE_WEIGHTED_TRIPLES:
+                    confs = extract_triple_confidences(md)
+                    if term_idx is not None:
+                        merged: Dict[str, Optional[float]] = {}
+                        for k, c in confs.items():
+                            ck = term_idx.canonical_triple(k)
+                            merged[ck] = max_confidence(merged.get(ck), c)
+                        confs = merged
+                    trip_conf[m] = confs
+
+            records.append({
+                "lecture": j.get("lecture"),
+                "slide_id": j.get("slide_id"),
+                "paths": j.get("paths", {}),
+                "models": parsed_conc,
+                "triples": parsed_trip,
+            })
+            conc_votes.append(parsed_conc)
+            trip_votes.append(trip_conf if CONFIDENCE_WEIGHTED_TRIPLES else parsed_trip)
+
+    if CONFIDENCE_WEIGHTED_TRIPLES:
+        trip_votes = relative_confidences(trip_votes)
+    fused_concepts = fuse_corpus(conc_votes, SELECTED_MODELS, conc_rule, conc_interner)
+    fused_triples = fuse_corpus(trip_votes, SELECTED_MODELS, trip_rule, trip_interner)
+
+    with open(FUSION_PATH, "w", encoding="utf-8") as fout:
+        for rec, fc, ft in zip(records, fused_concepts, fused_triples):
+            rec["superlearner"] = {
+                "concepts": fc,
+                "triples": ft,
+            }
+            fout.write(json.dumps(rec) + "\n")
+    total_slides = len(records)
+
+    log_line(SCRIPT, f"Vote rule: concepts={conc_rule!r} triples={trip_rule!r}"
+                     f"{' (confidence-weighted)' if CONFIDENCE_WEIGHTED_TRIPLES else ''}"
+                     f", term matching={TERM_MATCHING}")
 
     log_line(SCRIPT, f"✅ Fused {total_slides} slides")
     log_line(SCRIPT, f"File saved: {FUSION_PATH}")
@@ -0,0 +1,112 @@
+# fusion_engine.py
+import csv, os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from agreement_engine import Interner, SlideModelIncidence
+
+# ---------- voting rules ----------
+
+class ThresholdVote:
+    """Keep an item when at least k models emit it (the original "n >= 2" consensus)."""
+
+    # scores are model counts: confidence-weighted votes are rejected by fuse_corpus
+    counts_votes = True
+
+    def __init__(self, k: int = 2):
+        self.k = k
+
+    def model_weights(self, models: Sequence[str]) -> np.ndarray:
+        return np.ones(len(models), dtype=np.float64)
+
+    def keep(self, scores: np.ndarray, total_weight: float) -> np.ndarray:
+        return scores >= self.k
+
+    def __repr__(self) -> str:
+        return f"ThresholdVote(k={self.k})"
+
+class WeightedVote:
+    """
+    Reliability-weighted quorum: keep an item when the summed weight of the
+    models voting for it reaches quorum × the total weight of all models.
+    With equal weights, quorum=0.5 over 4 models is the same as k=2.
+    """
+
+    def __init__(self, weights: Dict[str, float], quorum: float = 0.5, default_weight: float = 1.0):
+        self.weights = dict(weights)
+        self.quorum = quorum
+        self.default_weight = default_weight
+
+    def model_weights(self, models: Sequence[str]) -> np.ndarray:
+        return np.asarray([self.weights.get(m, self.default_weight) for m in models], dtype=np.float64)
+
+    def keep(self, scores: np.ndarray, total_weight: float) -> np.ndarray:
+        # small tolerance so equal-weight ties behave like the integer threshold
+        return scores >= self.quorum * total_weight - 1e-9
+
+    def __repr__(self) -> str:
+        ws = ", ".join(f"{m}={w:.3f}" for m, w in sorted(self.weights.items()))
+        return f"WeightedVote(quorum={self.quorum}, weights={{{ws}}})"
+
+# ---------- per-model reliability ----------
+
+def load_model_reliability(path: str, metric: str, model_col: str = "model") -> Dict[str, float]:
+    """
+    Mean of `metric` per model from an evaluation CSV, rescaled so the weights
+    average 1.0. Works for superlearner_evaluation.csv (per-slide rows) and
+    human_ref_eval_global_summary.csv (one row per model, "org/name" ids).
+    """
+    if not os.path.isfile(path):
+        return {}
+    sums: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            m = (r.get(model_col) or "").replace("/", "__")
+            try:
+                v = float(r[metric])
+            except (KeyError, TypeError, ValueError):
+                continue
+            sums[m] = sums.get(m, 0.0) + v
+            counts[m] = counts.get(m, 0) + 1
+    means = {m: sums[m] / counts[m] for m in sums}
+    avg = sum(means.values()) / len(means) if means else 0.0
+    if avg <= 0:
+        return {m: 1.0 for m in means}
+    return {m: v / avg for m, v in means.items()}
+
+# ---------- corpus-wide fusion ----------
+
+def fuse_corpus(slides: List[Dict[str, object]], models: Sequence[str], rule,
+                interner: Optional[Interner] = None) -> List[List[str]]:
+    """
+    Fuse every slide in one sparse pass.
+    slides[i] maps model -> items (iterable) or {item: confidence}; confidences
+    multiply the model's vote weight (WeightedVote only; ThresholdVote counts
+    models). Returns the fused (sorted) items per slide.
+    """
+    if getattr(rule, "counts_votes", False) and any(
+            isinstance(v, dict) for per_model in slides for v in per_model.values()):
+        raise ValueError(f"{rule!r} counts models; use WeightedVote for confidence-weighted votes")
+    models = list(models)
+    inc = SlideModelIncidence(models, interner)
+    for per_model in slides:
+        inc.add_slide(per_model)
+    fused: List[List[str]] = [[] for _ in slides]
+    if not slides:
+        return fused
+
+    w_model = rule.model_weights(models)
+    X = inc.matrix(weighted=True)                         # (slide*model) × slide-local items
+    row_w = np.tile(w_model, inc.n_slides)                # model weight per row
+    scores = X.T @ row_w                                  # weighted votes per (slide, item)
+
+    col_slide, col_item = inc.columns()
+    keep = rule.keep(scores, float(w_model.sum()))
+    strings = inc.interner.strings
+    for si, ii in zip(col_slide[keep].tolist(), col_item[keep].tolist()):
+        fused[si].append(strings[ii])
+    for items in fused:
+        items.sort()
+    return fused
@@ -0,0 +1,302 @@
+# job_queue.py
+import ast, os, re, socket, sqlite3, threading, time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pipeline_logging import log_line
+
+SCRIPT = "job_queue"
+
+# One row per (lecture, slide, model, prompt) in a SQLite file that every
+# worker opens. Workers claim small batches inside BEGIN IMMEDIATE (one writer
+# at a time), keep their leases alive with heartbeats, and a lease that runs
+# out without one (crashed / killed worker) is put back to 'pending' by the
+# next claim. Each claim counts as an attempt; a job that fails or expires
+# max_attempts times ends as 'failed'.
+#
+# The default rollback journal is used on purpose: WAL needs shared memory and
+# does not work when the database sits on a network filesystem. The filesystem
+# must still honour POSIX locks for SQLite's locking to hold.
+
+STATUSES = ("pending", "leased", "done", "failed")
+
+RUNNER_SCRIPTS = {
+    "qwen": "qwen_code_to_compare_models.py",
+    "intern": "intern_code_to_compare_models.py",
+    "llava": "llava_code_to_compare_models.py",
+    "idefics2": "Idefics2_code_to_compare_models.py",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            INTEGER PRIMARY KEY,
+    lecture       TEXT    NOT NULL,
+    lecture_num   INTEGER NOT NULL,
+    slide_id      TEXT    NOT NULL,
+    slide_file    TEXT    NOT NULL,
+    slide_num     INTEGER NOT NULL,
+    family        TEXT    NOT NULL,
+    model         TEXT    NOT NULL,
+    prompt        TEXT    NOT NULL,
+    status        TEXT    NOT NULL DEFAULT 'pending',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    max_attempts  INTEGER NOT NULL DEFAULT 3,
+    worker        TEXT,
+    lease_expires REAL,
+    heartbeat     REAL,
+    last_error    TEXT,
+    created       REAL    NOT NULL,
+    updated       REAL    NOT NULL,
+    UNIQUE (lecture, slide_id, model, prompt)
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs (status, model, lecture_num, slide_num);
+CREATE INDEX IF NOT EXISTS jobs_lease ON jobs (status, lease_expires);
+"""
+
+def _last_int(s: str) -> int:
+    nums = re.findall(r"\d+", s)
+    return int(nums[-1]) if nums else 0
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+# ---------- queue ----------
+
+class JobQueue:
+    """SQLite-backed work queue; one instance (connection) per thread."""
+
+    def __init__(self, db_path: str, lease_seconds: float = 900.0, timeout: float = 60.0):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.timeout = timeout
+        # autocommit; write transactions are opened explicitly
+        self.conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(_SCHEMA)
+
+    def clone(self) -> "JobQueue":
+        """Same database, new connection (for the heartbeat thread)."""
+        return JobQueue(self.db_path, self.lease_seconds, self.timeout)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _write(self, fn, *args):
+        """Run fn(*args) inside one BEGIN IMMEDIATE transaction."""
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            out = fn(*args)
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+        return out
+
+    # --- producers ---
+
+    def enqueue(self, jobs: Iterable[Dict[str, Any]], max_attempts: int = 3) -> int:
+        """Insert jobs (dicts with lecture/slide_id/slide_file/family/model/prompt); existing rows are kept."""
+        now = time.time()
+        rows = [(j["lecture"], _last_int(j["lecture"]), j["slide_id"], j["slide_file"],
+                 _last_int(j["slide_id"]), j["family"], j["model"], j["prompt"],
+                 max_attempts, now, now) for j in jobs]
+
+        def insert() -> int:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO jobs (lecture, lecture_num, slide_id, slide_file, slide_num, "
+                "family, model, prompt, max_attempts, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            return self.conn.total_changes - before
+        return self._write(insert)
+
+    def retry_failed(self, model: Optional[str] = None) -> int:
+        """Put 'failed' jobs back to 'pending' with a fresh attempt budget."""
+        sql = "UPDATE jobs SET status = 'pending', attempts = 0, worker = NULL, updated = ? WHERE status = 'failed'"
+        args: List[Any] = [time.time()]
+        if model is not None:
+            sql += " AND model = ?"
+            args.append(model)
+        return self._write(lambda: self.conn.execute(sql, args).rowcount)
+
+    # --- workers ---
+
+    def _expire_leases(self, now: float) -> int:
+        cur = self.conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+            "worker = NULL, lease_expires = NULL, last_error = COALESCE(last_error, 'lease expired'), "
+            "updated = ? WHERE status = 'leased' AND lease_expires < ?", (now, now))
+        return cur.rowcount
+
+    def reclaim_expired(self) -> int:
+        return self._write(lambda: self._expire_leases(time.time()))
+
+    def claim(self, worker: str, n: int, models: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """Atomically lease up to n pending jobs (lecture/slide order), optionally for some models only."""
+        def take() -> List[Dict[str, Any]]:
+            now = time.time()
+            self._expire_leases(now)
+            sql = "SELECT * FROM jobs WHERE status = 'pending'"
+            args: List[Any] = []
+            if models:
+                sql += f" AND model IN ({','.join('?' * len(models))})"
+                args.extend(models)
+            sql += " ORDER BY lecture_num, slide_num, prompt LIMIT ?"
+            args.append(n)
+            rows = [dict(r) for r in self.conn.execute(sql, args)]
+            if not rows:
+                return []
+            ids = [r["id"] for r in rows]
+            self.conn.execute(
+                f"UPDATE jobs SET status = 'leased', worker = ?, attempts = attempts + 1, "
+                f"lease_expires = ?, heartbeat = ?, updated = ? WHERE id IN ({','.join('?' * len(ids))})",
+                [worker, now + self.lease_seconds, now, now, *ids])
+            for r in rows:
+                r.update(status="leased", worker=worker, attempts=r["attempts"] + 1)
+            return rows
+        return self._write(take)
+
+    def heartbeat(self, worker: str, ids: Sequence[int]) -> int:
+        """Extend the leases this worker still holds; returns how many were extended."""
+        if not ids:
+            return 0
+        now = time.time()
+        return self._write(lambda: self.conn.execute(
+            f"UPDATE jobs SET lease_expires = ?, heartbeat = ? "
+            f"WHERE status = 'leased' AND worker = ? AND id IN ({','.join('?' * len(ids))})",
+            [now + self.lease_seconds, now, worker, *ids]).rowcount)
+
+    def complete(self, job_id: int, worker: str) -> bool:
+        """Mark done. False if the lease was lost meanwhile (the job may run again elsewhere)."""
+        return self._write(lambda: self.conn.execute(
+            "UPDATE jobs SET status = 'done', worker = ?, lease_expires = NULL, last_error = NULL, "
+            "updated = ? WHERE id = ? AND status = 'leased' AND worker = ?",
+            (worker, time.time(), job_id, worker)).rowcount == 1)
+
+    def fail(self, job_id: int, worker: str, error: str) -> None:
+        """Give the job back for a retry, or mark it failed once its attempts are used up."""
+        self._write(lambda: self.conn.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+            "worker = NULL, lease_expires = NULL, last_error = ?, updated = ? "
+            "WHERE id = ? AND status = 'leased' AND worker = ?",
+            (error[:2000], time.time(), job_id, worker)))
+
+    def release(self, worker: str, ids: Optional[Sequence[int]] = None) -> int:
+        """Hand leased jobs back untouched (clean shutdown); the attempt is not counted."""
+        sql = ("UPDATE jobs SET status = 'pending', worker = NULL, lease_expires = NULL, "
+               "attempts = MAX(attempts - 1, 0), updated = ? WHERE status = 'leased' AND worker = ?")
+        args: List[Any] = [time.time(), worker]
+        if ids is not None:
+            if not ids:
+                return 0
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            args.extend(ids)
+        return self._write(lambda: self.conn.execute(sql, args).rowcount)
+
+    # --- reporting ---
+
+    def counts(self) -> Dict[Tuple[str, str], int]:
+        """(model, status) -> number of jobs."""
+        return {(r["model"], r["status"]): r["n"] for r in self.conn.execute(
+            "SELECT model, status, COUNT(*) AS n FROM jobs GROUP BY model, status")}
+
+    def pending_by_model(self, models: Optional[Sequence[str]] = None) -> Dict[str, int]:
+        out = {m: n for (m, st), n in self.counts().items() if st == "pending"}
+        return {m: n for m, n in out.items() if models is None or m in models}
+
+    def n_leased(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'leased'").fetchone()[0]
+
+class LeaseKeeper(threading.Thread):
+    """Background heartbeat for the jobs a worker currently holds."""
+
+    def __init__(self, queue: JobQueue, worker: str, interval: float):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.worker = worker
+        self.interval = interval
+        self._ids: List[int] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def hold(self, ids: Sequence[int]) -> None:
+        with self._lock:
+            self._ids = list(ids)
+
+    def drop(self, job_id: int) -> None:
+        with self._lock:
+            self._ids = [i for i in self._ids if i != job_id]
+
+    def run(self) -> None:
+        q = self.queue.clone()
+        try:
+            while not self._stop.wait(self.interval):
+                with self._lock:
+                    ids = list(self._ids)
+                try:
+                    q.heartbeat(self.worker, ids)
+                except sqlite3.OperationalError as e:
+                    log_line(SCRIPT, f"⚠️  Heartbeat failed ({e}); will retry")
+        finally:
+            q.close()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.join(timeout=self.interval)
+
+# ---------- job discovery ----------
+
+def list_slides(image_dir: str) -> List[str]:
+    """Slide images in slide-number order (same as the runners)."""
+    if not os.path.isdir(image_dir):
+        return []
+    files = [f for f in os.listdir(image_dir) if f.lower().endswith((".jpg", ".jpeg", ".png"))]
+    files.sort(key=_last_int)
+    return files
+
+def _literal(node: ast.AST) -> Any:
+    # GEN_KW is written as dict(max_new_tokens=..., ...)
+    if isinstance(node, ast.Call) and getattr(node.func, "id", None) == "dict" and not node.args:
+        return {kw.arg: ast.literal_eval(kw.value) for kw in node.keywords}
+    return ast.literal_eval(node)
+
+def load_runner_config(lecture_dir: str, family: str) -> Dict[str, Any]:
+    """
+    MODELS / PROMPTS / GEN_KW (+ optional PIXEL_BUDGETS, IMAGE_ROUTING) of a
+    lecture's runner script, read without importing it.
+    """
+    path = os.path.join(lecture_dir, RUNNER_SCRIPTS[family])
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    cfg: Dict[str, Any] = {"pixel_budgets": {}, "image_routing": "always"}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target, value = node.targets[0], node.value
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            target, value = node.target, node.value
+        else:
+            continue
+        name = getattr(target, "id", None)
+        if name in ("MODELS", "PROMPTS", "GEN_KW", "PIXEL_BUDGETS", "IMAGE_ROUTING"):
+            cfg[name.lower()] = _literal(value)
+    missing = {"models", "prompts", "gen_kw"} - set(cfg)
+    if missing:
+        raise ValueError(f"{path}: could not read {', '.join(sorted(missing))}")
+    return cfg
+
+def lecture_jobs(lecture_dir: str, families: Sequence[str]) -> List[Dict[str, Any]]:
+    """Every (slide, model, prompt) the lecture's runners would process."""
+    lecture = os.path.basename(os.path.normpath(lecture_dir))
+    slides = [f for f in list_slides(os.path.join(lecture_dir, "Images"))
+              if os.path.exists(os.path.join(lecture_dir, "Texts", os.path.splitext(f)[0] + ".txt"))]
+    jobs = []
+    for fam in families:
+        if not os.path.isfile(os.path.join(lecture_dir, RUNNER_SCRIPTS[fam])):
+            continue
+        cfg = load_runner_config(lecture_dir, fam)
+        for model in cfg["models"]:
+            for prompt in cfg["prompts"]:
+                for f in slides:
+                    jobs.append({"lecture": lecture, "slide_id": os.path.splitext(f)[0], "slide_file": f,
+                                 "family": fam, "model": model, "prompt": prompt})
+    return jobs
@@ -1,6 +1,10 @@
 import os
 import pandas as pd
 
+from pipeline_logging import log_line
+
+SCRIPT = "make_paper_tables"
+
 ROOT = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(ROOT, "MILU23", "data", "analysis")
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -22,7 +26,7 @@ pair_summary = (
 
 pair_out = os.path.join(DATA_DIR, "table_model_pair_summary.csv")
 pair_summary.to_csv(pair_out, index=False)
-print(f"✅ Saved model-pair summary to: {pair_out}")
+log_line(SCRIPT, f"✅ Saved model-pair summary to: {pair_out}")
 
 # --- 2. LECTURE-LEVEL SUMMARY (ALREADY AGGREGATED BUT WE CLEAN IT) ---
 
@@ -32,7 +36,7 @@ df_lecture = pd.read_csv(lecture_csv)
 df_lecture_sorted = df_lecture.sort_values(["lecture"])
 lecture_out = os.path.join(DATA_DIR, "table_lecture_summary.csv")
 df_lecture_sorted.to_csv(lecture_out, index=False)
-print(f"✅ Saved lecture summary to: {lecture_out}")
+log_line(SCRIPT, f"✅ Saved lecture summary to: {lecture_out}")
 
 # --- 3. SUPERLEARNER SUMMARY ---
 
@@ -47,7 +51,7 @@ df_super_sorted = (
 
 super_out = os.path.join(DATA_DIR, "table_superlearner_summary.csv")
 df_super_sorted.to_csv(super_out, index=False)
-print(f"✅ Saved superlearner summary to: {super_out}")
+log_line(SCRIPT, f"✅ Saved superlearner summary to: {super_out}")
 
 print("\n=== Quick previews ===")
 print("\n[Model-pair summary]")
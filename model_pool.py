@@ -0,0 +1,224 @@
+# model_pool.py
+import os, tempfile, time, uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+
+try:
+    from safetensors import safe_open
+    from safetensors.torch import save_file
+except ImportError:  # offloading needs safetensors; without it evicted models are reloaded from scratch
+    safe_open = save_file = None
+
+# Keeps several loaded models on one GPU box and decides which stay resident.
+# Offloading writes a model's weights once per pool to
+# <offload_dir>/<model>.<i>.<dtype>.<pool id>.safetensors and moves every parameter and buffer to the meta device, which frees the
+# memory but keeps the module tree (and the wrapper, processor, caches and
+# memory planner built around it). Reloading maps that file and copies each
+# tensor back to the device it came from, so bringing a model back costs a
+# read from the page cache instead of a from_pretrained(). The pool id
+# (pid + random suffix) keeps a file from another run, revision or dtype
+# from ever being restored; close() deletes the pool's files.
+
+# ---------- weight offloading ----------
+
+def _tensor_slots(module: torch.nn.Module) -> List[Tuple[torch.nn.Module, str, str, str]]:
+    """(owner, attribute, "param" | "buffer", dotted name) for every parameter and buffer, tied ones included."""
+    slots = []
+    for prefix, mod in module.named_modules(remove_duplicate=False):
+        for kind, table in (("param", mod._parameters), ("buffer", mod._buffers)):
+            for name, t in table.items():
+                if t is not None:
+                    slots.append((mod, name, kind, f"{prefix}.{name}" if prefix else name))
+    return slots
+
+def module_bytes(module: torch.nn.Module, device_type: Optional[str] = None) -> int:
+    seen, total = set(), 0
+    for mod, name, kind, _ in _tensor_slots(module):
+        t = (mod._parameters if kind == "param" else mod._buffers)[name]
+        if id(t) in seen or (device_type and t.device.type != device_type):
+            continue
+        seen.add(id(t))
+        total += t.numel() * t.element_size()
+    return total
+
+class OffloadedWeights:
+    """Where a module's tensors went: file key, device and tying per slot."""
+
+    def __init__(self, module: torch.nn.Module, path: str):
+        self.path = path
+        self.slots: List[Tuple[torch.nn.Module, str, str, str, torch.device, bool]] = []
+        keys: Dict[int, str] = {}
+        tensors: Dict[str, torch.Tensor] = {}
+        for mod, name, kind, dotted in _tensor_slots(module):
+            t = (mod._parameters if kind == "param" else mod._buffers)[name]
+            key = keys.setdefault(id(t), dotted)          # tied weights are stored once
+            if key == dotted and not os.path.exists(path):
+                tensors[key] = t.detach().to("cpu", copy=True).contiguous()
+            self.slots.append((mod, name, kind, key, t.device, t.requires_grad))
+        if tensors:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            os.close(fd)
+            save_file(tensors, tmp)
+            os.replace(tmp, path)
+        del tensors
+        # meta tensors keep shapes/dtypes (and ties) but hold no memory
+        metas: Dict[str, torch.Tensor] = {}
+        for mod, name, kind, key, _, grad in self.slots:
+            table = mod._parameters if kind == "param" else mod._buffers
+            if key not in metas:
+                meta = table[name].detach().to("meta")
+                metas[key] = torch.nn.Parameter(meta, requires_grad=grad) if kind == "param" else meta
+            table[name] = metas[key]
+
+    def restore(self) -> None:
+        restored: Dict[str, torch.Tensor] = {}
+        with safe_open(self.path, framework="pt", device="cpu") as f:
+            for mod, name, kind, key, device, grad in self.slots:
+                if key not in restored:
+                    t = f.get_tensor(key).to(device)
+                    restored[key] = torch.nn.Parameter(t, requires_grad=grad) if kind == "param" else t
+                (mod._parameters if kind == "param" else mod._buffers)[name] = restored[key]
+
+def _spilled(model: torch.nn.Module) -> bool:
+    """device_map="auto" puts what does not fit on the GPU on CPU/disk instead of failing."""
+    return bool({"cpu", "disk"} & {str(d) for d in getattr(model, "hf_device_map", {}).values()})
+
+# ---------- pool ----------
+
+class ModelPool:
+    """
+    load(model_id) -> an object with .wrapper.model (an InferenceEngine).
+    get() returns it resident on the GPU, offloading least-recently-used
+    models while free memory is below the model's size + headroom_bytes
+    (memory for activations / KV cache of the batches that will run).
+    A load that spills to CPU or hits OOM offloads another model and
+    retries. Without CUDA, or without safetensors, at most max_resident
+    models are kept and evicted ones are dropped.
+    """
+
+    def __init__(self, load: Callable[[str], Any], offload_dir: str, headroom_bytes: int,
+                 max_resident: Optional[int] = None):
+        os.makedirs(offload_dir, exist_ok=True)
+        self.load = load
+        self.offload_dir = offload_dir
+        self.headroom = headroom_bytes
+        self.cuda = torch.cuda.is_available()
+        self.max_resident = max_resident if max_resident is not None else (None if self.cuda else 1)
+        self.resident: "OrderedDict[str, Any]" = OrderedDict()      # LRU order, most recent last
+        self.offloaded: Dict[str, Tuple[Any, List[OffloadedWeights]]] = {}
+        self.sizes: Dict[str, int] = {}
+        self.n_loads = self.n_offloads = self.n_reloads = 0
+        self.swap_s = 0.0
+        self.pool_id = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.files: List[str] = []
+
+    def _free(self) -> Optional[int]:
+        if not self.cuda:
+            return None
+        free, _ = torch.cuda.mem_get_info()
+        return free + torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+
+    def _needs_room(self, model_id: str) -> bool:
+        if not self.resident:
+            return False
+        if self.max_resident is not None and len(self.resident) >= self.max_resident:
+            return True
+        free = self._free()
+        return free is not None and free < self.sizes.get(model_id, 0) + self.headroom
+
+    def _modules(self, engine) -> List[torch.nn.Module]:
+        return [m for m in (getattr(engine.wrapper, "model", None), getattr(engine.wrapper, "draft", None))
+                if isinstance(m, torch.nn.Module)]
+
+    def offload(self, model_id: str) -> None:
+        engine = self.resident.pop(model_id)
+        t0 = time.perf_counter()
+        if save_file is None:
+            engine.unload()
+        else:
+            safe = model_id.replace("/", "__")
+            parts = []
+            for i, m in enumerate(self._modules(engine)):
+                first = next(m.parameters(), None)
+                dtype = str(first.dtype).replace("torch.", "") if first is not None else "none"
+                path = os.path.join(self.offload_dir, f"{safe}.{i}.{dtype}.{self.pool_id}.safetensors")
+                if path not in self.files:
+                    self.files.append(path)
+                parts.append(OffloadedWeights(m, path))
+            self.offloaded[model_id] = (engine, parts)
+        if self.cuda:
+            torch.cuda.empty_cache()
+        self.n_offloads += 1
+        self.swap_s += time.perf_counter() - t0
+
+    def _make_room(self, model_id: str) -> bool:
+        """Offload the least recently used model; False when nothing is left to offload."""
+        victims = [m for m in self.resident if m != model_id]
+        if not victims:
+            return False
+        self.offload(victims[0])
+        return True
+
+    def get(self, model_id: str):
+        if model_id in self.resident:
+            self.resident.move_to_end(model_id)
+            return self.resident[model_id]
+        while self._needs_room(model_id) and self._make_room(model_id):
+            pass
+
+        t0 = time.perf_counter()
+        if model_id in self.offloaded:
+            engine, parts = self.offloaded.pop(model_id)
+            while True:
+                try:
+                    for p in parts:
+                        p.restore()
+                    break
+                except Exception as e:
+                    if not (self.cuda and "out of memory" in str(e)) or not self._make_room(model_id):
+                        raise
+            self.n_reloads += 1
+            self.swap_s += time.perf_counter() - t0
+        else:
+            while True:
+                try:
+                    engine = self.load(model_id)
+                except Exception as e:
+                    if not (self.cuda and "out of memory" in str(e)) or not self._make_room(model_id):
+                        raise
+                    continue
+                if any(_spilled(m) for m in self._modules(engine)) and self._make_room(model_id):
+                    engine.unload()
+                    del engine
+                    continue
+                break
+            self.n_loads += 1
+            self.sizes[model_id] = sum(module_bytes(m) for m in self._modules(engine))
+
+        self.resident[model_id] = engine
+        # the new model may leave less than headroom for the batches: push others out
+        free = self._free()
+        while free is not None and free < self.headroom and self._make_room(model_id):
+            free = self._free()
+        return engine
+
+    def close(self) -> None:
+        for model_id in list(self.resident):
+            self.resident.pop(model_id).unload()
+        for engine, _ in self.offloaded.values():
+            engine.unload()
+        self.offloaded.clear()
+        for path in self.files:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.files.clear()
+        if self.cuda:
+            torch.cuda.empty_cache()
+
+    def summary(self) -> str:
+        return (f"{self.n_loads} loads, {self.n_offloads} offloads, {self.n_reloads} reloads "
+                f"({self.swap_s:.1f}s swapping); resident: {', '.join(self.resident) or '-'}")
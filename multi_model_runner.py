@@ -0,0 +1,144 @@
+# multi_model_runner.py
+import os, re, traceback
+from typing import Any, Dict, List
+
+from PIL import Image
+
+from shared_config import MILU, DATA_DIR, SELECTED_MODELS, log_line
+from job_queue import RUNNER_SCRIPTS, list_slides, load_runner_config
+from run_manifest import input_hashes
+from inference_engine import InferenceEngine, read_text
+from image_router import ImageRouter
+from model_pool import ModelPool
+from vlm_wrappers import family_for
+from queue_worker import LectureOutputs
+
+SCRIPT = "multi_model_runner"
+
+# A full comparison pass over MODELS on one box, in one process. A lecture's
+# slide texts are read and its images decoded once, then every model visits
+# the lecture once and runs all of it (InferenceEngine.run_batch over
+# SLIDE_BATCH slides at a time, per prompt) before the next model is loaded.
+# model_pool.ModelPool keeps as many models on the GPU as fit next to
+# HEADROOM_GB of working memory and offloads the least recently used ones to
+# OFFLOAD_DIR; models still resident from the previous lecture go first, so
+# each model is swapped in at most once per lecture (and not at all while
+# the whole set fits).
+# Prompts, GEN_KW, PIXEL_BUDGETS and IMAGE_ROUTING come from each lecture's
+# runner for the model's family; outputs, manifests and resume match
+# queue_worker.py (per-slide files, already finished units are skipped).
+MODELS = [m.replace("__", "/") for m in SELECTED_MODELS]
+LECTURES = None               # None = every "Lecture N" directory
+SLIDE_BATCH = 8               # slides per run_batch call
+HEADROOM_GB = 8               # kept free for activations / KV cache
+MAX_GEN_BATCH = 8
+OFFLOAD_DIR = os.path.join(DATA_DIR, "offload")
+PERF_PROFILE = "default"      # vlm_wrappers.PERF_PROFILES
+
+def list_lectures(base: str) -> List[str]:
+    out = []
+    for name in os.listdir(base):
+        p = os.path.join(base, name)
+        if name.lower().startswith("lecture ") and os.path.isdir(p):
+            out.append(name)
+    out.sort(key=lambda x: int(re.findall(r"\d+", x)[-1]))
+    return out
+
+def load_engine(model_id: str) -> InferenceEngine:
+    engine = InferenceEngine(model_id, family=family_for(model_id), max_batch=MAX_GEN_BATCH, perf_profile=PERF_PROFILE)
+    log_line(SCRIPT, f"✅ Loaded: {model_id}")
+    return engine
+
+def main():
+    families = {m: family_for(m) for m in MODELS}
+    unknown = [m for m, fam in families.items() if fam is None]
+    if unknown:
+        raise ValueError(f"No wrapper for {', '.join(unknown)}")
+    pool = ModelPool(load_engine, OFFLOAD_DIR, int(HEADROOM_GB * 1e9))
+    outputs = LectureOutputs({"script": SCRIPT, "models": MODELS, "perf_profile": PERF_PROFILE,
+                              "slide_batch": SLIDE_BATCH, "output_format": "per_slide"})
+    routers: Dict[str, ImageRouter] = {}
+    n_done = n_skipped = n_reused = n_failed = 0
+    status = "ok"
+
+    try:
+        for lec in LECTURES or list_lectures(MILU):
+            lec_dir = os.path.join(MILU, lec)
+            slides = [f for f in list_slides(os.path.join(lec_dir, "Images"))
+                      if os.path.exists(os.path.join(lec_dir, "Texts", os.path.splitext(f)[0] + ".txt"))]
+            cfgs = {m: load_runner_config(lec_dir, fam) for m, fam in families.items()
+                    if os.path.isfile(os.path.join(lec_dir, RUNNER_SCRIPTS[fam]))}
+            if not slides or not cfgs:
+                continue
+            sink, _, done, dedup = outputs.get(lec)
+            log_line(SCRIPT, f"{lec}: {len(slides)} slides × {len(cfgs)} models")
+
+            texts = {f: read_text(os.path.join(lec_dir, "Texts", os.path.splitext(f)[0] + ".txt")) for f in slides}
+            images: Dict[str, Image.Image] = {}      # decoded on first use, shared by every model
+            # models still resident (most recently used first), then the rest in MODELS order
+            order = [m for m in reversed(pool.resident) if m in cfgs] + [m for m in cfgs if m not in pool.resident]
+            for model in order:
+                cfg = cfgs[model]
+                engine = pool.get(model)
+                budget = cfg["pixel_budgets"].get(model)
+                if hasattr(engine.wrapper, "set_pixel_budget"):
+                    engine.wrapper.set_pixel_budget(**(budget or {}))
+                router = routers.setdefault(cfg["image_routing"], ImageRouter(cfg["image_routing"]))
+                run_kw = router.gen_kw(dict(cfg["gen_kw"], pixel_budget=budget) if budget else cfg["gen_kw"])
+                for prompt_id, prompt_tpl in cfg["prompts"].items():
+                    for start in range(0, len(slides), SLIDE_BATCH):
+                        batch = slides[start:start + SLIDE_BATCH]
+                        items: List[Dict[str, Any]] = []
+                        hashes: List[Dict[str, str]] = []
+                        for f in batch:
+                            slide_id = os.path.splitext(f)[0]
+                            img_path = os.path.join(lec_dir, "Images", f)
+                            inputs = input_hashes(img_path, texts[f], prompt_tpl, run_kw)
+                            prev = done.get((engine.model_safe, prompt_id, slide_id))
+                            if prev is not None and prev.get("inputs") == inputs:
+                                n_skipped += 1
+                                continue
+                            record = dedup.reuse(engine.model_safe, prompt_id, slide_id, inputs)
+                            if record is not None:
+                                sink.write(engine.model_safe, prompt_id, record, inputs)
+                                n_reused += 1
+                                continue
+                            use_image = router.use_image(img_path)
+                            if use_image and f not in images:
+                                images[f] = Image.open(img_path).convert("RGB")
+                            items.append({"lecture_dir": lec_dir, "slide_file": f, "prompt_id": prompt_id,
+                                          "prompt_tpl": prompt_tpl, "slide_text": texts[f], "use_image": use_image,
+                                          "image": images.get(f) if use_image else None})
+                            hashes.append(inputs)
+                        if not items:
+                            continue
+                        try:
+                            records = engine.run_batch(items, cfg["gen_kw"])
+                        except Exception as e:
+                            n_failed += len(items)
+                            log_line(SCRIPT, f"❌ {lec}/{model}/{prompt_id} slides {batch[0]}…{batch[-1]}: {e}")
+                            log_line(SCRIPT, traceback.format_exc())
+                            continue
+                        for item, inputs, record in zip(items, hashes, records):
+                            if router.mode != "always":
+                                record["image_used"] = item["use_image"]
+                            dedup.remember(engine.model_safe, prompt_id, record)
+                            sink.write(engine.model_safe, prompt_id, record, inputs)
+                            n_done += 1
+            images.clear()
+    except KeyboardInterrupt:
+        status = "interrupted"
+        log_line(SCRIPT, "Interrupted")
+    except BaseException:
+        status = "failed"
+        raise
+    finally:
+        outputs.close(status)
+        log_line(SCRIPT, f"Model pool: {pool.summary()}")
+        pool.close()
+
+    log_line(SCRIPT, f"✅ Finished: {n_done} generated, {n_reused} reused from duplicate slides, "
+                     f"{n_skipped} already done, {n_failed} failed")
+
+if __name__ == "__main__":
+    main()
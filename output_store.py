@@ -0,0 +1,367 @@
+# output_store.py
+import json, os, re
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Runner records go either to one pretty-printed file per slide
+# (Outputs/<model>/<prompt>/SlideN.json, the original layout) or are appended
+# as compact lines to one shard per model and prompt
+# (Outputs/<model>/<prompt>.jsonl) next to an offset index
+# (Outputs/<model>/<prompt>.idx.jsonl). Shards are append-only: re-running a
+# slide appends a new line and the index points at the latest one.
+# Per-slide files are written to a temp file and renamed into place, so a
+# reader never sees a half-written record.
+
+SHARD_EXT = ".jsonl"
+INDEX_EXT = ".idx.jsonl"
+FSYNC_EVERY = 32
+
+_SLIDE_NUM_RE = re.compile(r"\d+")
+
+def shard_path(out_root: str, model_safe: str, prompt_id: str) -> str:
+    return os.path.join(out_root, model_safe, prompt_id + SHARD_EXT)
+
+def index_path(shard: str) -> str:
+    return shard[: -len(SHARD_EXT)] + INDEX_EXT
+
+def slide_sort_key(slide_id: str) -> Tuple[int, str]:
+    nums = _SLIDE_NUM_RE.findall(slide_id)
+    return (int(nums[-1]) if nums else -1, slide_id)
+
+def atomic_write_json(path: str, obj: Any, indent: Optional[int] = 2) -> None:
+    """Write JSON to a temp file in the same directory, fsync, then rename over `path`."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def _dumps_compact(record: Dict[str, Any]) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+# ---------- writing ----------
+
+class JsonlShardWriter:
+    """
+    Appends one compact JSON record per line. Data is flushed after every
+    record and fsync'ed every `fsync_every` records (and on close), so a crash
+    loses at most the records since the last sync. The index only needs to be
+    flushed: readers re-scan whatever part of the shard it does not cover.
+    `on_sync` is called after every fsync (used to publish manifest units).
+    """
+
+    def __init__(self, path: str, fsync_every: int = FSYNC_EVERY,
+                 on_sync: Optional[Callable[[], None]] = None):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.on_sync = on_sync
+        self._f = open(path, "ab")
+        self._idx = open(index_path(path), "a", encoding="utf-8")
+        self._offset = self._f.seek(0, os.SEEK_END)
+        self._pending = 0
+        if self._offset and not _ends_with_newline(path):
+            # torn last line from an interrupted run: terminate it, readers skip it
+            self._f.write(b"\n")
+            self._offset += 1
+
+    def append(self, record: Dict[str, Any]) -> Tuple[int, int]:
+        line = _dumps_compact(record)
+        offset = self._offset
+        self._f.write(line)
+        self._f.flush()
+        self._offset += len(line)
+        self._idx.write(json.dumps({"slide_id": record.get("slide_id"), "offset": offset,
+                                    "length": len(line)}, ensure_ascii=False) + "\n")
+        self._idx.flush()
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.sync()
+        return offset, len(line)
+
+    def sync(self) -> None:
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._idx.flush()
+        self._pending = 0
+        if self.on_sync is not None:
+            self.on_sync()
+
+    def close(self) -> None:
+        if self._f.closed:
+            return
+        self.sync()
+        self._f.close()
+        self._idx.close()
+
+    def __enter__(self) -> "JsonlShardWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+# ---------- reading ----------
+
+def _scan_lines(path: str, start: int, end: Optional[int] = None) -> Iterator[Tuple[Optional[str], int, int]]:
+    """(slide_id, offset, length) for every parseable line in bytes [start, end)."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        offset = start
+        for line in f:
+            if end is not None and offset >= end:
+                break
+            n = len(line)
+            if line.endswith(b"\n"):
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    rec = None
+                if isinstance(rec, dict):
+                    yield rec.get("slide_id"), offset, n
+            offset += n
+
+def load_index(shard: str) -> Dict[str, Tuple[int, int]]:
+    """
+    slide_id -> (offset, length) of its latest record in the shard. Byte ranges
+    the index file does not cover (lost index, records appended after a crash)
+    are re-scanned from the shard itself.
+    """
+    if not os.path.isfile(shard):
+        return {}
+    size = os.path.getsize(shard)
+    entries: List[Tuple[int, int, str]] = []
+    try:
+        with open(index_path(shard), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                    off, n, sid = int(e["offset"]), int(e["length"]), e["slide_id"]
+                except (ValueError, KeyError, TypeError):
+                    continue
+                if off + n <= size and sid is not None:
+                    entries.append((off, n, sid))
+    except OSError:
+        pass
+    entries.sort()
+
+    index: Dict[str, Tuple[int, int]] = {}
+    covered = 0
+    for off, n, sid in entries:
+        if off < covered:
+            continue
+        if off > covered:
+            for gsid, goff, gn in _scan_lines(shard, covered, off):
+                if gsid is not None:
+                    index[gsid] = (goff, gn)
+        index[sid] = (off, n)
+        covered = off + n
+    if covered < size:
+        for sid, off, n in _scan_lines(shard, covered):
+            if sid is not None:
+                index[sid] = (off, n)
+    return index
+
+class JsonlShardReader:
+    """Random access to the latest record per slide in one shard."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index = load_index(path)
+        self._f = open(path, "rb") if self.index else None
+
+    def slide_ids(self) -> List[str]:
+        return sorted(self.index, key=slide_sort_key)
+
+    def get(self, slide_id: str) -> Optional[Dict[str, Any]]:
+        loc = self.index.get(slide_id)
+        if loc is None or self._f is None:
+            return None
+        self._f.seek(loc[0])
+        try:
+            return json.loads(self._f.read(loc[1]))
+        except ValueError:
+            return None
+
+    def __iter__(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        for sid in self.slide_ids():
+            rec = self.get(sid)
+            if rec is not None:
+                yield sid, rec
+
+    def close(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def __enter__(self) -> "JsonlShardReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+# ---------- sinks used by the runners ----------
+
+class PerSlideSink:
+    """Original layout: Outputs/<model>/<prompt>/SlideN.json, indent=2, written atomically."""
+
+    def __init__(self, out_root: str, manifest=None):
+        self.out_root = out_root
+        self.manifest = manifest
+
+    def location(self, model_safe: str, prompt_id: str) -> str:
+        return os.path.join(self.out_root, model_safe, prompt_id)
+
+    def write(self, model_safe: str, prompt_id: str, record: Dict[str, Any],
+              inputs: Optional[Dict[str, str]] = None) -> str:
+        out_dir = self.location(model_safe, prompt_id)
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.join(out_dir, f"{record['slide_id']}.json")
+        atomic_write_json(path, record)
+        if self.manifest is not None:
+            self.manifest.add(model_safe, prompt_id, record["slide_id"], inputs or {},
+                              path, record.get("parsed") is not None)
+            self.manifest.flush()
+        return path
+
+    def close(self) -> None:
+        pass
+
+class JsonlShardSink:
+    """
+    One append-only shard per (model, prompt) under out_root. Manifest units
+    are held back until their shard has been fsync'ed.
+    """
+
+    def __init__(self, out_root: str, fsync_every: int = FSYNC_EVERY, manifest=None):
+        self.out_root = out_root
+        self.fsync_every = fsync_every
+        self.manifest = manifest
+        self._writers: Dict[Tuple[str, str], JsonlShardWriter] = {}
+        self._unsynced: Dict[Tuple[str, str], List[tuple]] = {}
+
+    def location(self, model_safe: str, prompt_id: str) -> str:
+        return shard_path(self.out_root, model_safe, prompt_id)
+
+    def _publish(self, key: Tuple[str, str]) -> None:
+        units = self._unsynced.pop(key, [])
+        if self.manifest is None or not units:
+            return
+        for u in units:
+            self.manifest.add(*u)
+        self.manifest.flush()
+
+    def write(self, model_safe: str, prompt_id: str, record: Dict[str, Any],
+              inputs: Optional[Dict[str, str]] = None) -> str:
+        key = (model_safe, prompt_id)
+        w = self._writers.get(key)
+        if w is None:
+            w = JsonlShardWriter(self.location(model_safe, prompt_id), self.fsync_every,
+                                 on_sync=lambda: self._publish(key))
+            self._writers[key] = w
+        self._unsynced.setdefault(key, []).append(
+            (model_safe, prompt_id, record["slide_id"], inputs or {},
+             f"{w.path}#{record['slide_id']}", record.get("parsed") is not None))
+        w.append(record)
+        return w.path
+
+    def close(self) -> None:
+        for w in self._writers.values():
+            w.close()
+        self._writers.clear()
+
+def make_sink(fmt: str, out_root: str, manifest=None):
+    if fmt == "jsonl":
+        return JsonlShardSink(out_root, manifest=manifest)
+    if fmt == "per_slide":
+        return PerSlideSink(out_root, manifest=manifest)
+    raise ValueError(f"Unknown output format: {fmt!r} (expected 'jsonl' or 'per_slide')")
+
+# ---------- reading either layout ----------
+
+class OutputReader:
+    """
+    Latest record per slide for one lecture's Outputs directory. A shard wins
+    over a per-slide file for the same slide, so the two layouts can coexist
+    (old per-slide results plus newer shard runs).
+    """
+
+    def __init__(self, out_root: str):
+        self.out_root = out_root
+        self._shards: Dict[Tuple[str, str], Optional[JsonlShardReader]] = {}
+        self.unreadable: List[str] = []   # per-slide files that exist but do not load
+
+    def _shard(self, model_safe: str, prompt_id: str) -> Optional[JsonlShardReader]:
+        key = (model_safe, prompt_id)
+        if key not in self._shards:
+            p = shard_path(self.out_root, model_safe, prompt_id)
+            self._shards[key] = JsonlShardReader(p) if os.path.isfile(p) else None
+        return self._shards[key]
+
+    def get(self, model_safe: str, prompt_id: str, slide_id: str) -> Tuple[Optional[Dict[str, Any]], str]:
+        """(record, source) — source is "<shard>#<slide_id>" or the per-slide path."""
+        shard = self._shard(model_safe, prompt_id)
+        if shard is not None and slide_id in shard.index:
+            rec = shard.get(slide_id)
+            if rec is not None:
+                return rec, f"{shard.path}#{slide_id}"
+        path = os.path.join(self.out_root, model_safe, prompt_id, f"{slide_id}.json")
+        if not os.path.exists(path):
+            return None, path
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f), path
+        except Exception:
+            self.unreadable.append(path)
+            return None, path
+
+    def close(self) -> None:
+        for r in self._shards.values():
+            if r is not None:
+                r.close()
+        self._shards.clear()
+
+# ---------- export back to the per-slide layout ----------
+
+def export_shard(shard: str, out_dir: str, overwrite: bool = True) -> int:
+    """Write the latest record of every slide in `shard` as out_dir/SlideN.json."""
+    os.makedirs(out_dir, exist_ok=True)
+    written = 0
+    with JsonlShardReader(shard) as r:
+        for sid, rec in r:
+            path = os.path.join(out_dir, f"{sid}.json")
+            if not overwrite and os.path.exists(path):
+                continue
+            atomic_write_json(path, rec)
+            written += 1
+    return written
+
+def list_shards(out_root: str) -> List[Tuple[str, str, str]]:
+    """(model_safe, prompt_id, shard path) for every shard under an Outputs directory."""
+    out = []
+    if not os.path.isdir(out_root):
+        return out
+    for model_safe in sorted(os.listdir(out_root)):
+        m_dir = os.path.join(out_root, model_safe)
+        if model_safe.startswith("_") or not os.path.isdir(m_dir):
+            continue
+        for fn in sorted(os.listdir(m_dir)):
+            if fn.endswith(SHARD_EXT) and not fn.endswith(INDEX_EXT):
+                out.append((model_safe, fn[: -len(SHARD_EXT)], os.path.join(m_dir, fn)))
+    return out
+
+def export_outputs(out_root: str, overwrite: bool = True) -> int:
+    """Export every shard under out_root to Outputs/<model>/<prompt>/SlideN.json."""
+    total = 0
+    for model_safe, prompt_id, shard in list_shards(out_root):
+        total += export_shard(shard, os.path.join(out_root, model_safe, prompt_id), overwrite)
+    return total
@@ -0,0 +1,113 @@
+# perf_benchmark.py
+import csv, gc, os, time
+from typing import Any, Dict, List
+
+import numpy as np
+import torch
+
+from shared_config import MILU, ANALYSIS_DIR, log_line
+from job_queue import load_runner_config
+from inference_engine import InferenceEngine
+from vlm_wrappers import PERF_PROFILES, family_for
+from qwen_resolution_sweep import list_lectures, sample_slides, timed_run
+
+SCRIPT = "perf_benchmark"
+
+# Loads MODEL_ID once per (device, profile from vlm_wrappers.PERF_PROFILES)
+# and times a few slides: first-token latency (a max_new_tokens=1 call) and
+# decode throughput ((new tokens - 1) / time after the first token).
+# CPU always runs; CUDA when available. Compiled profiles are warmed up
+# first so compilation time shows up in load_s, not in the timings.
+MODEL_ID = "Qwen/Qwen3-VL-2B-Instruct"
+PROFILES = list(PERF_PROFILES)
+N_SLIDES = {"cpu": 2, "cuda": 10}
+MAX_NEW_TOKENS = {"cpu": 64, "cuda": 256}
+WARMUP = 1
+SEED = 0
+
+OUT_ROWS = os.path.join(ANALYSIS_DIR, "perf_benchmark_rows.csv")
+OUT_SUMMARY = os.path.join(ANALYSIS_DIR, "perf_benchmark.csv")
+
+def count_new_tokens(wrapper, text: str) -> int:
+    n = getattr(wrapper, "last_stats", {}).get("new_tokens")
+    if n is not None:
+        return int(n)
+    tok = getattr(wrapper, "tokenizer", None) or wrapper.processor.tokenizer
+    return len(tok(text, add_special_tokens=False)["input_ids"])
+
+def bench_profile(device: str, profile: str, slides, prompts, gen_kw) -> List[Dict[str, Any]]:
+    t0 = time.perf_counter()
+    engine = InferenceEngine(MODEL_ID, device=device, family=family_for(MODEL_ID), perf_profile=profile)
+    calls = [(lec, f, pid, tpl) for lec, f in slides for pid, tpl in prompts.items()]
+    full_kw = dict(gen_kw, max_new_tokens=MAX_NEW_TOKENS[device])
+    for lec, f, pid, tpl in calls[:WARMUP]:
+        timed_run(engine, os.path.join(MILU, lec), f, pid, tpl, full_kw)
+    load_s = time.perf_counter() - t0
+
+    rows = []
+    for lec, f, pid, tpl in calls:
+        lec_dir = os.path.join(MILU, lec)
+        _, first_s = timed_run(engine, lec_dir, f, pid, tpl, dict(gen_kw, max_new_tokens=1))
+        rec, total_s = timed_run(engine, lec_dir, f, pid, tpl, full_kw)
+        n_new = count_new_tokens(engine.wrapper, rec["raw_output"])
+        decode_s = max(total_s - first_s, 1e-9)
+        rows.append({
+            "device": device, "profile": profile, "lecture": lec, "slide_id": rec["slide_id"], "prompt": pid,
+            "load_s": round(load_s, 2), "first_token_s": round(first_s, 4), "total_s": round(total_s, 4),
+            "new_tokens": n_new, "decode_tok_s": round(max(n_new - 1, 0) / decode_s, 2),
+        })
+    engine.unload()
+    del engine
+    gc.collect()
+    return rows
+
+def main():
+    lectures = list_lectures(MILU)
+    devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+    rows: List[Dict[str, Any]] = []
+    summary: List[Dict[str, Any]] = []
+
+    for device in devices:
+        slides = sample_slides(lectures, N_SLIDES[device] + WARMUP, SEED)
+        cfg = load_runner_config(os.path.join(MILU, slides[0][0]), family_for(MODEL_ID))
+        base_tok_s = None
+        for profile in PROFILES:
+            try:
+                prof_rows = bench_profile(device, profile, slides, cfg["prompts"], cfg["gen_kw"])
+            except Exception as e:
+                log_line(SCRIPT, f"⚠️ {device}/{profile}: {e.__class__.__name__}: {e}")
+                summary.append({"device": device, "profile": profile, "error": f"{e.__class__.__name__}: {e}"})
+                continue
+            rows.extend(prof_rows)
+            decode_s = sum(r["total_s"] - r["first_token_s"] for r in prof_rows)
+            tok_s = sum(max(r["new_tokens"] - 1, 0) for r in prof_rows) / decode_s if decode_s > 0 else 0.0
+            if profile == "default":
+                base_tok_s = tok_s
+            s = {
+                "device": device, "profile": profile, "calls": len(prof_rows),
+                "load_s": prof_rows[0]["load_s"],
+                "first_token_mean_s": round(float(np.mean([r["first_token_s"] for r in prof_rows])), 4),
+                "first_token_p50_s": round(float(np.median([r["first_token_s"] for r in prof_rows])), 4),
+                "decode_tok_s": round(tok_s, 2),
+                "decode_speedup": round(tok_s / base_tok_s, 3) if base_tok_s else "",
+                "error": "",
+            }
+            summary.append(s)
+            log_line(SCRIPT, f"{device}/{profile}: first token {s['first_token_mean_s']:.3f}s, "
+                             f"{s['decode_tok_s']} tok/s ({s['decode_speedup'] or '-'}× default)")
+
+    if rows:
+        with open(OUT_ROWS, "w", encoding="utf-8", newline="") as f:
+            w = csv.DictWriter(f, fieldnames=list(rows[0]))
+            w.writeheader()
+            w.writerows(rows)
+    fields = ["device", "profile", "calls", "load_s", "first_token_mean_s", "first_token_p50_s",
+              "decode_tok_s", "decode_speedup", "error"]
+    with open(OUT_SUMMARY, "w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=fields, restval="")
+        w.writeheader()
+        w.writerows(summary)
+    log_line(SCRIPT, f"✅ Wrote {OUT_SUMMARY}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+# pipeline_benchmark.py
+import datetime, glob, json, os, platform, random, resource, socket, subprocess, tempfile, time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import torch
+from PIL import Image, ImageDraw, ImageFont
+
+from shared_config import MILU, BENCHMARK_DIR, log_line
+from job_queue import RUNNER_SCRIPTS, list_slides, load_runner_config
+from run_manifest import input_hashes
+from output_store import make_sink
+from inference_engine import InferenceEngine, read_text
+from vlm_wrappers import family_for
+
+SCRIPT = "pipeline_benchmark"
+
+# End-to-end throughput of the extraction step (InferenceEngine.run_batch +
+# output sink) on a fixed synthetic corpus shaped like MILU23/Lecture N/
+# {Images,Texts}: 960×720 slide images — bullets, some with a plot or a
+# scan-like figure — and transcript-style texts. The corpus is generated
+# from SEED once and reused, so runs are comparable across code changes.
+#
+# Time per stage:
+#   image_load  open + decode images, read texts
+#   preprocess  processor / tokenizer work inside generate_batch
+#   prefill     a max_new_tokens=1 pass over the same batch (PREFILL_PROBE);
+#               the probe itself is timed apart (probe_s) and left out of
+#               wall_s and the throughput figures
+#   decode      generate time - preprocess - prefill
+#   parse       safe_json_parse + post_filter_parsed
+#   write       input hashes + sink writes (OUTPUT_FORMAT, to a scratch dir)
+# Results go to BENCHMARK_DIR/pipeline_<model>_<time>.json; each run is
+# compared with the previous one for the same model, device and corpus.
+#
+# MODEL_ID may be any vlm_wrappers family; the default "scripted/..." backend
+# (scripted_backend.py) needs no weights or GPU and measures the pipeline
+# around the model. Its BACKEND_KWARGS can add simulated prefill/decode cost.
+MODEL_ID = "scripted/bench"
+BACKEND_KWARGS: Dict[str, Any] = {}     # e.g. dict(prefill_s_per_token=2e-5, decode_s_per_token=0.02)
+N_LECTURES = 2
+SLIDES_PER_LECTURE = 40
+SEED = 0
+CORPUS_VERSION = 1            # bump when the generator changes
+PROMPT_LECTURE = "Lecture 1"  # whose runner supplies PROMPTS / GEN_KW
+BATCH_SLIDES = 8              # slides per run_batch call (the memory planner may split further)
+MAX_GEN_BATCH = 8
+PREFILL_PROBE = True
+WARMUP_BATCHES = 1
+OUTPUT_FORMAT = "jsonl"
+REGRESSION_TOLERANCE = 0.10   # warn when slides/s drops by more than this vs the previous run
+
+STAGES = ("image_load", "preprocess", "prefill", "decode", "parse", "write")
+
+# ---------- synthetic corpus ----------
+
+TERMS = ["Fourier transform", "point spread function", "sampling theorem", "convolution", "spatial resolution",
+         "signal-to-noise ratio", "contrast", "back projection", "filtered back projection", "sinogram",
+         "Radon transform", "attenuation coefficient", "X-ray tube", "detector array", "k-space",
+         "magnetic field gradient", "Larmor frequency", "T1 relaxation", "T2 relaxation", "ultrasound transducer",
+         "acoustic impedance", "Doppler shift", "gamma camera", "collimator", "positron emission",
+         "Hounsfield unit", "modulation transfer function", "aliasing", "linear system", "impulse response",
+         "MATLAB", "iterative reconstruction", "deep learning", "segmentation", "image registration"]
+SENTENCES = [
+    "In this part we look at how the {a} relates to the {b}.",
+    "The {a} determines how much detail survives, which is why the {b} matters in practice.",
+    "Remember that the {a} is measured with the {b}, so keep both in mind.",
+    "We can write the {a} in terms of the {b}, and this gives us a simple model.",
+    "If you change the {a}, the {b} changes as well; let me show you an example.",
+    "Most scanners today use the {a} together with the {b}.",
+    "This slide summarises the {a}; next time we will connect it to the {b}.",
+]
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:      # Pillow < 10.1
+        return ImageFont.load_default()
+
+def _slide_image(rng: random.Random, title: str, bullets: List[str], figure: Optional[str]) -> Image.Image:
+    im = Image.new("RGB", (960, 720), "white")
+    d = ImageDraw.Draw(im)
+    d.text((48, 32), title, fill=(20, 40, 120), font=_font(40))
+    width = 420 if figure else 860
+    y = 120
+    for b in bullets:
+        d.text((60, y), "- " + b[: width // 9], fill=(30, 30, 30), font=_font(22))
+        y += 44
+    if figure == "plot":
+        d.rectangle((520, 140, 910, 560), outline=(0, 0, 0), width=2)
+        f = rng.uniform(1, 4)
+        pts = [(520 + x, 350 - 150 * np.sin(f * x / 60.0) * np.exp(-x / 300.0)) for x in range(0, 390, 3)]
+        d.line(pts, fill=(200, 30, 30), width=3)
+    elif figure == "scan":
+        yy, xx = np.mgrid[-1:1:420j, -1:1:390j]
+        body = (xx ** 2 / 0.8 + yy ** 2 / 0.6 < 1) * 0.6 + (xx ** 2 / 0.1 + (yy + 0.2) ** 2 / 0.05 < 1) * 0.3
+        noise = np.random.default_rng(rng.randrange(2 ** 32)).normal(0, 0.05, body.shape)
+        im.paste(Image.fromarray(np.clip((body + noise) * 255, 0, 255).astype(np.uint8)).convert("RGB"), (520, 140))
+    return im
+
+def make_corpus(root: str) -> List[str]:
+    """Lecture dirs of the synthetic corpus under root, generated if missing."""
+    stamp = os.path.join(root, "corpus.json")
+    spec = {"version": CORPUS_VERSION, "seed": SEED, "lectures": N_LECTURES, "slides": SLIDES_PER_LECTURE}
+    lectures = [os.path.join(root, f"Lecture {i + 1}") for i in range(N_LECTURES)]
+    if os.path.isfile(stamp):
+        with open(stamp, "r", encoding="utf-8") as f:
+            if json.load(f) == spec:
+                return lectures
+    rng = random.Random(SEED)
+    for lec in lectures:
+        os.makedirs(os.path.join(lec, "Images"), exist_ok=True)
+        os.makedirs(os.path.join(lec, "Texts"), exist_ok=True)
+        for n in range(1, SLIDES_PER_LECTURE + 1):
+            terms = rng.sample(TERMS, rng.randint(3, 8))
+            n_sent = rng.choice([2, 4, 8, 14, 24])         # short title slides up to long narrations
+            text = " ".join(rng.choice(SENTENCES).format(a=rng.choice(terms), b=rng.choice(terms))
+                            for _ in range(n_sent))
+            with open(os.path.join(lec, "Texts", f"Slide{n}.txt"), "w", encoding="utf-8") as f:
+                f.write(text)
+            figure = rng.choice([None, None, "plot", "scan"])
+            _slide_image(rng, terms[0].capitalize(), terms[1:6], figure).save(
+                os.path.join(lec, "Images", f"Slide{n}.JPG"), quality=90)
+    with open(stamp, "w", encoding="utf-8") as f:
+        json.dump(spec, f)
+    return lectures
+
+# ---------- run ----------
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return ""
+
+def previous_result(model_safe: str, device: str, corpus: Dict[str, Any], exclude: str) -> Optional[Dict[str, Any]]:
+    for path in sorted(glob.glob(os.path.join(BENCHMARK_DIR, f"pipeline_{model_safe}_*.json")), reverse=True):
+        if path == exclude:
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            prev = json.load(f)
+        if prev.get("device") == device and prev.get("corpus") == corpus:
+            return prev
+    return None
+
+def main():
+    corpus_root = os.path.join(BENCHMARK_DIR, f"corpus_v{CORPUS_VERSION}_seed{SEED}")
+    lectures = make_corpus(corpus_root)
+    family = family_for(MODEL_ID)
+    cfg = load_runner_config(os.path.join(MILU, PROMPT_LECTURE), family if family in RUNNER_SCRIPTS else "qwen")
+    prompts, gen_kw = cfg["prompts"], cfg["gen_kw"]
+
+    t0 = time.perf_counter()
+    engine = InferenceEngine(MODEL_ID, family=family, max_batch=MAX_GEN_BATCH, **BACKEND_KWARGS)
+    load_s = time.perf_counter() - t0
+    cuda = torch.cuda.is_available() and engine.device == "cuda"
+    batches = []
+    for lec in lectures:
+        slides = list_slides(os.path.join(lec, "Images"))
+        batches += [(lec, slides[i:i + BATCH_SLIDES]) for i in range(0, len(slides), BATCH_SLIDES)]
+    log_line(SCRIPT, f"✅ Loaded: {MODEL_ID} in {load_s:.1f}s — {len(batches)} batches × {len(prompts)} prompts")
+
+    stages = dict.fromkeys(STAGES, 0.0)
+    totals = {"slides": 0, "units": 0, "parsed": 0, "prompt_tokens": 0, "new_tokens": 0}
+    with tempfile.TemporaryDirectory(dir=BENCHMARK_DIR) as scratch:
+        sink = make_sink(OUTPUT_FORMAT, scratch)
+        if cuda:
+            torch.cuda.reset_peak_memory_stats()
+        wall0 = None
+        probe_s = 0.0             # wall time of the PREFILL_PROBE passes, taken out of wall
+        for b, (lec, files) in enumerate(batches):
+            timed = b >= WARMUP_BATCHES
+            if timed and wall0 is None:
+                wall0 = time.perf_counter()
+            t = time.perf_counter()
+            images = {f: Image.open(os.path.join(lec, "Images", f)).convert("RGB") for f in files}
+            texts = {f: read_text(os.path.join(lec, "Texts", os.path.splitext(f)[0] + ".txt")) for f in files}
+            load_t = time.perf_counter() - t
+            run = {st: 0.0 for st in STAGES}
+            run["image_load"] = load_t
+            for prompt_id, prompt_tpl in prompts.items():
+                items = [{"lecture_dir": lec, "slide_file": f, "prompt_id": prompt_id, "prompt_tpl": prompt_tpl,
+                          "slide_text": texts[f], "image": images[f]} for f in files]
+                prefill = 0.0
+                if PREFILL_PROBE:
+                    before = dict(engine.stats)
+                    t = time.perf_counter()
+                    engine.run_batch(items, dict(gen_kw, max_new_tokens=1))
+                    if timed:
+                        probe_s += time.perf_counter() - t
+                    prefill = ((engine.stats["generate_s"] - before["generate_s"])
+                               - (engine.stats["preprocess_s"] - before["preprocess_s"]))
+                    engine.stats = before          # the probe is not part of the pipeline's own work
+                before = dict(engine.stats)
+                records = engine.run_batch(items, gen_kw)
+                gen = engine.stats["generate_s"] - before["generate_s"]
+                prep = engine.stats["preprocess_s"] - before["preprocess_s"]
+                run["preprocess"] += prep
+                run["prefill"] += prefill
+                run["decode"] += max(gen - prep - prefill, 0.0)
+                run["parse"] += engine.stats["parse_s"] - before["parse_s"]
+                t = time.perf_counter()
+                for f, rec in zip(files, records):
+                    inputs = input_hashes(os.path.join(lec, "Images", f), texts[f], prompt_tpl, gen_kw)
+                    sink.write(engine.model_safe, prompt_id, rec, inputs)
+                run["write"] += time.perf_counter() - t
+                if timed:
+                    totals["units"] += len(records)
+                    totals["parsed"] += sum(1 for r in records if r["parsed"])
+                    totals["prompt_tokens"] += engine.stats["prompt_tokens"] - before["prompt_tokens"]
+                    totals["new_tokens"] += engine.stats["new_tokens"] - before["new_tokens"]
+            if timed:
+                totals["slides"] += len(files)
+                for st in STAGES:
+                    stages[st] += run[st]
+        wall = time.perf_counter() - wall0 - probe_s if wall0 is not None else 0.0
+        sink.close()
+
+    peak_gpu = torch.cuda.max_memory_allocated() if cuda else None
+    staged = sum(stages.values())
+    gen_s = stages["preprocess"] + stages["prefill"] + stages["decode"]
+    results = {
+        "wall_s": round(wall, 3),
+        "load_s": round(load_s, 3),
+        "probe_s": round(probe_s, 3),
+        "slides": totals["slides"],
+        "units": totals["units"],
+        "slides_per_s": round(totals["slides"] / wall, 3) if wall else None,
+        "units_per_s": round(totals["units"] / wall, 3) if wall else None,
+        "new_tokens_per_s": round(totals["new_tokens"] / wall, 2) if wall else None,
+        "decode_tokens_per_s": round(totals["new_tokens"] / stages["decode"], 2) if stages["decode"] else None,
+        "prompt_tokens": totals["prompt_tokens"],
+        "new_tokens": totals["new_tokens"],
+        "parsed_rate": round(totals["parsed"] / totals["units"], 4) if totals["units"] else None,
+        "oom_splits": engine.n_oom_splits,
+        "peak_gpu_bytes": peak_gpu,
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "stages_s": {st: round(v, 4) for st, v in stages.items()},
+        "stages_share": {st: round(v / staged, 4) if staged else 0.0 for st, v in stages.items()},
+        "unaccounted_s": round(max(wall - staged, 0.0), 4),
+        "model_s": round(gen_s, 4),
+    }
+    corpus = {"version": CORPUS_VERSION, "seed": SEED, "lectures": N_LECTURES, "slides": SLIDES_PER_LECTURE}
+    ts = datetime.datetime.now(datetime.timezone.utc)
+    report = {
+        "benchmark": "pipeline",
+        "timestamp_utc": ts.isoformat(),
+        "git_commit": git_commit(),
+        "host": socket.gethostname(),
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "model": MODEL_ID,
+        "device": engine.device,
+        "backend_kwargs": BACKEND_KWARGS,
+        "corpus": corpus,
+        "config": {"prompt_lecture": PROMPT_LECTURE, "prompts": list(prompts), "gen_kw": gen_kw,
+                   "batch_slides": BATCH_SLIDES, "max_gen_batch": MAX_GEN_BATCH, "prefill_probe": PREFILL_PROBE,
+                   "warmup_batches": WARMUP_BATCHES, "output_format": OUTPUT_FORMAT},
+        "results": results,
+    }
+    engine.unload()
+
+    out_path = os.path.join(BENCHMARK_DIR, f"pipeline_{engine.model_safe}_{ts.strftime('%Y%m%dT%H%M%SZ')}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    log_line(SCRIPT, f"{results['slides_per_s']} slides/s, {results['new_tokens_per_s']} new tokens/s, "
+                     f"parsed {results['parsed_rate']}, peak RSS {results['peak_rss_bytes'] / 1e9:.2f} GB"
+                     + (f", peak GPU {peak_gpu / 1e9:.2f} GB" if peak_gpu is not None else ""))
+    log_line(SCRIPT, "Stages: " + ", ".join(f"{st} {results['stages_s'][st]:.3f}s ({results['stages_share'][st]:.0%})"
+                                            for st in STAGES))
+    prev = previous_result(engine.model_safe, report["device"], corpus, out_path)
+    if prev is not None:
+        p = prev["results"]
+        if p.get("slides_per_s") and results["slides_per_s"]:
+            ratio = results["slides_per_s"] / p["slides_per_s"]
+            flag = "⚠️ regression" if ratio < 1 - REGRESSION_TOLERANCE else "ok"
+            log_line(SCRIPT, f"vs {prev['git_commit'] or prev['timestamp_utc']}: {ratio:.2f}× slides/s ({flag}); "
+                             + ", ".join(f"{st} {results['stages_s'][st] - p['stages_s'].get(st, 0.0):+.3f}s"
+                                         for st in STAGES))
+    log_line(SCRIPT, f"✅ Wrote {out_path}")
+
+if __name__ == "__main__":
+    main()
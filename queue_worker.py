@@ -0,0 +1,197 @@
+# queue_worker.py
+import os, time, traceback
+from typing import Any, Dict, List, Optional, Tuple
+
+from shared_config import MILU, JOB_QUEUE_DB, log_line
+from job_queue import JobQueue, LeaseKeeper, load_runner_config, worker_name
+from output_store import make_sink
+from run_manifest import RunManifest, completed_units
+from slide_dedup import DedupReuse
+from inference_engine import InferenceEngine
+from image_router import ImageRouter
+
+SCRIPT = "queue_worker"
+
+# Start one of these per GPU box (python queue_worker.py from the repo root);
+# jobs come from enqueue_jobs.py. A worker keeps one model loaded and only
+# switches when that model has nothing left to claim.
+WORKER_MODELS = None          # e.g. ["Qwen/Qwen3-VL-4B-Instruct"]; None = any queued model
+BATCH_SIZE = 16               # jobs leased per claim; generate batches are cut from these
+MAX_GEN_BATCH = 8             # upper bound for InferenceEngine's memory planner
+LEASE_SECONDS = 900           # a lease not renewed for this long is reclaimed by other workers
+HEARTBEAT_SECONDS = 60
+POLL_SECONDS = 30             # wait while only other workers' leases are outstanding
+EXIT_WHEN_DRAINED = True
+# Several workers may write the same lecture at once and JSONL shards assume a
+# single appender, so workers write atomic per-slide files by default.
+OUTPUT_FORMAT = "per_slide"
+# Preprocessed image tensors shared by all workers on this filesystem (None = off).
+TENSOR_CACHE_DIR = None       # e.g. os.path.join(DATA_DIR, "tensor_cache")
+# Vision-encoder outputs, LRU-capped; the cap is per worker's view of the directory.
+EMBED_CACHE_DIR = None        # e.g. os.path.join(DATA_DIR, "embed_cache")
+EMBED_CACHE_MAX_GB = 20
+# Speculative decoding drafts for Qwen-VL targets (see speculative_benchmark.py)
+DRAFT_MODELS: Dict[str, str] = {}  # e.g. {"Qwen/Qwen3-VL-4B-Instruct": "Qwen/Qwen3-VL-2B-Instruct"}
+PERF_PROFILE = "default"      # vlm_wrappers.PERF_PROFILES
+
+class LectureOutputs:
+    """Sink + run manifest + resume info + duplicate-slide reuse per lecture, opened on first use."""
+
+    def __init__(self, meta: Dict[str, Any]):
+        self.meta = meta
+        self._open: Dict[str, Tuple[Any, RunManifest, Dict, DedupReuse]] = {}
+
+    def get(self, lecture: str):
+        if lecture not in self._open:
+            out_root = os.path.join(MILU, lecture, "Outputs")
+            done = completed_units(out_root)
+            manifest = RunManifest(out_root, self.meta)
+            self._open[lecture] = (make_sink(OUTPUT_FORMAT, out_root, manifest=manifest), manifest, done,
+                                   DedupReuse(os.path.join(MILU, lecture)))
+        return self._open[lecture]
+
+    def close(self, status: str = "ok") -> None:
+        for sink, manifest, _, dedup in self._open.values():
+            sink.close()
+            manifest.close(status)
+            dedup.close()
+        self._open.clear()
+
+def pick_model(q: JobQueue, current: Optional[str], broken: set) -> Optional[str]:
+    pending = {m: n for m, n in q.pending_by_model(WORKER_MODELS).items() if m not in broken}
+    if current in pending:
+        return current
+    return max(pending, key=pending.get) if pending else None
+
+def main():
+    worker = worker_name()
+    q = JobQueue(JOB_QUEUE_DB, lease_seconds=LEASE_SECONDS)
+    keeper = LeaseKeeper(q, worker, HEARTBEAT_SECONDS)
+    keeper.start()
+    outputs = LectureOutputs({"script": SCRIPT, "worker": worker, "perf_profile": PERF_PROFILE,
+                              "output_format": OUTPUT_FORMAT})
+    configs: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    engine: Optional[InferenceEngine] = None
+    broken: set = set()
+    routers: Dict[str, ImageRouter] = {}   # IMAGE_ROUTING mode -> router (decisions cached per image)
+    n_done = n_skipped = n_reused = n_failed = 0
+    status = "ok"
+
+    log_line(SCRIPT, f"Worker {worker} on {JOB_QUEUE_DB}")
+    try:
+        while True:
+            model = pick_model(q, engine.model_id if engine else None, broken)
+            if model is None:
+                if EXIT_WHEN_DRAINED and q.n_leased() == 0:
+                    break
+                time.sleep(POLL_SECONDS)
+                continue
+
+            jobs = q.claim(worker, BATCH_SIZE, models=[model])
+            if not jobs:
+                continue
+            keeper.hold([j["id"] for j in jobs])
+
+            if engine is None or engine.model_id != model:
+                if engine is not None:
+                    engine.unload()
+                    engine = None
+                try:
+                    engine = InferenceEngine(model, family=jobs[0]["family"], tensor_cache_dir=TENSOR_CACHE_DIR,
+                                             embed_cache_dir=EMBED_CACHE_DIR,
+                                             embed_cache_max_bytes=int(EMBED_CACHE_MAX_GB * 1e9),
+                                             max_batch=MAX_GEN_BATCH, perf_profile=PERF_PROFILE,
+                                             **({"draft_model_id": DRAFT_MODELS[model]} if model in DRAFT_MODELS else {}))
+                    log_line(SCRIPT, f"✅ Loaded: {model}")
+                except Exception as e:
+                    log_line(SCRIPT, f"❌ Cannot load {model} here: {e}")
+                    broken.add(model)
+                    q.release(worker, [j["id"] for j in jobs])
+                    keeper.hold([])
+                    continue
+
+            # resumed / reused jobs finish here; the rest are generated per (lecture, prompt) batch
+            to_generate: Dict[Tuple[str, str], List[Tuple[Dict[str, Any], Dict[str, Any], Dict[str, str]]]] = {}
+            for job in jobs:
+                lec_dir = os.path.join(MILU, job["lecture"])
+                try:
+                    cfg_key = (job["lecture"], job["family"])
+                    if cfg_key not in configs:
+                        configs[cfg_key] = load_runner_config(lec_dir, job["family"])
+                    cfg = configs[cfg_key]
+                    prompt_tpl = cfg["prompts"][job["prompt"]]
+                    budget = cfg["pixel_budgets"].get(model)
+                    router = routers.setdefault(cfg["image_routing"], ImageRouter(cfg["image_routing"]))
+                    run_kw = router.gen_kw(dict(cfg["gen_kw"], pixel_budget=budget) if budget else cfg["gen_kw"])
+                    slide_text, inputs = engine.slide_inputs(lec_dir, job["slide_file"], prompt_tpl, run_kw)
+
+                    sink, _, done, dedup = outputs.get(job["lecture"])
+                    prev = done.get((engine.model_safe, job["prompt"], job["slide_id"]))
+                    if prev is not None and prev.get("inputs") == inputs:
+                        n_skipped += 1
+                    else:
+                        record = dedup.reuse(engine.model_safe, job["prompt"], job["slide_id"], inputs)
+                        if record is None:
+                            use_image = router.use_image(os.path.join(lec_dir, "Images", job["slide_file"]))
+                            item = {"lecture_dir": lec_dir, "slide_file": job["slide_file"], "prompt_id": job["prompt"],
+                                    "prompt_tpl": prompt_tpl, "slide_text": slide_text, "use_image": use_image}
+                            to_generate.setdefault((job["lecture"], job["prompt"]), []).append((job, item, inputs))
+                            continue
+                        n_reused += 1
+                        sink.write(engine.model_safe, job["prompt"], record, inputs)
+                    if not q.complete(job["id"], worker):
+                        log_line(SCRIPT, f"⚠️ Lease on job {job['id']} was lost before completion")
+                except Exception as e:
+                    n_failed += 1
+                    log_line(SCRIPT, f"❌ Job {job['id']} ({job['lecture']}/{job['slide_id']}/{job['prompt']}): {e}")
+                    q.fail(job["id"], worker, traceback.format_exc())
+                keeper.drop(job["id"])
+
+            for (lecture, _), group in to_generate.items():
+                cfg = configs[(lecture, group[0][0]["family"])]
+                budget = cfg["pixel_budgets"].get(model)
+                if hasattr(engine.wrapper, "set_pixel_budget"):
+                    engine.wrapper.set_pixel_budget(**(budget or {}))
+                sink, _, _, dedup = outputs.get(lecture)
+                try:
+                    records = engine.run_batch([item for _, item, _ in group], cfg["gen_kw"])
+                except Exception as e:
+                    err = traceback.format_exc()
+                    for job, _, _ in group:
+                        n_failed += 1
+                        log_line(SCRIPT, f"❌ Job {job['id']} ({lecture}/{job['slide_id']}/{job['prompt']}): {e}")
+                        q.fail(job["id"], worker, err)
+                        keeper.drop(job["id"])
+                    continue
+                for (job, item, inputs), record in zip(group, records):
+                    try:
+                        if cfg["image_routing"] != "always":
+                            record["image_used"] = item["use_image"]
+                        dedup.remember(engine.model_safe, job["prompt"], record)
+                        sink.write(engine.model_safe, job["prompt"], record, inputs)
+                        n_done += 1
+                        if not q.complete(job["id"], worker):
+                            log_line(SCRIPT, f"⚠️ Lease on job {job['id']} was lost before completion")
+                    except Exception as e:
+                        n_failed += 1
+                        log_line(SCRIPT, f"❌ Job {job['id']} ({lecture}/{job['slide_id']}/{job['prompt']}): {e}")
+                        q.fail(job["id"], worker, traceback.format_exc())
+                    keeper.drop(job["id"])
+    except KeyboardInterrupt:
+        status = "interrupted"
+        log_line(SCRIPT, "Interrupted — handing leased jobs back")
+    except BaseException:
+        status = "failed"
+        raise
+    finally:
+        keeper.stop()
+        q.release(worker)
+        outputs.close(status)
+        q.close()
+
+    log_line(SCRIPT, f"✅ Worker {worker} finished: {n_done} generated, {n_reused} reused from duplicate slides, "
+                     f"{n_skipped} already done, {n_failed} failed"
+                     + (f", {engine.n_oom_splits} batches split after OOM" if engine else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# qwen_resolution_sweep.py
+import csv, os, random, re, time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from shared_config import MILU, ANALYSIS_DIR, log_line
+from job_queue import list_slides, load_runner_config
+from inference_engine import InferenceEngine
+from fuse_models_multi import extract_concepts, extract_triples
+from analyze_model_agreement_multi import jaccard, triple_f1
+
+SCRIPT = "qwen_resolution_sweep"
+
+# Runs a sample of slides through one Qwen-VL model at several resolution
+# budgets and compares every budget with the unrestricted ("full") run:
+# latency, visual/prompt tokens, concept Jaccard and triple F1. The cheapest
+# budget that stays above the quality floors is the one to put in the
+# runners' PIXEL_BUDGETS.
+MODEL_ID = "Qwen/Qwen3-VL-4B-Instruct"
+LECTURES = None               # e.g. ["Lecture 1", "Lecture 7"]; None = all
+N_SLIDES = 40                 # sampled across the chosen lectures
+SEED = 0
+# "full" must stay first: it is the processor default (12.8M pixels for
+# Qwen2/2.5-VL), above every slide image here, so slides go in unscaled.
+BUDGETS: Dict[str, Dict[str, int]] = {
+    "full": {},
+    "tok2048": dict(max_visual_tokens=2048),
+    "tok1024": dict(max_visual_tokens=1024),
+    "tok512": dict(max_visual_tokens=512),
+    "tok256": dict(max_visual_tokens=256),
+}
+MIN_CONCEPT_JACCARD = 0.9
+MIN_TRIPLE_F1 = 0.8
+
+OUT_ROWS = os.path.join(ANALYSIS_DIR, "qwen_resolution_sweep_rows.csv")
+OUT_SUMMARY = os.path.join(ANALYSIS_DIR, "qwen_resolution_sweep.csv")
+
+def list_lectures(base: str) -> List[str]:
+    out = []
+    for name in os.listdir(base):
+        p = os.path.join(base, name)
+        if name.lower().startswith("lecture ") and os.path.isdir(p):
+            out.append(name)
+    out.sort(key=lambda x: int(re.findall(r"\d+", x)[-1]))
+    return out
+
+def sample_slides(lectures: List[str], n: int, seed: int) -> List[Tuple[str, str]]:
+    """(lecture, image file) pairs with a text file, sampled reproducibly."""
+    pool = []
+    for lec in lectures:
+        lec_dir = os.path.join(MILU, lec)
+        for f in list_slides(os.path.join(lec_dir, "Images")):
+            if os.path.exists(os.path.join(lec_dir, "Texts", os.path.splitext(f)[0] + ".txt")):
+                pool.append((lec, f))
+    rng = random.Random(seed)
+    return sorted(rng.sample(pool, min(n, len(pool))))
+
+def timed_run(engine: InferenceEngine, lec_dir: str, slide_file: str, prompt_id: str,
+              prompt_tpl: str, gen_kw: Dict[str, Any], **kwargs) -> Tuple[Dict[str, Any], float]:
+    """engine.run_slide(...) and its wall time; kwargs go to run_slide."""
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    t0 = time.perf_counter()
+    rec = engine.run_slide(lec_dir, slide_file, prompt_id, prompt_tpl, gen_kw, **kwargs)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return rec, time.perf_counter() - t0
+
+def agreement(prompt_id: str, rec: Dict[str, Any], ref: Dict[str, Any]) -> Optional[float]:
+    """
+    Concept Jaccard / triple F1 of a budgeted record against the full-resolution one;
+    None when neither has items (jaccard/triple_f1 would score that 0).
+    """
+    if prompt_id == "concepts":
+        a, b = extract_concepts({"concepts": rec}), extract_concepts({"concepts": ref})
+        return jaccard(a, b) if a or b else None
+    if prompt_id == "triples":
+        a, b = extract_triples({"triples": rec}), extract_triples({"triples": ref})
+        return triple_f1(a, b) if a or b else None
+    return None
+
+def main():
+    lectures = LECTURES or list_lectures(MILU)
+    slides = sample_slides(lectures, N_SLIDES, SEED)
+    if not slides:
+        raise FileNotFoundError(f"No slides with texts under {MILU}")
+    cfg = load_runner_config(os.path.join(MILU, slides[0][0]), "qwen")
+    prompts, gen_kw = cfg["prompts"], cfg["gen_kw"]
+
+    engine = InferenceEngine(MODEL_ID, family="qwen")
+    wrapper = engine.wrapper
+    log_line(SCRIPT, f"✅ Loaded: {MODEL_ID} — {len(slides)} slides × {len(prompts)} prompts × {len(BUDGETS)} budgets")
+
+    rows: List[Dict[str, Any]] = []
+    refs: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+    for name, budget in BUDGETS.items():
+        lo, hi = wrapper.set_pixel_budget(**budget)
+        log_line(SCRIPT, f"Budget {name}: {lo}–{hi} pixels (≤{hi // wrapper.pixels_per_token()} visual tokens)")
+        for lec, slide_file in slides:
+            lec_dir = os.path.join(MILU, lec)
+            for prompt_id, prompt_tpl in prompts.items():
+                rec, secs = timed_run(engine, lec_dir, slide_file, prompt_id, prompt_tpl, gen_kw)
+                key = (lec, slide_file, prompt_id)
+                if name == "full":
+                    refs[key] = rec
+                rows.append({
+                    "budget": name, "lecture": lec, "slide_id": rec["slide_id"], "prompt": prompt_id,
+                    "latency_s": round(secs, 4), **wrapper.last_stats,
+                    "parsed_ok": int(bool(rec["parsed"])),
+                    "agreement": agreement(prompt_id, rec, refs[key]),
+                })
+    wrapper.set_pixel_budget()
+    engine.unload()
+
+    with open(OUT_ROWS, "w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=list(rows[0]))
+        w.writeheader()
+        w.writerows(rows)
+
+    summary = []
+    for name, budget in BUDGETS.items():
+        sub = [r for r in rows if r["budget"] == name]
+        conc = [r["agreement"] for r in sub if r["prompt"] == "concepts" and r["agreement"] is not None]
+        trip = [r["agreement"] for r in sub if r["prompt"] == "triples" and r["agreement"] is not None]
+        summary.append({
+            "budget": name,
+            "settings": ";".join(f"{k}={v}" for k, v in budget.items()) or "default",
+            "n": len(sub),
+            "latency_mean_s": round(float(np.mean([r["latency_s"] for r in sub])), 4),
+            "latency_p50_s": round(float(np.median([r["latency_s"] for r in sub])), 4),
+            "visual_tokens_mean": round(float(np.mean([r["visual_tokens"] for r in sub])), 1),
+            "prompt_tokens_mean": round(float(np.mean([r["prompt_tokens"] for r in sub])), 1),
+            "parsed_ok_rate": round(float(np.mean([r["parsed_ok"] for r in sub])), 4),
+            "concept_jaccard_mean": round(float(np.mean(conc)), 4) if conc else "",
+            "triple_f1_mean": round(float(np.mean(trip)), 4) if trip else "",
+        })
+    with open(OUT_SUMMARY, "w", encoding="utf-8", newline="") as f:
+        w = csv.DictWriter(f, fieldnames=list(summary[0]))
+        w.writeheader()
+        w.writerows(summary)
+
+    for s in summary:
+        log_line(SCRIPT, f"{s['budget']:>8}: {s['latency_mean_s']:.2f}s, {s['visual_tokens_mean']:.0f} visual tokens, "
+                         f"concepts J={s['concept_jaccard_mean']}, triples F1={s['triple_f1_mean']}")
+    ok = [s for s in summary[1:]
+          if (s["concept_jaccard_mean"] == "" or s["concept_jaccard_mean"] >= MIN_CONCEPT_JACCARD)
+          and (s["triple_f1_mean"] == "" or s["triple_f1_mean"] >= MIN_TRIPLE_F1)]
+    if ok:
+        best = min(ok, key=lambda s: s["latency_mean_s"])
+        log_line(SCRIPT, f"✅ Cheapest budget within quality floors: {best['budget']} ({best['settings']}), "
+                         f"{best['latency_mean_s'] / summary[0]['latency_mean_s']:.0%} of full-resolution latency")
+    else:
+        log_line(SCRIPT, "⚠️ No reduced budget meets the quality floors; keep full resolution")
+    log_line(SCRIPT, f"✅ Wrote {OUT_SUMMARY} and {OUT_ROWS}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# reparse_outputs.py
+import os, re, json
+from typing import List, Optional
+
+from shared_config import MILU, log_line
+from slide_parsing import safe_json_parse, post_filter_parsed
+from output_store import JsonlShardReader, JsonlShardWriter, atomic_write_json, shard_path
+
+SCRIPT = "reparse_outputs"
+
+# Re-run the (truncation-tolerant) parser over the stored raw_output of every
+# runner record — no re-generation. By default only records that have no full
+# answer are touched: parsed is None, or only the last array element survived
+# (a bare {"term": ...} / {"s": ...} object from an output cut at max_new_tokens).
+# Per-slide files are rewritten in place; JSONL shards get the updated record
+# appended (the shard index then points at it).
+ONLY_INCOMPLETE = True
+DRY_RUN = False
+
+def list_lectures(base: str) -> List[str]:
+    out = []
+    for name in os.listdir(base):
+        p = os.path.join(base, name)
+        if name.lower().startswith("lecture ") and os.path.isdir(p):
+            out.append(name)
+    out.sort(key=lambda x: int(re.findall(r"\d+", x)[-1]))
+    return out
+
+def read_text(path: str) -> str:
+    # same as the runners' read_text, so grounding sees identical slide text
+    if not os.path.isfile(path):
+        return ""
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        return f.read().strip()
+
+def is_incomplete(parsed: Optional[dict]) -> bool:
+    if not isinstance(parsed, dict):
+        return True
+    return "concepts" not in parsed and "triples" not in parsed
+
+def main():
+    seen = changed = recovered = partial = 0
+
+    def reparse(rec: dict, lec: str, prompt_id: str) -> bool:
+        """Re-parse one record in place; True if its "parsed" changed."""
+        nonlocal seen, changed, recovered, partial
+        seen += 1
+        old = rec.get("parsed")
+        if ONLY_INCOMPLETE and not is_incomplete(old):
+            return False
+
+        slide_text = read_text(os.path.join(MILU, lec, "Texts", f"{rec.get('slide_id')}.txt"))
+        parsed = safe_json_parse(rec.get("raw_output") or "")
+        if parsed:
+            parsed = post_filter_parsed(parsed, slide_text, rec.get("prompt", prompt_id))
+        if parsed == old:
+            return False
+
+        changed += 1
+        if old is None and parsed is not None:
+            recovered += 1
+        if isinstance(parsed, dict) and parsed.get("partial"):
+            partial += 1
+        rec["parsed"] = parsed
+        return True
+
+    for lec in list_lectures(MILU):
+        out_root = os.path.join(MILU, lec, "Outputs")
+        if not os.path.isdir(out_root):
+            continue
+        for model_safe in sorted(os.listdir(out_root)):
+            for prompt_id in ("concepts", "triples"):
+                shard = shard_path(out_root, model_safe, prompt_id)
+                if os.path.isfile(shard):
+                    with JsonlShardReader(shard) as r:
+                        updates = [rec for _, rec in r if reparse(rec, lec, prompt_id)]
+                    if updates and not DRY_RUN:
+                        with JsonlShardWriter(shard) as w:
+                            for rec in updates:
+                                w.append(rec)
+
+                d = os.path.join(out_root, model_safe, prompt_id)
+                if not os.path.isdir(d):
+                    continue
+                for fn in sorted(os.listdir(d)):
+                    if not fn.lower().endswith(".json"):
+                        continue
+                    path = os.path.join(d, fn)
+                    try:
+                        with open(path, "r", encoding="utf-8") as f:
+                            rec = json.load(f)
+                    except Exception:
+                        continue
+                    if not reparse(rec, lec, prompt_id) or DRY_RUN:
+                        continue
+                    atomic_write_json(path, rec)
+
+    log_line(SCRIPT, f"Scanned {seen} records ({'incomplete only' if ONLY_INCOMPLETE else 'all'})")
+    log_line(SCRIPT, f"✅ Updated {changed} records: {recovered} previously unparsed, "
+                     f"{partial} flagged partial{' (dry run, nothing written)' if DRY_RUN else ''}")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 # report_parsing_coverage.py
 import os, re, json, csv
-from typing import List
+from typing import Dict, List, Tuple
 
-from shared_config import BY_SLIDE_DIR, ANALYSIS_DIR, SELECTED_MODELS, log_line
+from shared_config import MILU, BY_SLIDE_DIR, ANALYSIS_DIR, SELECTED_MODELS, log_line
+from run_manifest import completed_units, run_summaries
 
 SCRIPT = "report_parsing_coverage"
 
@@ -28,6 +29,43 @@ def safe_jload(path: str):
     except Exception:
         return None
 
+def is_partial(parsed) -> bool:
+    """Recovered from a truncated output by slide_parsing.safe_json_parse."""
+    return isinstance(parsed, dict) and bool(parsed.get("partial"))
+
+def write_run_coverage() -> None:
+    """Completed (model, prompt, slide) units per lecture, straight from the run manifests."""
+    run_csv = os.path.join(ANALYSIS_DIR, "run_coverage.csv")
+    n_rows = 0
+    with open(run_csv, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["lecture", "model", "prompt", "units_done", "parsed_ok",
+                         "runs", "incomplete_runs"])
+        for lec in list_lectures(MILU):
+            out_root = os.path.join(MILU, lec, "Outputs")
+            units = completed_units(out_root)
+            if not units:
+                continue
+            runs = run_summaries(out_root)
+            # crashed ("failed"), interrupted and never-closed ("incomplete") runs
+            n_incomplete = sum(1 for r in runs if r["status"] != "ok")
+
+            counts: Dict[Tuple[str, str], List[int]] = {}
+            for (m, prompt, _), e in units.items():
+                c = counts.setdefault((m, prompt), [0, 0])
+                c[0] += 1
+                c[1] += int(bool(e.get("parsed_ok")))
+            for (m, prompt), (n, ok) in sorted(counts.items()):
+                writer.writerow([lec, m, prompt, n, ok, len(runs), n_incomplete])
+                n_rows += 1
+            if n_incomplete:
+                log_line(SCRIPT, f"⚠️ {lec}: {n_incomplete}/{len(runs)} runs did not finish cleanly")
+
+    if n_rows:
+        log_line(SCRIPT, f"✅ Run-manifest coverage saved to: {run_csv}")
+    else:
+        log_line(SCRIPT, "No run manifests found (outputs predate manifests)")
+
 def main():
     if not os.path.isdir(BY_SLIDE_DIR):
         log_line(SCRIPT, f"❌ Not found: {BY_SLIDE_DIR}")
@@ -36,7 +74,7 @@ def main():
     os.makedirs(ANALYSIS_DIR, exist_ok=True)
     cov_csv = os.path.join(ANALYSIS_DIR, "parsing_coverage.csv")
 
-    # model -> lecture -> [have, total]
+    # model -> lecture -> [have, total, partial]
     per_model_concepts = {m: {} for m in SELECTED_MODELS}
     per_model_triples  = {m: {} for m in SELECTED_MODELS}
 
@@ -49,8 +87,8 @@ def main():
             continue
 
         for m in SELECTED_MODELS:
-            per_model_concepts[m].setdefault(lec, [0, total])
-            per_model_triples[m].setdefault(lec, [0, total])
+            per_model_concepts[m].setdefault(lec, [0, total, 0])
+            per_model_triples[m].setdefault(lec, [0, total, 0])
 
         for sf in slide_files:
             p = os.path.join(lec_dir, sf)
@@ -67,38 +105,44 @@ def main():
 
                 if isinstance(c, dict) and c.get("parsed") is not None:
                     per_model_concepts[m][lec][0] += 1
+                    if is_partial(c["parsed"]):
+                        per_model_concepts[m][lec][2] += 1
                 if isinstance(t, dict) and t.get("parsed") is not None:
                     per_model_triples[m][lec][0] += 1
+                    if is_partial(t["parsed"]):
+                        per_model_triples[m][lec][2] += 1
 
     # Print to console + CSV for table
     with open(cov_csv, "w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(["model", "lecture", "lecture_index",
                          "concepts_valid", "concepts_total",
-                         "triples_valid", "triples_total"])
+                         "triples_valid", "triples_total",
+                         "concepts_partial", "triples_partial"])
 
         log_line(SCRIPT, "\n=== PARSING COVERAGE (valid parsed JSON only) ===\n")
 
         for m in SELECTED_MODELS:
             log_line(SCRIPT, f"[{m}]")
             for lec in lectures:
-                cv = per_model_concepts[m].get(lec, [0, 0])
-                tv = per_model_triples[m].get(lec, [0, 0])
-                c_have, c_tot = cv
-                t_have, t_tot = tv
+                cv = per_model_concepts[m].get(lec, [0, 0, 0])
+                tv = per_model_triples[m].get(lec, [0, 0, 0])
+                c_have, c_tot, c_part = cv
+                t_have, t_tot, t_part = tv
                 c_pct = (c_have / c_tot * 100.0) if c_tot else 0.0
                 t_pct = (t_have / t_tot * 100.0) if t_tot else 0.0
                 idx = int(re.findall(r"\d+", lec)[-1])
 
                 log_line(SCRIPT,
-                    f"  {lec:>9}: C {c_have:4d}/{c_tot:<4d} ({c_pct:6.2f}%) | "
-                    f"T {t_have:4d}/{t_tot:<4d} ({t_pct:6.2f}%)"
+                    f"  {lec:>9}: C {c_have:4d}/{c_tot:<4d} ({c_pct:6.2f}%, {c_part} partial) | "
+                    f"T {t_have:4d}/{t_tot:<4d} ({t_pct:6.2f}%, {t_part} partial)"
                 )
-                writer.writerow([m, lec, idx, c_have, c_tot, t_have, t_tot])
+                writer.writerow([m, lec, idx, c_have, c_tot, t_have, t_tot, c_part, t_part])
 
             log_line(SCRIPT, "")
 
     log_line(SCRIPT, f"✅ Coverage CSV saved to: {cov_csv}")
+    write_run_coverage()
 
 if __name__ == "__main__":
     main()
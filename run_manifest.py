@@ -0,0 +1,140 @@
+# run_manifest.py
+import datetime, hashlib, json, os, socket
+from typing import Any, Dict, List, Optional, Tuple
+
+# Every runner invocation appends to its own manifest,
+# Outputs/_manifests/run_<utc>_<host>_<pid>.jsonl:
+#   {"type": "run", ...}   header (script, host, models, gen kwargs, output format)
+#   {"type": "unit", ...}  one line per durably written (model, prompt, slide) record,
+#                          with hashes of the inputs that produced it
+#   {"type": "end", ...}   footer, only present if the run finished cleanly
+# Resume, audit and coverage read these instead of rescanning Outputs/.
+
+MANIFEST_DIRNAME = "_manifests"
+
+UnitKey = Tuple[str, str, str]   # (model_safe, prompt_id, slide_id)
+
+def utc_now() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+def file_sha1(path: str, chunk: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def text_sha1(s: str) -> str:
+    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
+def input_hashes(img_path: str, slide_text: str, prompt_tpl: str, gen_kw: Dict[str, Any]) -> Dict[str, str]:
+    """Everything that determines a (greedy) record: image bytes, slide text, prompt, gen kwargs."""
+    return {
+        "image": file_sha1(img_path),
+        "text": text_sha1(slide_text),
+        "prompt": text_sha1(prompt_tpl),
+        "gen": text_sha1(json.dumps(gen_kw, sort_keys=True, default=str)),
+    }
+
+def manifest_dir(out_root: str) -> str:
+    return os.path.join(out_root, MANIFEST_DIRNAME)
+
+class RunManifest:
+    """
+    Append-only manifest for one run. Units are buffered by add() and only
+    written by flush(), which callers invoke once the records they describe
+    are on disk — a listed unit always has a durable record behind it.
+    """
+
+    def __init__(self, out_root: str, meta: Optional[Dict[str, Any]] = None):
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S")
+        host = socket.gethostname()
+        self.run_id = f"{stamp}_{host}_{os.getpid()}"
+        os.makedirs(manifest_dir(out_root), exist_ok=True)
+        self.path = os.path.join(manifest_dir(out_root), f"run_{self.run_id}.jsonl")
+        self.n_units = 0
+        self._pending: List[str] = []
+        self._f = open(self.path, "a", encoding="utf-8")
+        self._write({"type": "run", "run_id": self.run_id, "started_utc": utc_now(),
+                     "host": host, "pid": os.getpid(), **(meta or {})})
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        self._f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def add(self, model_safe: str, prompt_id: str, slide_id: str, inputs: Dict[str, str],
+            output: str, parsed_ok: bool) -> None:
+        self._pending.append(json.dumps({
+            "type": "unit", "model": model_safe, "prompt": prompt_id, "slide_id": slide_id,
+            "inputs": inputs, "output": output, "parsed_ok": bool(parsed_ok), "t": utc_now(),
+        }, ensure_ascii=False))
+
+    def flush(self) -> None:
+        if not self._pending or self._f.closed:
+            return
+        self._f.write("\n".join(self._pending) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self.n_units += len(self._pending)
+        self._pending = []
+
+    def close(self, status: str = "ok") -> None:
+        if self._f.closed:
+            return
+        self.flush()
+        self._write({"type": "end", "run_id": self.run_id, "finished_utc": utc_now(),
+                     "status": status, "n_units": self.n_units})
+        self._f.close()
+
+# ---------- reading ----------
+
+def read_manifest(path: str) -> List[Dict[str, Any]]:
+    """All entries of one manifest; a torn last line (killed run) is skipped."""
+    out = []
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(e, dict):
+                    out.append(e)
+    except OSError:
+        pass
+    return out
+
+def list_manifests(out_root: str) -> List[str]:
+    d = manifest_dir(out_root)
+    if not os.path.isdir(d):
+        return []
+    return [os.path.join(d, fn) for fn in sorted(os.listdir(d))
+            if fn.startswith("run_") and fn.endswith(".jsonl")]
+
+def completed_units(out_root: str) -> Dict[UnitKey, Dict[str, Any]]:
+    """Latest unit entry per (model, prompt, slide) over all runs (manifest names sort by start time)."""
+    done: Dict[UnitKey, Dict[str, Any]] = {}
+    for path in list_manifests(out_root):
+        for e in read_manifest(path):
+            if e.get("type") == "unit":
+                done[(e.get("model"), e.get("prompt"), e.get("slide_id"))] = e
+    return done
+
+def run_summaries(out_root: str) -> List[Dict[str, Any]]:
+    """Header + unit count + end status per run, for auditing."""
+    out = []
+    for path in list_manifests(out_root):
+        entries = read_manifest(path)
+        head = next((e for e in entries if e.get("type") == "run"), {})
+        end = next((e for e in entries if e.get("type") == "end"), None)
+        out.append({
+            "run_id": head.get("run_id", os.path.basename(path)),
+            "host": head.get("host"),
+            "script": head.get("script"),
+            "started_utc": head.get("started_utc"),
+            "finished_utc": end.get("finished_utc") if end else None,
+            "status": end.get("status") if end else "incomplete",
+            "n_units": sum(1 for e in entries if e.get("type") == "unit"),
+        })
+    return out
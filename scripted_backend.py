@@ -0,0 +1,138 @@
+# scripted_backend.py
+import hashlib, json, random, re, time
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+from stage_profiler import timed
+
+# A VLM without weights, for exercising everything around the models on a
+# CPU-only machine with no network: InferenceEngine batching and the memory
+# planner's OOM split, the model pool, queue workers, caches, resume, parsing
+# and grounding. Implements vlm_wrappers.VLMBackend; load it like any other
+# family with a "scripted/<name>" model id, e.g.
+#   InferenceEngine("scripted/qwen-like", family="scripted")
+#
+# Answers are deterministic per (model id, seed, prompt, image size) and look
+# like what the real models return for the runners' prompts: concepts and
+# triples whose terms are taken verbatim from the SLIDE_TEXT block, sometimes
+# fenced or followed by prose, cut off at max_new_tokens like a real decode.
+# Optional sleeps model prefill / decode cost (batched decode runs rows in
+# parallel, so batches pay the longest row once), and oom_tokens raises the
+# same "out of memory" RuntimeError torch does when a call is too large.
+
+CATEGORIES = ["software", "workflow", "mathematics", "signal_processing", "frequency_domain", "physics",
+              "instrumentation", "data_processing", "reconstruction", "quality_metric", "communication",
+              "modality", "anatomy", "algorithm", "ai_ml"]
+PREDICATES = ["uses", "via", "represents", "depends_on", "measures", "produces", "reconstructs_with"]
+STOPWORDS = {"a", "an", "as", "at", "be", "by", "in", "is", "it", "of", "on", "or", "to", "we", "the", "and",
+             "for", "with", "from", "that", "this", "are", "was", "were", "into", "onto", "which", "their",
+             "there", "then", "than", "also", "can", "will", "using", "used", "each", "where", "when"}
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+SLIDE_TEXT_RE = re.compile(r"SLIDE_TEXT:\n(.*?)\n\s*(?:STRICT INSTRUCTIONS|OUTPUT|$)", re.S)
+
+def _terms(text: str) -> List[str]:
+    """Candidate terms as they appear in text: content words and two-word phrases."""
+    words = re.findall(r"[A-Za-z][A-Za-z0-9\-]+", text)
+    out, seen = [], set()
+    for i, w in enumerate(words):
+        cands = [w]
+        if i + 1 < len(words) and w.lower() not in STOPWORDS and words[i + 1].lower() not in STOPWORDS:
+            cands.append(f"{w} {words[i + 1]}")
+        for c in cands:
+            if len(c) >= 4 and c.lower() not in STOPWORDS and c.lower() not in seen and c in text:
+                seen.add(c.lower())
+                out.append(c)
+    return out
+
+class ScriptedVLM:
+    tensor_cache = None
+    embed_cache = None
+    profiler = None
+    model = None                      # no torch module: MemoryPlanner plans without a GPU budget
+
+    def __init__(self, model_id: str, device: str = "cpu", seed: int = 0, prefill_s_per_token: float = 0.0,
+                 decode_s_per_token: float = 0.0, oom_tokens: Optional[int] = None, fence_rate: float = 0.1,
+                 prose_rate: float = 0.1, max_items: int = 8, **_ignored):
+        # _ignored: wrapper options of the real families (perf_profile, pixel_budget, ...)
+        self.model_id = model_id
+        self.device = device
+        self.seed = seed
+        self.prefill_s_per_token = prefill_s_per_token
+        self.decode_s_per_token = decode_s_per_token
+        self.oom_tokens = oom_tokens
+        self.fence_rate = fence_rate
+        self.prose_rate = prose_rate
+        self.max_items = max_items
+        self.last_stats: Dict[str, float] = {}
+        self.n_calls = 0
+
+    def count_tokens(self, text: str) -> int:
+        return len(TOKEN_RE.findall(text))
+
+    def visual_tokens(self, image: Optional[Image.Image]) -> int:
+        """Qwen-like: one token per 28×28 patch, at most 1024."""
+        if image is None:
+            return 0
+        w, h = image.size
+        return min(1024, max(1, w // 28) * max(1, h // 28))
+
+    def _answer(self, image: Optional[Image.Image], prompt_text: str) -> str:
+        key = f"{self.model_id}|{self.seed}|{image.size if image is not None else None}|{prompt_text}"
+        rng = random.Random(hashlib.sha1(key.encode("utf-8")).hexdigest())
+        m = SLIDE_TEXT_RE.search(prompt_text)
+        slide_text = m.group(1) if m else prompt_text
+        terms = _terms(slide_text)
+        rng.shuffle(terms)
+        if '"triples"' in prompt_text:
+            triples = []
+            for s, o in zip(terms[0::2], terms[1::2]):
+                if len(triples) >= self.max_items:
+                    break
+                line = next((ln.strip() for ln in slide_text.splitlines() if s in ln), s)
+                triples.append({"s": s, "p": rng.choice(PREDICATES), "o": o,
+                                "modalities": ["text", "image"] if image is not None and rng.random() < 0.2 else ["text"],
+                                "confidence": round(rng.uniform(0.5, 0.99), 2), "evidence": line[:80]})
+            obj: Dict[str, Any] = {"triples": triples}
+        else:
+            picked = terms[:rng.randint(min(2, len(terms)), min(self.max_items, len(terms)))]
+            obj = {"concepts": [{"term": t, "category": rng.choice(CATEGORIES)} for t in picked],
+                   "evidence": picked[:2]}
+        text = json.dumps(obj, ensure_ascii=False, indent=2 if rng.random() < 0.5 else None)
+        if rng.random() < self.fence_rate:
+            text = f"```json\n{text}\n```"
+        if rng.random() < self.prose_rate:
+            text += "\n\nThese items are taken verbatim from the slide text."
+        return text
+
+    def _truncate(self, text: str, max_new_tokens: int) -> str:
+        toks = list(TOKEN_RE.finditer(text))
+        return text if len(toks) <= max_new_tokens else text[:toks[max_new_tokens - 1].end()]
+
+    def _run(self, images: List[Optional[Image.Image]], prompt_texts: List[str],
+             gen_kw: Dict[str, Any]) -> List[str]:
+        t0 = time.perf_counter()
+        with timed(self.profiler, "preprocess"):
+            max_new = int(gen_kw.get("max_new_tokens", 256))
+            prompt = [self.count_tokens(p) + self.visual_tokens(img) for img, p in zip(images, prompt_texts)]
+            total = sum(prompt) + max_new * len(prompt)
+            if self.oom_tokens is not None and total > self.oom_tokens:
+                raise RuntimeError(f"CUDA out of memory (scripted backend: {len(prompt)} sequences, "
+                                   f"{total} tokens > oom_tokens={self.oom_tokens})")
+        prep_s = time.perf_counter() - t0
+        with timed(self.profiler, "generate"):
+            outs = [self._truncate(self._answer(img, p), max_new) for img, p in zip(images, prompt_texts)]
+            new = [self.count_tokens(o) for o in outs]
+            delay = self.prefill_s_per_token * sum(prompt) + self.decode_s_per_token * max(new, default=0)
+            if delay > 0:
+                time.sleep(delay)
+        self.n_calls += 1
+        self.last_stats = {"prompt_tokens": sum(prompt), "new_tokens": sum(new), "preprocess_s": prep_s}
+        return outs
+
+    def generate(self, image: Optional[Image.Image], prompt_text: str, gen_kw: Dict[str, Any]) -> str:
+        return self._run([image], [prompt_text], gen_kw)[0]
+
+    def generate_batch(self, images: List[Optional[Image.Image]], prompt_texts: List[str],
+                       gen_kw: Dict[str, Any]) -> List[str]:
+        return self._run(images, prompt_texts, gen_kw)
@@ -1,5 +1,7 @@
 # shared_config.py
-import os, datetime
+import os
+
+from pipeline_logging import LOG_PATH, get_logger
 
 # Root = where this script is run from (Further Work)
 ROOT = os.path.abspath(".")
@@ -10,9 +12,25 @@ BY_SLIDE_DIR = os.path.join(DATA_DIR, "by_slide")
 ANALYSIS_DIR = os.path.join(DATA_DIR, "analysis")
 FUSION_DIR = os.path.join(DATA_DIR, "fusion")
 FUSION_PATH = os.path.join(FUSION_DIR, "fusion_multi_models.jsonl")
-LOG_PATH = os.path.join(ROOT, "pipeline.log")
+HUMAN_REF_DIR = os.path.join(DATA_DIR, "human_annotation_result_generation_code")
+# LOG_PATH (pipeline.jsonl under ROOT, or PIPELINE_LOG_PATH) comes from pipeline_logging.py
+
+# Concept/triple matching across models: "exact" (lowercased strings, original
+# behaviour) or "fuzzy" (normalized terms + approximate-match canonical ids,
+# see term_normalization.py). The fuzzy index is cached at TERM_INDEX_PATH.
+TERM_MATCHING = "exact"
+TERM_INDEX_PATH = os.path.join(ANALYSIS_DIR, "term_index.json")
+TERM_SIMILARITY = 0.85
+
+# Distributed extraction: one SQLite job row per (lecture, slide, model, prompt),
+# filled by enqueue_jobs.py and drained by queue_worker.py on any machine that
+# sees this filesystem.
+JOB_QUEUE_DB = os.path.join(DATA_DIR, "job_queue.sqlite")
+
+# Benchmark results (JSON, one file per run) and the synthetic corpus they run on.
+BENCHMARK_DIR = os.path.join(DATA_DIR, "benchmarks")
 
-for d in [DATA_DIR, BY_SLIDE_DIR, ANALYSIS_DIR, FUSION_DIR]:
+for d in [DATA_DIR, BY_SLIDE_DIR, ANALYSIS_DIR, FUSION_DIR, BENCHMARK_DIR]:
     os.makedirs(d, exist_ok=True)
 
 # Final 4 models to use everywhere
@@ -23,10 +41,6 @@ SELECTED_MODELS = [
     "Qwen__Qwen3-VL-4B-Instruct",
 ]
 
-def log_line(script: str, msg: str):
-    """Write a line to stdout and pipeline.log with timestamp + script name."""
-    ts = datetime.datetime.utcnow().isoformat()
-    line = f"[{ts}] [{script}] {msg}"
-    print(line)
-    with open(LOG_PATH, "a", encoding="utf-8") as f:
-        f.write(line + "\n")
+def log_line(script: str, msg: str, level=None, **fields):
+    """Print "[ts] [script] msg" and queue a JSON record (level, run_id, extra fields) for pipeline.jsonl."""
+    get_logger(LOG_PATH).log(script, msg, level, **fields)
@@ -0,0 +1,168 @@
+# streaming_stats.py
+import math
+from bisect import insort
+from typing import Dict, Iterable, List, Optional
+
+# ---------- P² quantile sketch ----------
+
+class P2Quantile:
+    """
+    P² single-quantile estimator (Jain & Chlamtac, 1985): five markers, O(1) memory.
+    The first exact_limit values are kept and answered exactly; the markers are
+    then seeded from that sorted sample. P² interpolates between markers, so on
+    heavily tied data (lots of 0.0 agreement scores) it drifts off the tied value
+    (e.g. ~1e-6 instead of a true median of 0.0); use ExactMedian there.
+    """
+
+    __slots__ = ("p", "count", "exact_limit", "buf", "q", "n", "np", "dn")
+
+    def __init__(self, p: float = 0.5, exact_limit: int = 512):
+        self.p = p
+        self.count = 0
+        self.exact_limit = max(exact_limit, 5)
+        self.buf: Optional[List[float]] = []
+        self.q: List[float] = []
+        self.n: List[int] = []
+        self.np: List[float] = []
+        self.dn = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def push(self, x: float) -> None:
+        self.count += 1
+        if self.buf is not None:
+            insort(self.buf, x)
+            if len(self.buf) > self.exact_limit:
+                self._seed_markers()
+            return
+
+        q, n = self.q, self.n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while k < 3 and x >= q[k + 1]:
+                k += 1
+
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.np[i] += self.dn[i]
+
+        for i in (1, 2, 3):
+            d = self.np[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                s = 1 if d > 0 else -1
+                qp = self._parabolic(i, s)
+                if not (q[i - 1] < qp < q[i + 1]):
+                    qp = q[i] + s * (q[i + s] - q[i]) / (n[i + s] - n[i])
+                q[i] = qp
+                n[i] += s
+
+    def _seed_markers(self) -> None:
+        buf = self.buf
+        last = len(buf) - 1
+        self.np = [last * f for f in self.dn]
+        self.n = [int(round(pos)) for pos in self.np]
+        for i in (1, 2, 3):  # keep marker positions strictly increasing
+            self.n[i] = min(max(self.n[i], self.n[i - 1] + 1), last - (4 - i))
+        self.q = [buf[i] for i in self.n]
+        self.buf = None
+
+    def _parabolic(self, i: int, s: int) -> float:
+        q, n = self.q, self.n
+        return q[i] + s / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + s) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - s) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self) -> float:
+        if self.count == 0:
+            return 0.0
+        if self.buf is not None:
+            # exact (linear-interpolated) quantile of the retained sample
+            pos = self.p * (len(self.buf) - 1)
+            lo = int(math.floor(pos))
+            hi = min(lo + 1, len(self.buf) - 1)
+            return self.buf[lo] + (pos - lo) * (self.buf[hi] - self.buf[lo])
+        return self.q[2]
+
+# ---------- exact median ----------
+
+class ExactMedian:
+    """
+    Exact median (np.median semantics: mean of the two middle values) from a
+    value -> count table. Ties share one entry, so the mostly-0.0 agreement
+    scores of a model pair stay small however many slides there are.
+    """
+
+    __slots__ = ("counts", "count")
+
+    def __init__(self):
+        self.counts: Dict[float, int] = {}
+        self.count = 0
+
+    def push(self, x: float) -> None:
+        self.counts[x] = self.counts.get(x, 0) + 1
+        self.count += 1
+
+    def value(self) -> float:
+        if self.count == 0:
+            return 0.0
+        lo_rank, hi_rank = (self.count - 1) // 2, self.count // 2
+        lo = hi = None
+        seen = 0
+        for v in sorted(self.counts):
+            seen += self.counts[v]
+            if lo is None and seen > lo_rank:
+                lo = v
+            if seen > hi_rank:
+                hi = v
+                break
+        return (lo + hi) / 2
+
+# ---------- running moments ----------
+
+class RunningStats:
+    """
+    Streaming sum/mean, Welford variance and a median for one metric.
+    The mean is total/n (same summation order as the batch path), so averages
+    match the non-streaming CSVs exactly. The median is exact by default
+    (ExactMedian); exact_median=False swaps in a constant-memory P² estimate.
+    """
+
+    __slots__ = ("n", "total", "_mean", "_m2", "_median")
+
+    def __init__(self, exact_median: bool = True):
+        self.n = 0
+        self.total = 0.0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._median = ExactMedian() if exact_median else P2Quantile(0.5)
+
+    def push(self, x: float) -> None:
+        self.n += 1
+        self.total += x
+        delta = x - self._mean
+        self._mean += delta / self.n
+        self._m2 += delta * (x - self._mean)
+        self._median.push(x)
+
+    def push_many(self, xs: Iterable[float]) -> None:
+        for x in xs:
+            self.push(x)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.n if self.n else 0.0
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation (0.0 with fewer than two values)."""
+        return math.sqrt(self._m2 / (self.n - 1)) if self.n > 1 else 0.0
+
+    @property
+    def median(self) -> float:
+        return self._median.value()
@@ -0,0 +1,77 @@
+# tensor_cache.py
+import hashlib, json, os, shutil
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+# Preprocessed image tensors (pixel values, grids, masks) per model, stored as
+# one .npy per tensor under <root>/<key[:2]>/<key>/ and loaded memory-mapped.
+# The key covers the model, its image-processor config, wrapper-specific
+# preprocessing settings and the decoded image itself, so a processor or
+# resolution change never serves stale tensors.
+
+def digest(*parts: Any) -> str:
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else str(p).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def image_digest(image) -> str:
+    """sha1 of a decoded PIL image (mode, size, pixels)."""
+    return digest(image.mode, image.size, image.tobytes())
+
+def config_digest(cfg: Any) -> str:
+    """Stable hash of a processor config (transformers objects expose to_json_string/to_dict)."""
+    for attr in ("to_json_string", "to_dict"):
+        fn = getattr(cfg, attr, None)
+        if callable(fn):
+            try:
+                out = fn()
+                return digest(out if isinstance(out, str) else json.dumps(out, sort_keys=True, default=str))
+            except Exception:
+                pass
+    return digest(repr(cfg))
+
+class TensorCache:
+    def __init__(self, root: str):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        d = self._dir(key)
+        try:
+            with open(os.path.join(d, "meta.json"), "r", encoding="utf-8") as f:
+                names = json.load(f)["tensors"]
+            # copy-on-write maps: pages are read lazily, callers may still write
+            out = {n: np.load(os.path.join(d, f"{n}.npy"), mmap_mode="c") for n in names}
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return out
+
+    def put(self, key: str, arrays: Dict[str, np.ndarray], meta: Optional[Dict[str, Any]] = None) -> None:
+        d = self._dir(key)
+        if os.path.isdir(d):
+            return
+        tmp = f"{d}.{os.getpid()}.tmp"
+        os.makedirs(tmp, exist_ok=True)
+        try:
+            for n, a in arrays.items():
+                np.save(os.path.join(tmp, f"{n}.npy"), np.ascontiguousarray(a))
+            with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump({"tensors": list(arrays), **(meta or {})}, f)
+            os.rename(tmp, d)
+        except OSError:
+            # another process published the same key first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def stats(self) -> str:
+        total = self.hits + self.misses
+        return f"{self.hits}/{total} hits" if total else "unused"
@@ -0,0 +1,364 @@
+# term_normalization.py
+import hashlib, json, os, re
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+from scipy import sparse
+
+from agreement_engine import Interner
+
+# ---------- lexical normalization ----------
+
+# Expansions so an acronym and its spelled-out form land on the same key
+ACRONYMS = {
+    "ct": "computed tomography",
+    "cbct": "cone beam computed tomography",
+    "mri": "magnetic resonance imaging",
+    "mr": "magnetic resonance",
+    "fmri": "functional magnetic resonance imaging",
+    "pet": "positron emission tomography",
+    "spect": "single photon emission computed tomography",
+    "oct": "optical coherence tomography",
+    "fbp": "filtered back projection",
+    "fft": "fast fourier transform",
+    "dft": "discrete fourier transform",
+    "ft": "fourier transform",
+    "snr": "signal to noise ratio",
+    "cnr": "contrast to noise ratio",
+    "psf": "point spread function",
+    "lsf": "line spread function",
+    "mtf": "modulation transfer function",
+    "dqe": "detective quantum efficiency",
+    "roi": "region of interest",
+    "cnn": "convolutional neural network",
+    "ai": "artificial intelligence",
+    "ml": "machine learning",
+    "dl": "deep learning",
+}
+
+_QUOTES = str.maketrans({"“": '"', "”": '"', "’": "'", "‘": "'",
+                         "‐": "-", "‑": "-", "–": "-", "—": "-"})
+_SEP_RE = re.compile(r"[\s\-_/]+")
+_TRAILING_PAREN_RE = re.compile(r"\s*\([^)]*\)\s*$")
+_EDGE_PUNCT = " \t\n\"'`.,;:!?()[]{}"
+
+# Words that look plural but are not (or whose singular would be wrong)
+_KEEP_S = {"physics", "mathematics", "dynamics", "optics", "electronics", "statistics",
+           "kinetics", "acoustics", "genomics", "radiomics", "lens", "bias", "gauss",
+           "ras", "series", "species", "data", "basis", "analysis", "diagnosis",
+           "axis", "thesis", "synthesis", "sinus", "focus", "radius", "locus",
+           "modulus", "stimulus", "thus", "plus", "minus", "status", "corpus", "versus",
+           "gas", "atlas", "canvas", "alias", "pancreas", "chaos", "cosmos", "ethos"}
+# Singulars ending in "-che" (their plurals look like "patches" / "branches")
+_CHE_STEMS = {"cache", "niche", "ache", "headache", "avalanche", "psyche", "cliche"}
+
+_IRREGULAR = {"analyses": "analysis", "diagnoses": "diagnosis", "axes": "axis",
+              "bases": "basis", "syntheses": "synthesis", "matrices": "matrix",
+              "indices": "index", "vertices": "vertex", "spectra": "spectrum",
+              "maxima": "maximum", "minima": "minimum", "criteria": "criterion",
+              "phenomena": "phenomenon", "nuclei": "nucleus", "foci": "focus"}
+
+def singularize(tok: str) -> str:
+    """Light rule-based lemmatizer for English plurals in technical terms."""
+    if tok in _IRREGULAR:
+        return _IRREGULAR[tok]
+    if len(tok) <= 3 or tok in _KEEP_S or not tok.isalpha():
+        return tok
+    if tok.endswith("ies") and len(tok) > 4:           # studies, frequencies
+        return tok[:-3] + "y"
+    if tok.endswith("ches") and tok[:-1] in _CHE_STEMS:   # caches, niches
+        return tok[:-1]
+    if tok.endswith(("sses", "shes", "ches", "xes")):  # losses, meshes, patches, boxes
+        return tok[:-2]
+    if tok.endswith("ses"):                            # lenses, biases, viruses / pulses, phases
+        stem = tok[:-2]
+        return stem if stem in _KEEP_S or stem.endswith(("us", "is")) else tok[:-1]
+    if tok.endswith(("ss", "us", "is")):
+        return tok
+    if tok.endswith("s"):
+        return tok[:-1]
+    return tok
+
+def normalize_term(s: str) -> str:
+    """Lowercase, fold quotes/dashes, drop trailing "(ACR)", singularize, expand acronyms."""
+    if not isinstance(s, str):
+        return ""
+    t = s.translate(_QUOTES).lower().strip(_EDGE_PUNCT)
+    stripped = _TRAILING_PAREN_RE.sub("", t)
+    if stripped:
+        t = stripped
+    toks = [singularize(x) for x in _SEP_RE.split(t) if x]
+    t = " ".join(toks)
+    return ACRONYMS.get(t.replace(" ", ""), t)
+
+def match_key(s: str) -> str:
+    """Separator-free key: "back-projection" / "back projection" / "backprojection" collide."""
+    return normalize_term(s).replace(" ", "")
+
+# ---------- approximate-match index ----------
+
+# Bumped whenever the merge or normalization rules change, so cached indexes built under old rules are rebuilt
+MERGE_RULES = 3
+# Endings that only inflect a shared stem (plurals are already folded by singularize);
+# derivational ones ("scatter" / "scatterer", "photograph" / "photography") change the meaning
+_INFLECTIONS = {"", "e", "d", "ed", "es", "ing"}
+
+def _interior_edit(a: str, b: str) -> bool:
+    """At most one substituted / inserted / deleted letter, not the last one ("photograph" / "photography")."""
+    if abs(len(a) - len(b)) > 1:
+        return False
+    i = 0
+    while i < min(len(a), len(b)) and a[i] == b[i]:
+        i += 1
+    if i >= max(len(a), len(b)) - 1:
+        return False
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return (a[i:] == b[i + 1:]) if len(b) > len(a) else (a[i + 1:] == b[i:])
+
+def variant_tokens(a: str, b: str) -> bool:
+    """
+    True when two tokens are spellings / inflections of one word: a shared stem
+    with inflectional endings ("filtered" / "filtering", "image" / "imaging") or
+    a single-letter edit ("colour" / "color"). Never for an added prefix
+    ("unfiltered" / "filtered", "nonlinear" / "linear"), different numbers or
+    short tokens ("t1" / "t2"), or stems that part early ("hyper" / "hypo").
+    """
+    if a == b:
+        return True
+    if min(len(a), len(b)) < 4 or any(ch.isdigit() for ch in a + b):
+        return False
+    if a.endswith(b) or b.endswith(a):
+        return False
+    stem = 0
+    while stem < min(len(a), len(b)) and a[stem] == b[stem]:
+        stem += 1
+    if stem >= 4 and a[stem:] in _INFLECTIONS and b[stem:] in _INFLECTIONS:
+        return True
+    return stem > 0 and min(len(a), len(b)) >= 5 and _interior_edit(a, b)
+
+def variant_terms(a: str, b: str) -> bool:
+    """Normalized terms with the same number of tokens, each pair of tokens a variant_tokens() match."""
+    ta, tb = a.split(), b.split()
+    return len(ta) == len(tb) and all(variant_tokens(x, y) for x, y in zip(ta, tb))
+
+def char_ngrams(key: str, n: int = 3) -> List[str]:
+    padded = " " * (n - 1) + key + " "
+    return [padded[i:i + n] for i in range(len(padded) - n + 1)]
+
+class TermIndex:
+    """
+    Corpus-wide canonical ids for concept strings. Terms are grouped by match_key;
+    keys whose character-trigram Dice similarity reaches `threshold` are merge
+    candidates, and a candidate pair is merged (union-find) only if the terms
+    are token-by-token spelling / inflection variants (variant_terms), so
+    "unfiltered back projection" stays apart from "filtered back projection".
+    Each group's canonical form is its most frequent normalized surface. Keys
+    shorter than min_fuzzy_len only match exactly.
+    """
+
+    def __init__(self, threshold: float = 0.85, min_fuzzy_len: int = 6):
+        self.threshold = threshold
+        self.min_fuzzy_len = min_fuzzy_len
+        self.key_to_cid: Dict[str, int] = {}
+        self.canonical_forms: List[str] = []
+        self.fingerprint: str = ""
+
+    # --- build ---
+
+    def build(self, terms: Iterable[str], chunk: int = 2048) -> "TermIndex":
+        surface_counts: Counter = Counter()
+        for t in terms:
+            norm = normalize_term(t)
+            if norm:
+                surface_counts[norm] += 1
+
+        keys = sorted({n.replace(" ", "") for n in surface_counts})
+        kid = {k: i for i, k in enumerate(keys)}
+        # tokenized surfaces per key ("back projection" and "backprojection" share a key)
+        surfaces: Dict[int, List[str]] = {}
+        for norm in surface_counts:
+            surfaces.setdefault(kid[norm.replace(" ", "")], []).append(norm)
+        parent = list(range(len(keys)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        fuzzy = [i for i, k in enumerate(keys) if len(k) >= self.min_fuzzy_len]
+        if len(fuzzy) > 1:
+            grams = Interner()
+            rows, cols = [], []
+            for r, i in enumerate(fuzzy):
+                g = set(grams.intern_many(char_ngrams(keys[i])))
+                rows.extend([r] * len(g))
+                cols.extend(g)
+            T = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, cols)),
+                                  shape=(len(fuzzy), len(grams)))
+            sizes = np.asarray(T.sum(axis=1)).ravel()
+            TT = T.T.tocsr()
+            for lo in range(0, len(fuzzy), chunk):
+                S = (T[lo:lo + chunk] @ TT).tocoo()
+                r, c, shared = S.row + lo, S.col, S.data
+                upper = c > r
+                r, c, shared = r[upper], c[upper], shared[upper]
+                dice = 2.0 * shared / (sizes[r] + sizes[c])
+                for a, b in zip(r[dice >= self.threshold].tolist(), c[dice >= self.threshold].tolist()):
+                    ka, kb = fuzzy[a], fuzzy[b]
+                    if not any(variant_terms(x, y) for x in surfaces[ka] for y in surfaces[kb]):
+                        continue
+                    ra, rb = find(ka), find(kb)
+                    if ra != rb:
+                        parent[max(ra, rb)] = min(ra, rb)
+
+        # canonical surface per group: most frequent, then shortest, then alphabetical
+        best: Dict[int, str] = {}
+        for norm, cnt in surface_counts.items():
+            root = find(kid[norm.replace(" ", "")])
+            cur = best.get(root)
+            if cur is None or (-cnt, len(norm), norm) < (-surface_counts[cur], len(cur), cur):
+                best[root] = norm
+
+        cid_of_root: Dict[int, int] = {}
+        self.canonical_forms = []
+        self.key_to_cid = {}
+        for i, k in enumerate(keys):
+            root = find(i)
+            if root not in cid_of_root:
+                cid_of_root[root] = len(self.canonical_forms)
+                self.canonical_forms.append(best[root])
+            self.key_to_cid[k] = cid_of_root[root]
+        return self
+
+    # --- lookup ---
+
+    def canonical_id(self, term: str) -> Optional[int]:
+        return self.key_to_cid.get(match_key(term))
+
+    def canonical(self, term: str) -> str:
+        """Canonical form of a term; unseen terms fall back to their normalized form."""
+        cid = self.canonical_id(term)
+        return self.canonical_forms[cid] if cid is not None else normalize_term(term)
+
+    def canonical_triple(self, key: str) -> str:
+        """Canonicalize subject/object of an "s||p||o" key (predicate is only lowercased)."""
+        parts = key.split("||")
+        if len(parts) != 3:
+            return key
+        s, p, o = parts
+        return f"{self.canonical(s) if s else s}||{p.strip().lower()}||{self.canonical(o) if o else o}"
+
+    def n_merged(self) -> int:
+        """How many distinct keys were folded into another key's group."""
+        return len(self.key_to_cid) - len(self.canonical_forms)
+
+    # --- cache ---
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "fingerprint": self.fingerprint,
+                "merge_rules": MERGE_RULES,
+                "threshold": self.threshold,
+                "min_fuzzy_len": self.min_fuzzy_len,
+                "canonical_forms": self.canonical_forms,
+                "key_to_cid": self.key_to_cid,
+            }, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["TermIndex"]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                d = json.load(f)
+        except Exception:
+            return None
+        if d.get("merge_rules") != MERGE_RULES:
+            return None
+        idx = cls(threshold=d.get("threshold", 0.85), min_fuzzy_len=d.get("min_fuzzy_len", 6))
+        idx.fingerprint = d.get("fingerprint", "")
+        idx.canonical_forms = d.get("canonical_forms", [])
+        idx.key_to_cid = d.get("key_to_cid", {})
+        return idx
+
+class CanonicalInterner(Interner):
+    """Interner that maps every string through canon_fn first (canonical ids, computed once)."""
+
+    def __init__(self, canon_fn: Callable[[str], str]):
+        super().__init__()
+        self.canon_fn = canon_fn
+        self._memo: Dict[str, int] = {}
+
+    def intern(self, s: str) -> int:
+        i = self._memo.get(s)
+        if i is None:
+            i = super().intern(self.canon_fn(s))
+            self._memo[s] = i
+        return i
+
+def tree_fingerprint(base: str) -> str:
+    """Cheap change detector for a directory tree (relative path, size, mtime)."""
+    h = hashlib.sha1()
+    for dirpath, _, files in sorted(os.walk(base)):
+        for fn in sorted(files):
+            try:
+                st = os.stat(os.path.join(dirpath, fn))
+            except OSError:
+                continue
+            rel = os.path.relpath(os.path.join(dirpath, fn), base)
+            h.update(f"{rel}|{st.st_size}|{st.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+# ---------- self-check ----------
+
+# (term, singular) pairs normalize_term must fold
+KNOWN_PLURALS = [
+    ("lenses", "lens"), ("biases", "bias"), ("caches", "cache"), ("gases", "gas"),
+    ("atlases", "atlas"), ("canvases", "canvas"), ("atlas", "atlas"), ("chaos", "chaos"),
+    ("pulses", "pulse"), ("phases", "phase"), ("patches", "patch"), ("losses", "loss"),
+    ("viruses", "virus"), ("ratios", "ratio"), ("cameras", "camera"),
+]
+
+# Pairs that must keep separate canonical ids (different meanings) and pairs that must merge
+KNOWN_DISTINCT = [
+    ("filtered back projection", "unfiltered back projection"),
+    ("T1-weighted image", "T2-weighted image"),
+    ("T1 relaxation", "T2 relaxation"),
+    ("linear system", "nonlinear system"),
+    ("homogeneous field", "inhomogeneous field"),
+    ("hyperintense lesion", "hypointense lesion"),
+    ("point scatter", "point scatterer"),
+    ("confocal microscope", "confocal microscopy"),
+    ("high resolution image", "higher resolution image"),
+    ("invasive imaging", "noninvasive imaging"),
+    ("1D Fourier transform", "2D Fourier transform"),
+    ("spin echo", "gradient echo"),
+]
+KNOWN_VARIANTS = [
+    ("filtered back projection", "filtered backprojections"),
+    ("normalised cross correlation", "normalized cross-correlation"),
+    ("image reconstructions", "image reconstruction"),
+    ("modelling error", "modeling error"),
+    ("point spread function", "point-spread functions"),
+    ("iterative reconstruction method", "iterative reconstructions methods"),
+]
+
+if __name__ == "__main__":
+    idx = TermIndex().build([t for pair in KNOWN_DISTINCT + KNOWN_VARIANTS for t in pair])
+    bad = [(a, b) for a, b in KNOWN_DISTINCT if idx.canonical_id(a) == idx.canonical_id(b)]
+    missed = [(a, b) for a, b in KNOWN_VARIANTS if idx.canonical_id(a) != idx.canonical_id(b)]
+    plurals = [(a, b) for a, b in KNOWN_PLURALS if normalize_term(a) != b]
+    for a, b in bad:
+        print(f"❌ merged: {a!r} / {b!r} -> {idx.canonical(a)!r}")
+    for a, b in missed:
+        print(f"❌ not merged: {a!r} / {b!r}")
+    for a, b in plurals:
+        print(f"❌ normalized: {a!r} -> {normalize_term(a)!r}, expected {b!r}")
+    print(f"{'✅' if not bad and not missed and not plurals else '❌'} {len(KNOWN_DISTINCT)} distinct pairs, "
+          f"{len(KNOWN_VARIANTS)} variant pairs, {len(KNOWN_PLURALS)} plurals checked")
+    raise SystemExit(1 if bad or missed or plurals else 0)